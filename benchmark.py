@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+"""
+benchmark.py
+
+Micro-benchmarks for the fitness functions, mutators, crossovers and
+selectors.
+
+Each operator is timed over a sweep of pattern lengths and instrument counts
+and, for the operators that work on whole populations (batch fitness forms,
+batch mutators and crossovers, and selectors), population sizes.  Patterns
+are scored against synthetic trajectories, so no database is needed, and the
+random number generators are reseeded before every measurement so runs are
+repeatable.
+
+For each operator the benchmark reports the number of calls per second and
+the number of objects allocated per call.  Python 2 has no allocation
+counter, so allocations are counted as the growth of the garbage collector's
+list of container objects while the collector is disabled and the results of
+the calls are kept.  That counts the objects each call leaves behind, such
+as copied organisms and their genes, including objects reused from the
+interpreter's free lists, but not temporaries freed within the call, or
+strings, numbers and array data.
+
+Batch mutators change genomes in place, so each one works on its own copy
+of the benchmark genomes and the operators timed after it see the same
+genomes whichever groups are run.
+"""
+import gc
+import random
+import RandomArray
+import Numeric
+from optparse import OptionParser
+from timeit import default_timer
+from genome import GENOME_TYPECODE
+from registry import fitness_functions, mutators, crossovers, selectors
+from evaluator import CompiledTrajectory
+from selector import IndexedCandidate
+from pattern import PatternGene, PatternOrganism, PackedPatternOrganism
+
+FITNESS, MUTATOR, CROSSOVER, SELECTOR = "fitness", "mutator", "crossover", "selector"
+GROUPS = (FITNESS, MUTATOR, CROSSOVER, SELECTOR)
+
+# Selectors driven by an external process instead of fitness values.
+SKIPPED_SELECTORS = ("SpeaSelector",)
+
+# The number of calls whose allocations are counted.
+ALLOCATION_CALLS = 50
+
+
+def synthetic_trajectories(length, instrument_length):
+    """
+    Build a trajectory for each fitness function from random expected values.
+
+    @param int length
+    @param int instrument_length
+    @return list CompiledTrajectory objects
+    """
+    rows = range(instrument_length)
+    return [CompiledTrajectory("temporal_beat_density",
+                               [(i, random.uniform(0, instrument_length))
+                                for i in xrange(length)]),
+            CompiledTrajectory("instrument_beat_density",
+                               [(i, random.randint(0, length)) for i in rows]),
+            CompiledTrajectory("unison",
+                               random.sample(rows, max(2, instrument_length / 2))),
+            CompiledTrajectory("double_rhythms", [],
+                               ",".join([str(i) for i in rows[1:]]), 0)]
+
+def configure(species, length, instrument_length):
+    """
+    Configure an organism class for the given pattern dimensions.
+
+    @param class species PatternOrganism or PackedPatternOrganism
+    @param int length
+    @param int instrument_length
+    @return class the species
+    """
+    species.mutProb = 1.0
+    species.crossoverRate = 1.0
+    species.instrument_length = instrument_length
+    species.instruments = range(instrument_length)
+    species.length = length
+    species.crossover = None
+    species.mutators = []
+    species.limit_mutation = False
+    species.mutateOneOnly = False
+    species.trajectory_set = synthetic_trajectories(length, instrument_length)
+    species.gene = PatternGene
+    species.fitness_cache = None
+    species.compile()
+    return species
+
+def reseed(seed):
+    random.seed(seed)
+    RandomArray.seed(seed, seed + 1)
+
+def count_allocations(operation, calls=ALLOCATION_CALLS):
+    """
+    @param function operation
+    @param int calls
+    @return float the container objects created and not freed by each call,
+                  including its result
+
+    >>> count_allocations(lambda: [1, 2])
+    1.0
+    >>> count_allocations(lambda: None)
+    0.0
+    """
+    results = []
+    gc.collect()
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        # The object counter of gc.get_count is not incremented for
+        # objects reused from free lists, so count the tracked objects.
+        before = len(gc.get_objects())
+        for i in xrange(calls):
+            results.append(operation())
+        after = len(gc.get_objects())
+    finally:
+        if enabled:
+            gc.enable()
+    return (after - before) / float(calls)
+
+def measure(operation, seed, min_time=0.1):
+    """
+    Call an operation until the calls take at least min_time seconds.
+
+    @param function operation
+    @param int seed
+    @param float min_time
+    @return tuple calls per second and allocations per call
+    """
+    reseed(seed)
+    calls = 1
+    while True:
+        started = default_timer()
+        for i in xrange(calls):
+            operation()
+        elapsed = default_timer() - started
+        if elapsed >= min_time:
+            break
+        if elapsed > 0:
+            calls = max(calls * 2, int(calls * min_time / elapsed * 1.2))
+        else:
+            calls *= 10
+
+    reseed(seed)
+    return calls / elapsed, count_allocations(operation)
+
+
+def make_organism(species, genes):
+    """
+    @param class species
+    @param array genes the genome of packed species' organisms; organisms with
+                       gene objects get random genes
+    @return PatternOrganism
+    """
+    if hasattr(species, 'fromGenes'):
+        return species.fromGenes(genes.copy())
+    return species()
+
+def fitness_operations(species, genomes):
+    """
+    @return list (name, operation) pairs for each form of each fitness function
+    """
+    organism = make_organism(species, genomes[0])
+    row = random.randint(0, species.instrument_length - 1)
+    column = random.randint(0, species.length - 1)
+    changes = [(row, column, organism.getGene(row, column))]
+
+    operations = []
+    for trajectory in species.trajectory_set:
+        function = fitness_functions.resolve(trajectory.function.name)
+        name = trajectory.function.name
+        operations.append((name, lambda f=function, t=trajectory: f(organism, t)))
+        if hasattr(function, 'batch'):
+            operations.append(("%s batch" % name,
+                               lambda f=function, t=trajectory: f.batch(genomes, t)))
+        if hasattr(function, 'partials') and hasattr(function, 'delta'):
+            partials = function.partials(organism, trajectory)[1]
+            operations.append(("%s delta" % name,
+                               lambda f=function, t=trajectory, p=partials:
+                               f.delta(organism, t, p, changes)))
+    return operations
+
+def mutator_operations(species, genomes):
+    organism = make_organism(species, genomes[0])
+    count = Numeric.shape(genomes)[0]
+    indices = range(count)
+
+    operations = []
+    for name in mutators.names():
+        mutator = mutators.resolve(name)
+        operations.append((name, lambda m=mutator: m(organism.copy()).mutate()))
+        if hasattr(mutator, 'mutateBatch') and hasattr(species, 'fromGenes'):
+            operations.append(("%s batch" % name,
+                               lambda m=mutator, g=genomes.copy():
+                               m.mutateBatch(species, g, indices)))
+    return operations
+
+def crossover_operations(species, genomes):
+    parent1 = make_organism(species, genomes[0])
+    parent2 = make_organism(species, genomes[1])
+    count = Numeric.shape(genomes)[0]
+    parents1 = RandomArray.randint(0, count, (count / 2,))
+    parents2 = RandomArray.randint(0, count, (count / 2,))
+
+    operations = []
+    for name in crossovers.names():
+        crossover = crossovers.resolve(name)()
+        operations.append((name, lambda c=crossover: c.mate(parent1, parent2)))
+        if hasattr(crossover, 'mateBatch'):
+            operations.append(("%s batch" % name,
+                               lambda c=crossover: c.mateBatch(genomes, parents1, parents2)))
+    return operations
+
+def selector_operations(count):
+    fitnesses = RandomArray.random((count,)) * 100.0
+    candidates = [IndexedCandidate(i, fitness)
+                  for i, fitness in enumerate(fitnesses.tolist())]
+
+    operations = []
+    for name in selectors.names():
+        if name in SKIPPED_SELECTORS:
+            continue
+        selector = selectors.resolve(name)()
+        operations.append((name, lambda s=selector: s.select(candidates, count)))
+        operations.append(("%s indices" % name,
+                           lambda s=selector: s.selectIndices(fitnesses, count)))
+    return operations
+
+
+def run(groups, lengths, instrument_lengths, population_sizes, species,
+        seed=1, min_time=0.1, report=None):
+    """
+    Time every operator of the given groups over the sweep.
+
+    @param list groups a subset of GROUPS
+    @param list lengths pattern lengths
+    @param list instrument_lengths instrument counts
+    @param list population_sizes
+    @param class species PatternOrganism or PackedPatternOrganism
+    @param int seed
+    @param float min_time the minimum seconds spent timing each operator
+    @param function report called with each result as it is measured
+    @return list a dict for each measurement
+    """
+    results = []
+    def record(group, name, length, instrument_length, population_size, operation):
+        calls, allocations = measure(operation, seed, min_time)
+        result = {'group': group,
+                  'name': name,
+                  'length': length,
+                  'instruments': instrument_length,
+                  'population': population_size,
+                  'calls_per_second': calls,
+                  'allocations_per_call': allocations}
+        results.append(result)
+        if report is not None:
+            report(result)
+
+    for length in lengths:
+        for instrument_length in instrument_lengths:
+            for population_size in population_sizes:
+                reseed(seed)
+                configure(species, length, instrument_length)
+                genomes = RandomArray.randint(0, 2, (population_size, instrument_length,
+                                                     length)).astype(GENOME_TYPECODE)
+
+                operations = []
+                if FITNESS in groups:
+                    operations.extend([(FITNESS, name, operation) for name, operation
+                                       in fitness_operations(species, genomes)])
+                if MUTATOR in groups:
+                    operations.extend([(MUTATOR, name, operation) for name, operation
+                                       in mutator_operations(species, genomes)])
+                if CROSSOVER in groups:
+                    operations.extend([(CROSSOVER, name, operation) for name, operation
+                                       in crossover_operations(species, genomes)])
+
+                # Operators on single organisms do not depend on the
+                # population size, so they are timed once.
+                for group, name, operation in operations:
+                    if population_size == population_sizes[0] or \
+                       name.endswith(" batch"):
+                        record(group, name, length, instrument_length,
+                               population_size, operation)
+
+    if SELECTOR in groups:
+        for population_size in population_sizes:
+            reseed(seed)
+            for name, operation in selector_operations(population_size):
+                record(SELECTOR, name, None, None, population_size, operation)
+
+    return results
+
+def format_result(result):
+    """
+    @param dict result
+    @return string a line of the benchmark report
+    """
+    return "%-10s %-40s %6s %6s %6s %14.1f %10.2f" % (
+        result['group'], result['name'],
+        result['length'] or "-", result['instruments'] or "-",
+        result['population'] or "-",
+        result['calls_per_second'], result['allocations_per_call'])
+
+def split_integers(values):
+    return [int(value) for value in values.split(",")]
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-g", "--groups",
+                      dest="groups", type="string", default=",".join(GROUPS),
+                      help="comma separated operator groups to time: %s" %
+                           ", ".join(GROUPS))
+    parser.add_option("-l", "--lengths",
+                      dest="lengths", type="string", default="8,16,32,64,128,256",
+                      help="comma separated pattern lengths")
+    parser.add_option("-i", "--instruments",
+                      dest="instruments", type="string", default="2,4,8,16,32",
+                      help="comma separated instrument counts")
+    parser.add_option("-p", "--populations",
+                      dest="populations", type="string", default="16,64,256",
+                      help="comma separated population sizes")
+    parser.add_option("-s", "--seed",
+                      dest="seed", type="int", default=1,
+                      help="the random seed used for every measurement")
+    parser.add_option("-t", "--min-time",
+                      dest="min_time", type="float", default=0.1,
+                      help="the minimum number of seconds to time each operator")
+    parser.add_option("--genes",
+                      dest="genes", action="store_true", default=False,
+                      help="time organisms with gene objects instead of packed\
+                            genomes")
+    (options, args) = parser.parse_args()
+
+    if options.genes:
+        species = PatternOrganism
+    else:
+        species = PackedPatternOrganism
+
+    groups = [group.strip() for group in options.groups.split(",")]
+    for group in groups:
+        if group not in GROUPS:
+            parser.error("Unknown operator group: %s" % group)
+
+    print "%-10s %-40s %6s %6s %6s %14s %10s" % ("group", "operator", "length",
+                                                 "instr", "pop", "calls/s",
+                                                 "allocs")
+    def report(result):
+        print format_result(result)
+
+    run(groups, split_integers(options.lengths), split_integers(options.instruments),
+        split_integers(options.populations), species, options.seed,
+        options.min_time, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+"""
+benchmark_generations.py
+
+End to end benchmark of whole generations.
+
+Runs PatternPopulation.gen and MultiObjectiveDictPopulation.gen for a fixed
+number of generations on synthetic patterns (see benchmark.py) and records
+generations per second, evaluations per second and the peak resident set
+size of each run.  Each run is made in its own process so the peak memory of
+one run does not hide that of the next.  The multiobjective population is
+driven by pisa.LocalSelector instead of a PISA selector process, and only
+the time spent in gen is measured.
+
+Results are compared with a baseline file, and any result that is slower or
+larger than its baseline by more than the tolerance is reported as a
+regression.  The first run, or a run with --save, writes the baseline.
+"""
+import os
+import sys
+import json
+import shutil
+import tempfile
+import resource
+from optparse import OptionParser
+from timeit import default_timer
+import pisa
+from benchmark import configure, reseed
+from crossover import OnePointCrossover
+from selector import TournamentSelector
+from evaluator import make_evaluator
+from pattern import PatternPopulation, PatternOrganism, PackedPatternOrganism, \
+     MultiObjectiveDictPopulation, MultiObjectivePatternOrganism, \
+     MultiObjectivePackedPatternOrganism
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Synthetic pattern specs: length, instrument count and population size.
+SPECS = {'small': (16, 8, 1000),
+         'large': (64, 16, 10000)}
+
+PATTERN, MULTIOBJECTIVE = "pattern", "multiobjective"
+POPULATIONS = (PATTERN, MULTIOBJECTIVE)
+
+# Measurements compared with the baseline, and whether larger values are
+# better.
+MEASUREMENTS = (('generations_per_second', True),
+                ('evaluations_per_second', True),
+                ('peak_rss_kb', False))
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+
+def configure_species(species, length, instrument_length):
+    configure(species, length, instrument_length)
+    species.mutProb = 0.5
+    species.crossoverRate = 0.9
+    species.crossover = OnePointCrossover()
+    species.mutators = ["ClassicMutator"]
+    species.compile()
+    return species
+
+def run_pattern(length, instrument_length, size, generations, packed=True,
+                processes=0):
+    """
+    @return tuple the number of evaluations and the seconds spent in gen
+    """
+    if packed:
+        species = PackedPatternOrganism
+    else:
+        species = PatternOrganism
+    configure_species(species, length, instrument_length)
+
+    evaluator = None
+    if processes > 0:
+        evaluator = make_evaluator(species, processes)
+    PatternPopulation.selector = TournamentSelector()
+    PatternPopulation.evaluator = evaluator
+
+    # Breed half a population of children each generation and keep the
+    # population size constant.
+    population = PatternPopulation(init=size, species=species)
+    population.childCount = max(1, size / 4)
+    population.survivorCount = size
+    population.sort()
+
+    started = default_timer()
+    for i in xrange(generations):
+        population.gen()
+    elapsed = default_timer() - started
+
+    if evaluator is not None:
+        evaluator.close()
+    return generations * 2 * population.childCount, elapsed
+
+def run_multiobjective(length, instrument_length, size, generations, packed=True,
+                       processes=0):
+    """
+    @return tuple the number of evaluations and the seconds spent in gen
+    """
+    if packed:
+        species = MultiObjectivePackedPatternOrganism
+    else:
+        species = MultiObjectivePatternOrganism
+    configure_species(species, length, instrument_length)
+
+    evaluator = None
+    if processes > 0:
+        evaluator = make_evaluator(species, processes)
+
+    directory = tempfile.mkdtemp()
+    try:
+        prefix = os.path.join(directory, "PISA_")
+        children = max(2, size / 2)
+        pisa.write_configuration_file(prefix + pisa.files['configuration'],
+                                      {'alpha': size, 'mu': children,
+                                       'lambda': children, 'dim': 0})
+
+        population = MultiObjectiveDictPopulation(prefix, 0.01,
+                                                  len(species.trajectory_set),
+                                                  children, None, species=species,
+                                                  evaluator=evaluator)
+        selector = pisa.LocalSelector(prefix)
+
+        elapsed = 0.0
+        for i in xrange(generations):
+            selector.step()
+            started = default_timer()
+            population.gen()
+            elapsed += default_timer() - started
+        # Keep the population from writing to the PISA files once they are
+        # removed.
+        population.state = pisa.STATE_4
+    finally:
+        shutil.rmtree(directory)
+
+    if evaluator is not None:
+        evaluator.close()
+    return generations * children, elapsed
+
+def measure(kind, spec, generations, packed=True, processes=0, seed=1):
+    """
+    @param string kind PATTERN or MULTIOBJECTIVE
+    @param string spec a key of SPECS
+    @return dict the run's measurements
+    """
+    reseed(seed)
+    length, instrument_length, size = SPECS[spec]
+    if kind == PATTERN:
+        run = run_pattern
+    else:
+        run = run_multiobjective
+
+    evaluations, elapsed = run(length, instrument_length, size, generations,
+                               packed, processes)
+    return {'generations_per_second': generations / elapsed,
+            'evaluations_per_second': evaluations / elapsed,
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def _measure_process(results, *args):
+    results.put(measure(*args))
+
+def measure_isolated(*args):
+    """
+    Measure a run in a new process so its peak memory is its own.
+    """
+    if multiprocessing is None:
+        return measure(*args)
+
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_measure_process,
+                                      args=(results,) + args)
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def regressions(results, baseline, tolerance):
+    """
+    @param dict results measurements by run name
+    @param dict baseline measurements by run name
+    @param float tolerance the allowed fraction a measurement may worsen by
+    @return list a description of each regression
+    """
+    found = []
+    for name, result in results.items():
+        if not baseline.has_key(name):
+            continue
+        for measurement, larger_is_better in MEASUREMENTS:
+            value = result[measurement]
+            expected = baseline[name][measurement]
+            if larger_is_better:
+                regressed = value < expected * (1 - tolerance)
+            else:
+                regressed = value > expected * (1 + tolerance)
+            if regressed:
+                found.append("%s %s: %.1f, baseline %.1f" % (name, measurement,
+                                                             value, expected))
+    return found
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-s", "--specs",
+                      dest="specs", type="string", default="small",
+                      help="comma separated pattern specs: %s" %
+                           ", ".join(["%s (%ix%i, %i organisms)" % ((name,) + SPECS[name])
+                                      for name in sorted(SPECS.keys())]))
+    parser.add_option("-p", "--populations",
+                      dest="populations", type="string", default=",".join(POPULATIONS),
+                      help="comma separated populations to run: %s" %
+                           ", ".join(POPULATIONS))
+    parser.add_option("-g", "--generations",
+                      dest="generations", type="int", default=5,
+                      help="the number of generations of each run")
+    parser.add_option("-b", "--baseline",
+                      dest="baseline", type="string", default=DEFAULT_BASELINE,
+                      help="the baseline file")
+    parser.add_option("-t", "--tolerance",
+                      dest="tolerance", type="float", default=0.1,
+                      help="the fraction a measurement may worsen by before it\
+                            is reported as a regression")
+    parser.add_option("--save",
+                      dest="save", action="store_true", default=False,
+                      help="write the results to the baseline file")
+    parser.add_option("--genes",
+                      dest="genes", action="store_true", default=False,
+                      help="use organisms with gene objects instead of packed\
+                            genomes")
+    parser.add_option("-j", "--processes",
+                      dest="processes", type="int", default=0,
+                      help="evaluate fitness with this many processes")
+    parser.add_option("--seed",
+                      dest="seed", type="int", default=1,
+                      help="the random seed of every run")
+    (options, args) = parser.parse_args()
+
+    results = {}
+    for spec in options.specs.split(","):
+        if not SPECS.has_key(spec):
+            parser.error("Unknown pattern spec: %s" % spec)
+        for kind in options.populations.split(","):
+            if kind not in POPULATIONS:
+                parser.error("Unknown population: %s" % kind)
+
+            name = "%s %s" % (spec, kind)
+            result = results[name] = measure_isolated(kind, spec, options.generations,
+                                                      not options.genes,
+                                                      options.processes, options.seed)
+            print "%-25s %10.3f gens/s %12.1f evals/s %10i KB" % (
+                name, result['generations_per_second'],
+                result['evaluations_per_second'], result['peak_rss_kb'])
+
+    baseline = {}
+    if os.path.exists(options.baseline):
+        f = open(options.baseline)
+        try:
+            baseline = json.load(f)
+        finally:
+            f.close()
+
+    found = regressions(results, baseline, options.tolerance)
+    for regression in found:
+        print "Regression: %s" % regression
+
+    if options.save or not baseline:
+        baseline.update(results)
+        f = open(options.baseline, "w")
+        try:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+        print "Wrote %s" % options.baseline
+
+    if found:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+cache.py
+
+Bounded least recently used cache for fitness values.
+
+Organisms with identical genomes have identical fitness, so objective values
+are cached by genome key (see genome.genome_key) and shared by every organism
+in a run.  The cache stores the raw value of each fitness trajectory, which
+lets single objective organisms average them and multiobjective organisms use
+them as a fitness vector.
+"""
+
+# Positions of the fields in each linked list entry.
+PREVIOUS, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class FitnessCache(object):
+    """
+    Maps genome keys to objective values, evicting the least recently used
+    entry once the cache holds maxsize entries.
+    """
+    def __init__(self, maxsize=10000):
+        """
+        @param int maxsize the maximum number of entries to keep
+        """
+        self.maxsize = maxsize
+        self.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._entries.has_key(key)
+
+    def clear(self):
+        """
+        Remove every entry and reset the hit and miss counters.
+        """
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+        # Entries form a circular doubly linked list ordered from least to
+        # most recently used, starting after the root entry.
+        self._root = root = [None, None, None, None]
+        root[PREVIOUS] = root[NEXT] = root
+
+    def get(self, key):
+        """
+        @param string key
+        @return mixed the cached value or None if the key is not cached
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._unlink(entry)
+        self._append(entry)
+        return entry[VALUE]
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entry if the cache
+        is full.
+
+        @param string key
+        @param mixed value
+        @return mixed the value
+        """
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry[VALUE] = value
+            self._unlink(entry)
+            self._append(entry)
+            return value
+
+        if self.maxsize <= 0:
+            return value
+
+        if len(self._entries) >= self.maxsize:
+            oldest = self._root[NEXT]
+            self._unlink(oldest)
+            del self._entries[oldest[KEY]]
+
+        entry = [None, None, key, value]
+        self._append(entry)
+        self._entries[key] = entry
+        return value
+
+    def stats(self):
+        """
+        @return dict the cache's size and hit and miss counts
+        """
+        lookups = self.hits + self.misses
+        if lookups > 0:
+            hit_rate = float(self.hits) / lookups
+        else:
+            hit_rate = 0.0
+
+        return {'size': len(self),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': hit_rate}
+
+    def _append(self, entry):
+        root = self._root
+        last = root[PREVIOUS]
+        entry[PREVIOUS] = last
+        entry[NEXT] = root
+        last[NEXT] = root[PREVIOUS] = entry
+
+    def _unlink(self, entry):
+        entry[PREVIOUS][NEXT] = entry[NEXT]
+        entry[NEXT][PREVIOUS] = entry[PREVIOUS]
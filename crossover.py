@@ -1,8 +1,11 @@
 """
 Crossover classes implementing various Crossover algorithms
 """
-from random import random, randint
+from random import random, randint, sample
 import sys
+import Numeric
+import RandomArray
+from registry import crossovers
 
 class Crossover(object):
     """
@@ -15,6 +18,63 @@ class Crossover(object):
         """
         raise Exception("mate method is not implemented.")
 
+    def mateBatch(self, genomes, parents1, parents2):
+        """
+        Mate pairs of genomes from a population array.
+
+        @param array genomes (organisms x instruments x length) genome array
+        @param array parents1 indices of the first parent of each pair
+        @param array parents2 indices of the second parent of each pair
+        @return array the children of every pair
+        """
+        raise Exception("mateBatch method is not implemented.")
+
+    def exchange(self, genomes, parents1, parents2, mask):
+        """
+        Build the children of pairs of genomes by exchanging the genes
+        selected by a mask.  Each pair exchanges a different slice of its
+        genomes, so the slices are expressed as a mask and every child is
+        built by a single where instead of a slice assignment per pair.
+
+        @param array genomes (organisms x instruments x length) genome array
+        @param array parents1 indices of the first parent of each pair
+        @param array parents2 indices of the second parent of each pair
+        @param array mask (pairs x instruments x length) array that is 1 for
+                          each gene the children take from the other parent
+        @return array the first child of every pair followed by the second
+        """
+        first = Numeric.take(genomes, parents1)
+        second = Numeric.take(genomes, parents2)
+        children1 = Numeric.where(mask, second, first)
+        children2 = Numeric.where(mask, first, second)
+        return Numeric.concatenate((children1, children2)).astype(genomes.typecode())
+
+    def columnMask(self, genomes, start, end):
+        """
+        @param array genomes (organisms x instruments x length) genome array
+        @param array start first column exchanged by each pair
+        @param array end column after the last column exchanged by each pair
+        @return array mask selecting the given columns of every instrument
+        """
+        instrument_length = Numeric.shape(genomes)[1]
+        columns = Numeric.arange(Numeric.shape(genomes)[2])[Numeric.NewAxis, :]
+        mask = Numeric.logical_and(
+            Numeric.greater_equal(columns, start[:, Numeric.NewAxis]),
+            Numeric.less(columns, end[:, Numeric.NewAxis]))
+        return mask[:, Numeric.NewAxis, :] * \
+               Numeric.ones((1, instrument_length, 1), Numeric.Int)
+
+    def rowMask(self, genomes, selected):
+        """
+        @param array genomes (organisms x instruments x length) genome array
+        @param array selected (pairs x instruments) array that is 1 for each
+                              instrument exchanged by a pair
+        @return array mask selecting every column of the given instruments
+        """
+        return selected[:, :, Numeric.NewAxis] * \
+               Numeric.ones((1, 1, Numeric.shape(genomes)[2]), Numeric.Int)
+
+@crossovers.register()
 class OnePointCrossover(Crossover):
     """The simplest crossover."""
     def mate(self, parent1, parent2):
@@ -29,55 +89,117 @@ class OnePointCrossover(Crossover):
         
         return (child1, child2)
 
+    def mateBatch(self, genomes, parents1, parents2):
+        length = Numeric.shape(genomes)[2]
+        count = len(parents1)
+        crossPoints = RandomArray.randint(1, length, (count,))
+        mask = self.columnMask(genomes, crossPoints,
+                               Numeric.zeros(count, Numeric.Int) + length)
+        return self.exchange(genomes, parents1, parents2, mask)
+
+@crossovers.register()
 class TwoPointCrossover(Crossover):
     """
-    Based on the algorithm presented by Holland (1975) and Goldberg (1989b)
+    Based on the algorithm presented by Holland (1975) and Goldberg (1989b).
+    The children exchange the beats between two distinct cross points.
+    Patterns shorter than three beats have a single cross point and are
+    mated by one point crossover.
+
+    >>> from benchmark import configure
+    >>> from pattern import PackedPatternOrganism
+    >>> species = configure(PackedPatternOrganism, 2, 3)
+    >>> len(TwoPointCrossover().mate(species(), species()))
+    2
+    >>> genomes = Numeric.zeros((4, 3, 2), Numeric.UnsignedInt8)
+    >>> parents1, parents2 = Numeric.array([0, 1]), Numeric.array([2, 3])
+    >>> Numeric.shape(TwoPointCrossover().mateBatch(genomes, parents1, parents2))
+    (4, 3, 2)
     """    
     def mate(self, parent1, parent2):
-        pass
+        x = len(parent1)
+        if x < 3:
+            return OnePointCrossover().mate(parent1, parent2)
+        start, end = sample(xrange(1, x), 2)
+        if start > end:
+            start, end = end, start
+
+        child1, child2 = parent1.copy(), parent2.copy()
 
+        temp = parent1[start:end]
+        child1[start:end] = parent2[start:end]
+        child2[start:end] = temp
+
+        return (child1, child2)
+
+    def mateBatch(self, genomes, parents1, parents2):
+        length = Numeric.shape(genomes)[2]
+        count = len(parents1)
+        if length < 3:
+            return OnePointCrossover().mateBatch(genomes, parents1, parents2)
+
+        # Draw the second point from the remaining points so both are distinct.
+        first = RandomArray.randint(1, length, (count,))
+        second = RandomArray.randint(1, length - 1, (count,))
+        second = second + Numeric.greater_equal(second, first)
+
+        mask = self.columnMask(genomes, Numeric.minimum(first, second),
+                               Numeric.maximum(first, second))
+        return self.exchange(genomes, parents1, parents2, mask)
+
+@crossovers.register()
 class PartExchangeCrossover(Crossover):
+    """
+    The children exchange the part of one random instrument.
+    """
     def mate(self, parent1, parent2):
-        # TODO: Rewrite for array data structure
-        child1 = self.copy()
-        child2 = partner.copy()
+        child1, child2 = parent1.copy(), parent2.copy()
         
         # Select a random instrument to exchange
-        instrument = randint(0, self.instrument_length - 1)
-        
-        # Calculate the range of genes represented by the chosen instrument row
-        range_start = instrument * self.length
-        range_end = (instrument + 1) * self.length
-        
-        for i in range(range_start, range_end):
-            # Copy genes from partner sources
-            child1.genes[str(i)], child2.genes[str(i)] = child2.genes[str(i)], child1.genes[str(i)]
+        instrument = randint(0, parent1.instrument_length - 1)
+        child1.setRow(instrument, parent2.getRow(instrument))
+        child2.setRow(instrument, parent1.getRow(instrument))
             
         return (child1, child2)
 
+    def mateBatch(self, genomes, parents1, parents2):
+        instrument_length = Numeric.shape(genomes)[1]
+        instruments = RandomArray.randint(0, instrument_length, (len(parents1),))
+        selected = Numeric.equal(
+            Numeric.arange(instrument_length)[Numeric.NewAxis, :],
+            instruments[:, Numeric.NewAxis])
+        return self.exchange(genomes, parents1, parents2,
+                             self.rowMask(genomes, selected))
+
+@crossovers.register()
 class GroupPartExchangeCrossover(Crossover):
+    """
+    The children exchange the parts of a random group of up to half of the
+    instruments.
+    """
     def mate(self, parent1, parent2):
-        # TODO: Rewrite for array data structure
-        child1 = self.copy()
-        child2 = partner.copy()
+        child1, child2 = parent1.copy(), parent2.copy()
 
         # Select a random number of instrument to exchange        
-        #totalExchange = randint(1, self.instrument_length)
-        totalExchange = randint(1, self.instrument_length / 2)
-        
-        instrument_length = range(self.instrument_length)
-        exchangeinstrument_length = []
-        for i in range(totalExchange):
-            index = randint(0, len(instrument_length) - 1)
-            exchangeinstrument_length.append(instrument_length.pop(index))
-        
-        for instrument in exchangeinstrument_length:
-            # Calculate the range of genes represented by the chosen instrument row
-            range_start = instrument * self.length
-            range_end = (instrument + 1) * self.length
-            
-            for i in range(range_start, range_end):
-                # Copy genes from partner sources
-                child1.genes[str(i)], child2.genes[str(i)] = child2.genes[str(i)], child1.genes[str(i)]
+        totalExchange = randint(1, max(1, parent1.instrument_length / 2))
+        for instrument in sample(xrange(parent1.instrument_length), totalExchange):
+            child1.setRow(instrument, parent2.getRow(instrument))
+            child2.setRow(instrument, parent1.getRow(instrument))
             
         return (child1, child2)
+
+    def mateBatch(self, genomes, parents1, parents2):
+        instrument_length = Numeric.shape(genomes)[1]
+        count = len(parents1)
+        totals = RandomArray.randint(1, max(1, instrument_length / 2) + 1, (count,))
+
+        # The instruments ranked below each pair's total in a random
+        # permutation form a random group of that size.
+        ranks = Numeric.argsort(RandomArray.random((count, instrument_length)), 1)
+        selected = Numeric.less(ranks, totals[:, Numeric.NewAxis])
+        return self.exchange(genomes, parents1, parents2,
+                             self.rowMask(genomes, selected))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
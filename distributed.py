@@ -0,0 +1,643 @@
+#!/usr/bin/env python
+"""
+distributed.py
+
+Fitness evaluation spread over worker processes on several machines.
+
+A Coordinator accepts connections from workers on a TCP port and evaluates
+batches of genomes by sending them to whichever workers are connected.
+Workers may join or leave at any time: a worker receives the compiled
+trajectory spec once, when it joins, and the batches of a worker that leaves
+are sent to the remaining workers.  A batch that a worker does not answer in
+time is sent to another worker as well, and the first answer is used.  The
+coordinator keeps the number of batches, genomes and seconds spent by each
+worker.
+
+Every message is a header of a message type byte and the payload length
+followed by the payload.  Genomes are sent bit packed (see
+genome.pack_genomes) and fitness values as network order doubles, so
+coordinators and workers may run on different platforms.
+
+Workers are started on each machine with:
+
+    python distributed.py --host coordinator.example.com --port 9000
+
+or on the coordinator's machine with Coordinator.startLocalWorkers.
+"""
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import traceback
+import Queue
+import Numeric
+from optparse import OptionParser
+from genome import GENOME_TYPECODE, pack_genomes, unpack_genomes
+from registry import compile_fitness_plan
+from evaluator import CompiledTrajectory, compile_trajectories, evaluate_genomes
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+PROTOCOL_VERSION = 1
+
+# Message types
+HELLO, SPEC, BATCH, RESULT, ERROR, BYE = range(1, 7)
+
+# Message header: message type and payload length.
+HEADER = struct.Struct("!BI")
+
+# Genome encodings: one byte or one bit per beat.
+RAW_GENOMES, PACKED_GENOMES = 0, 1
+
+# Trajectory value number types.
+INTEGER, FLOAT = "i", "d"
+
+# The default time a worker has to answer a batch: a fixed allowance for the
+# connection plus an allowance per genome, so larger batches get longer.
+BATCH_TIMEOUT = 30.0
+GENOME_TIMEOUT = 0.5
+
+
+class DistributedException(Exception):
+    pass
+
+
+class ConnectionClosedException(DistributedException):
+    pass
+
+
+def send_message(sock, message_type, payload=""):
+    sock.sendall(HEADER.pack(message_type, len(payload)) + payload)
+
+def receive_exactly(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise ConnectionClosedException("Connection closed by peer.")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return "".join(chunks)
+
+def receive_message(sock):
+    """
+    @param socket sock
+    @return tuple the message type and payload
+    """
+    message_type, size = HEADER.unpack(receive_exactly(sock, HEADER.size))
+    return message_type, receive_exactly(sock, size)
+
+
+def encode_string(value):
+    value = str(value)
+    return struct.pack("!H", len(value)) + value
+
+def decode_string(data, offset):
+    size, = struct.unpack_from("!H", data, offset)
+    offset += 2
+    return data[offset:offset + size], offset + size
+
+def encode_number(value):
+    if isinstance(value, (int, long)):
+        return INTEGER + struct.pack("!q", value)
+    return FLOAT + struct.pack("!d", float(value))
+
+def decode_number(data, offset):
+    if data[offset] == INTEGER:
+        value, = struct.unpack_from("!q", data, offset + 1)
+    else:
+        value, = struct.unpack_from("!d", data, offset + 1)
+    return value, offset + 9
+
+def encode_spec(instrument_length, length, trajectories):
+    """
+    Encode the genome shape and trajectory data that workers need to evaluate
+    genomes.  Trajectory values are numbers or tuples of numbers.
+
+    @param int instrument_length
+    @param int length
+    @param list trajectories CompiledTrajectory objects
+    @return string
+    """
+    parts = [struct.pack("!HHH", instrument_length, length, len(trajectories))]
+    for trajectory in trajectories:
+        parts.append(encode_string(trajectory.function.name))
+        if trajectory.rows is None:
+            parts.append(struct.pack("!B", 0))
+        else:
+            parts.append(struct.pack("!B", 1) + encode_string(trajectory.rows))
+        if trajectory.master_row is None:
+            parts.append(struct.pack("!i", -1))
+        else:
+            parts.append(struct.pack("!i", trajectory.master_row))
+
+        parts.append(struct.pack("!I", len(trajectory.values)))
+        for value in trajectory.values:
+            if isinstance(value, (tuple, list)):
+                parts.append(struct.pack("!B", len(value)))
+                parts.extend([encode_number(number) for number in value])
+            else:
+                parts.append(struct.pack("!B", 0) + encode_number(value))
+
+    return "".join(parts)
+
+def decode_spec(data):
+    """
+    @param string data see encode_spec
+    @return tuple instrument_length, length and a list of CompiledTrajectory
+                  objects
+    """
+    instrument_length, length, count = struct.unpack_from("!HHH", data)
+    offset = 6
+    trajectories = []
+    for i in xrange(count):
+        name, offset = decode_string(data, offset)
+        has_rows, = struct.unpack_from("!B", data, offset)
+        offset += 1
+        rows = None
+        if has_rows:
+            rows, offset = decode_string(data, offset)
+        master_row, value_count = struct.unpack_from("!iI", data, offset)
+        offset += 8
+        if master_row < 0:
+            master_row = None
+
+        values = []
+        for j in xrange(value_count):
+            arity, = struct.unpack_from("!B", data, offset)
+            offset += 1
+            if arity == 0:
+                value, offset = decode_number(data, offset)
+            else:
+                value = []
+                for k in xrange(arity):
+                    number, offset = decode_number(data, offset)
+                    value.append(number)
+                value = tuple(value)
+            values.append(value)
+
+        trajectories.append(CompiledTrajectory(name, values, rows, master_row))
+
+    return instrument_length, length, trajectories
+
+def encode_genomes(genomes):
+    """
+    Encode a genome array, one bit per beat when every beat is 0 or 1.
+
+    @param array genomes (organisms x instruments x length) genome array
+    @return string
+    """
+    count, instrument_length, length = Numeric.shape(genomes)
+    genomes = genomes.astype(GENOME_TYPECODE)
+    if count > 0 and Numeric.maximum.reduce(Numeric.ravel(genomes)) <= 1:
+        encoding, data = PACKED_GENOMES, pack_genomes(genomes).tostring()
+    else:
+        encoding, data = RAW_GENOMES, genomes.tostring()
+    return struct.pack("!BIHH", encoding, count, instrument_length, length) + data
+
+def decode_genomes(data):
+    """
+    @param string data see encode_genomes
+    @return array (organisms x instruments x length) genome array
+    """
+    encoding, count, instrument_length, length = struct.unpack_from("!BIHH", data)
+    genomes = Numeric.fromstring(data[struct.calcsize("!BIHH"):], GENOME_TYPECODE)
+    if encoding == PACKED_GENOMES:
+        packed = Numeric.reshape(genomes, (count, instrument_length, (length + 7) / 8))
+        return unpack_genomes(packed, length)
+    return Numeric.reshape(genomes, (count, instrument_length, length))
+
+def encode_objectives(objectives):
+    """
+    @param list objectives an array of fitness values for each trajectory
+    @return string
+    """
+    count = len(objectives) and len(objectives[0])
+    parts = [struct.pack("!II", len(objectives), count)]
+    for values in objectives:
+        parts.append(struct.pack("!%id" % count, *values.tolist()))
+    return "".join(parts)
+
+def decode_objectives(data):
+    """
+    @param string data see encode_objectives
+    @return list a list of fitness values for each trajectory
+    """
+    trajectory_count, count = struct.unpack_from("!II", data)
+    offset = 8
+    objectives = []
+    for i in xrange(trajectory_count):
+        objectives.append(list(struct.unpack_from("!%id" % count, data, offset)))
+        offset += 8 * count
+    return objectives
+
+
+class WorkerStats(object):
+    """
+    Throughput of one worker connection.
+    """
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+        self.joined = time.time()
+        self.left = None
+        self.batches = 0
+        self.genomes = 0
+        self.seconds = 0.0
+        self.failures = 0
+
+    def throughput(self):
+        """
+        @return float the genomes evaluated per second spent on batches
+        """
+        if self.seconds > 0:
+            return self.genomes / self.seconds
+        return 0.0
+
+    def __str__(self):
+        if self.left is None:
+            state = "connected"
+        else:
+            state = "left"
+        return "%s (%s): %i batches, %i genomes, %.1f genomes/s, %i failures" % \
+               (self.name, state, self.batches, self.genomes, self.throughput(),
+                self.failures)
+
+
+class Batch(object):
+    def __init__(self, batch_id, data, count, evaluation=None):
+        """
+        @param int batch_id
+        @param string data encoded genomes
+        @param int count the number of genomes
+        @param int evaluation the Coordinator.evaluate call the batch belongs to
+        """
+        self.batch_id = batch_id
+        self.data = data
+        self.count = count
+        self.evaluation = evaluation
+        self.attempts = 0
+
+
+class Coordinator(object):
+    """
+    Evaluates batches of genomes on connected workers.  A Coordinator can be
+    used wherever a SerialEvaluator is.
+    """
+    def __init__(self, species, host="localhost", port=0, batch_size=32,
+                 timeout=None, retries=3):
+        """
+        @param class species a configured organism class
+        @param string host the interface to accept workers on
+        @param int port the port to accept workers on, or 0 for any free port
+        @param int batch_size the number of genomes sent to a worker at once
+        @param float timeout seconds to wait for a worker to answer a batch
+                             before sending it to another worker as well, or
+                             None to allow BATCH_TIMEOUT plus GENOME_TIMEOUT
+                             per genome in a batch
+        @param int retries the number of times a batch is sent again before
+                           evaluation fails
+        """
+        self.instrument_length = species.instrument_length
+        self.length = species.length
+        self.trajectories = compile_trajectories(species.trajectory_set)
+        self.fitness_plan = compile_fitness_plan(self.trajectories)
+        self.spec = encode_spec(self.instrument_length, self.length,
+                                self.trajectories)
+        self.batch_size = batch_size
+        if timeout is None:
+            timeout = BATCH_TIMEOUT + GENOME_TIMEOUT * batch_size
+        self.timeout = timeout
+        self.retries = retries
+
+        self.batches = Queue.Queue()
+        self.results = Queue.Queue()
+        self.workers = []
+        self.local_workers = []
+        self.lock = threading.Lock()
+        self.closed = False
+        self.evaluation = None
+        self._next_batch = 0
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(16)
+        self.server.settimeout(0.5)
+        self.address = self.server.getsockname()
+
+        self.acceptor = threading.Thread(target=self._accept)
+        self.acceptor.setDaemon(True)
+        self.acceptor.start()
+
+    def evaluate(self, genomes):
+        """
+        @param array genomes (organisms x instruments x length) genome array
+        @return list an array of fitness values for each trajectory
+        """
+        count = Numeric.shape(genomes)[0]
+        if count == 0:
+            return evaluate_genomes(genomes, self.fitness_plan)
+
+        # Batches are tagged with the evaluation they belong to, so workers
+        # skip the batches of an evaluation that failed.
+        self.evaluation = self._batchId()
+        starts = {}
+        values = {}
+        try:
+            for start in xrange(0, count, self.batch_size):
+                batch = Batch(self._batchId(),
+                              encode_genomes(genomes[start:start + self.batch_size]),
+                              min(self.batch_size, count - start),
+                              self.evaluation)
+                starts[batch.batch_id] = start
+                self.batches.put(batch)
+
+            while len(values) < len(starts):
+                try:
+                    batch_id, objectives, error = self.results.get(True, self.timeout)
+                except Queue.Empty:
+                    if self.workerCount() == 0:
+                        raise DistributedException("No workers connected to %s:%i" %
+                                                   self.address)
+                    continue
+
+                # Results of batches that were sent again may arrive twice, or
+                # after the evaluation they belong to.
+                if not starts.has_key(batch_id) or values.has_key(batch_id):
+                    continue
+                if error is not None:
+                    raise DistributedException("Batch %i failed: %s" % (batch_id, error))
+                values[batch_id] = objectives
+        finally:
+            self.evaluation = None
+            self._drain(self.batches)
+            self._drain(self.results)
+
+        batch_ids = starts.keys()
+        batch_ids.sort(lambda a, b: cmp(starts[a], starts[b]))
+        objectives = []
+        for t in xrange(len(self.fitness_plan)):
+            trajectory_values = []
+            for batch_id in batch_ids:
+                trajectory_values.extend(values[batch_id][t])
+            objectives.append(Numeric.array(trajectory_values, Numeric.Float))
+        return objectives
+
+    def waitForWorkers(self, count, timeout=None):
+        """
+        Block until the given number of workers are connected.
+
+        @param int count
+        @param float timeout seconds to wait, or None to wait forever
+        @return boolean whether the workers connected in time
+        """
+        started = time.time()
+        while self.workerCount() < count:
+            if timeout is not None and time.time() - started > timeout:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def startLocalWorkers(self, count):
+        """
+        Start worker processes on this machine.  They are stopped when the
+        coordinator is closed.
+
+        @param int count
+        """
+        if multiprocessing is None:
+            raise DistributedException("Local workers require the multiprocessing module.")
+
+        host, port = self.address
+        if host == "0.0.0.0":
+            host = "localhost"
+        for i in xrange(count):
+            process = multiprocessing.Process(target=run_worker, args=(host, port))
+            process.daemon = True
+            process.start()
+            self.local_workers.append(process)
+
+    def workerCount(self):
+        self.lock.acquire()
+        try:
+            return len([stats for stats in self.workers if stats.left is None])
+        finally:
+            self.lock.release()
+
+    def stats(self):
+        """
+        @return list WorkerStats of every worker that has joined
+        """
+        self.lock.acquire()
+        try:
+            return list(self.workers)
+        finally:
+            self.lock.release()
+
+    def close(self):
+        """
+        Stop accepting workers and tell connected workers to exit.
+        """
+        self.closed = True
+        self.acceptor.join()
+        self.server.close()
+        for process in self.local_workers:
+            process.join(self.timeout)
+            if process.is_alive():
+                process.terminate()
+
+    def _drain(self, queue):
+        """
+        Discard the items left in a queue.
+        """
+        try:
+            while True:
+                queue.get(False)
+        except Queue.Empty:
+            pass
+
+    def _batchId(self):
+        self.lock.acquire()
+        try:
+            self._next_batch += 1
+            return self._next_batch
+        finally:
+            self.lock.release()
+
+    def _accept(self):
+        while not self.closed:
+            try:
+                connection, address = self.server.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                break
+
+            thread = threading.Thread(target=self._serve, args=(connection, address))
+            thread.setDaemon(True)
+            thread.start()
+
+    def _retry(self, batch, error):
+        batch.attempts += 1
+        if batch.attempts > self.retries:
+            self.results.put((batch.batch_id, None, error))
+        else:
+            self.batches.put(batch)
+
+    def _serve(self, connection, address):
+        """
+        Send batches to one worker until it leaves or the coordinator closes.
+        """
+        connection.settimeout(self.timeout)
+        try:
+            message_type, payload = receive_message(connection)
+            version, = struct.unpack_from("!H", payload)
+            if message_type != HELLO or version != PROTOCOL_VERSION:
+                connection.close()
+                return
+            name, offset = decode_string(payload, 2)
+            send_message(connection, SPEC, self.spec)
+        except (socket.error, DistributedException, struct.error):
+            connection.close()
+            return
+
+        stats = WorkerStats(name, "%s:%i" % address)
+        self.lock.acquire()
+        self.workers.append(stats)
+        self.lock.release()
+
+        batch = None
+        sent_again = False
+        try:
+            try:
+                while not self.closed:
+                    try:
+                        batch = self.batches.get(True, 0.5)
+                    except Queue.Empty:
+                        continue
+                    if batch.evaluation != self.evaluation:
+                        batch = None
+                        continue
+
+                    started = time.time()
+                    sent_again = False
+                    send_message(connection, BATCH,
+                                 struct.pack("!I", batch.batch_id) + batch.data)
+
+                    # A worker slower than the timeout keeps its connection:
+                    # its batch is sent to another worker as well, and
+                    # whichever answer arrives first is used.
+                    while not self.closed and \
+                          not select.select([connection], [], [], 0.5)[0]:
+                        if not sent_again and time.time() - started > self.timeout:
+                            sent_again = True
+                            stats.failures += 1
+                            self._retry(batch, "%s timed out after %.1f s" %
+                                        (name, self.timeout))
+                    if self.closed:
+                        break
+                    message_type, payload = receive_message(connection)
+                    batch_id, = struct.unpack_from("!I", payload)
+
+                    if message_type == RESULT:
+                        stats.seconds += time.time() - started
+                        stats.batches += 1
+                        stats.genomes += batch.count
+                        self.results.put((batch_id, decode_objectives(payload[4:]), None))
+                    elif not sent_again:
+                        stats.failures += 1
+                        self._retry(batch, payload[4:])
+                    batch = None
+
+                send_message(connection, BYE)
+            except (socket.error, DistributedException, struct.error), e:
+                # The worker left: send its batch to the other workers.
+                if batch is not None and not sent_again:
+                    stats.failures += 1
+                    self._retry(batch, "%s left: %s" % (name, e))
+        finally:
+            stats.left = time.time()
+            connection.close()
+
+
+class Worker(object):
+    """
+    Evaluates the batches a coordinator sends until the coordinator says bye
+    or closes the connection.
+    """
+    def __init__(self, host, port, name=None):
+        """
+        @param string host the coordinator's host
+        @param int port the coordinator's port
+        @param string name the name the coordinator reports the worker by
+        """
+        self.host = host
+        self.port = port
+        self.name = name or "%s:%i" % (socket.gethostname(), os.getpid())
+
+    def run(self):
+        connection = socket.create_connection((self.host, self.port))
+        try:
+            send_message(connection, HELLO,
+                         struct.pack("!H", PROTOCOL_VERSION) + encode_string(self.name))
+            message_type, payload = receive_message(connection)
+            if message_type != SPEC:
+                raise DistributedException("Expected a trajectory spec, received message type %i" %
+                                           message_type)
+            instrument_length, length, trajectories = decode_spec(payload)
+            fitness_plan = compile_fitness_plan(trajectories)
+
+            while True:
+                try:
+                    message_type, payload = receive_message(connection)
+                except ConnectionClosedException:
+                    break
+                if message_type != BATCH:
+                    break
+
+                batch_id = payload[:4]
+                try:
+                    objectives = evaluate_genomes(decode_genomes(payload[4:]),
+                                                  fitness_plan)
+                except Exception:
+                    message = (ERROR, batch_id + traceback.format_exc())
+                else:
+                    message = (RESULT, batch_id + encode_objectives(objectives))
+
+                # The coordinator may have closed while the batch was
+                # evaluated.
+                try:
+                    send_message(connection, *message)
+                except socket.error:
+                    break
+        finally:
+            connection.close()
+
+
+def run_worker(host, port, name=None):
+    Worker(host, port, name).run()
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--host",
+                      dest="host", type="string", default="localhost",
+                      help="the coordinator's host")
+    parser.add_option("-p", "--port",
+                      dest="port", type="int", default=9000,
+                      help="the coordinator's port")
+    parser.add_option("-n", "--name",
+                      dest="name", type="string", default=None,
+                      help="the name the coordinator reports this worker by")
+    (options, args) = parser.parse_args()
+
+    run_worker(options.host, options.port, options.name)
+
+
+if __name__ == '__main__':
+    main()
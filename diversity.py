@@ -0,0 +1,181 @@
+"""
+diversity.py
+
+Diversity measures for populations of patterns.
+
+Diversity is measured over a (organisms x instruments x length) genome array
+in one of two ways:
+
+ * similarity - the cosine similarity of two genomes' gene values, so higher
+                values mean a less diverse population
+ * distance - the fraction of beats that differ between two genomes (their
+              Hamming distance), so higher values mean a more diverse
+              population
+
+The diversity of a population is the mean measure over all pairs of distinct
+organisms.  Every pair is compared with a single matrix product (similarity)
+or with the population count of the exclusive or of packed rows (distance).
+For large populations the mean can be estimated from a random sample of pairs
+instead.
+"""
+import Numeric
+import RandomArray
+from genome import pack_genomes, popcount
+
+SIMILARITY = "similarity"
+DISTANCE = "distance"
+
+# Normal quantile used for the default 95% confidence bounds of estimates.
+CONFIDENCE_Z = 1.96
+
+
+def genome_vectors(genomes):
+    """
+    @param array genomes (organisms x instruments x length) genome array
+    @return array (organisms x genes) array of gene values
+    """
+    shape = Numeric.shape(genomes)
+    return Numeric.reshape(genomes, (shape[0], shape[1] * shape[2])).astype(Numeric.Float)
+
+def genome_norms(vectors):
+    """
+    @param array vectors (organisms x genes) array of gene values
+    @return array the magnitude of each genome vector.  Genomes without beats
+                  have magnitude 1 so their similarity to any genome is 0.
+    """
+    norms = Numeric.sqrt(Numeric.add.reduce(vectors * vectors, 1))
+    return Numeric.where(Numeric.equal(norms, 0), 1.0, norms)
+
+def similarity_matrix(genomes):
+    """
+    @param array genomes (organisms x instruments x length) genome array
+    @return array (organisms x organisms) array of cosine similarities
+    """
+    vectors = genome_vectors(genomes)
+    norms = genome_norms(vectors)
+    products = Numeric.dot(vectors, Numeric.transpose(vectors))
+    return products / Numeric.outerproduct(norms, norms)
+
+def distance_matrix(genomes):
+    """
+    @param array genomes (organisms x instruments x length) genome array
+    @return array (organisms x organisms) array of the fraction of beats that
+                  differ between each pair of genomes
+    """
+    shape = Numeric.shape(genomes)
+    packed = pack_genomes(genomes)
+    distances = []
+    for i in xrange(shape[0]):
+        mismatches = popcount(Numeric.bitwise_xor(packed[i:i + 1], packed))
+        distances.append(Numeric.add.reduce(Numeric.add.reduce(mismatches, 2), 1))
+    return Numeric.array(distances, Numeric.Float) / (shape[1] * shape[2])
+
+def pair_measures(genomes, first, second, measure=SIMILARITY):
+    """
+    @param array genomes (organisms x instruments x length) genome array
+    @param array first index of the first genome of each pair
+    @param array second index of the second genome of each pair
+    @param string measure SIMILARITY or DISTANCE
+    @return array the measure of each pair of genomes
+    """
+    if measure == SIMILARITY:
+        vectors = genome_vectors(genomes)
+        norms = genome_norms(vectors)
+        products = Numeric.add.reduce(Numeric.take(vectors, first) *
+                                      Numeric.take(vectors, second), 1)
+        return products / (Numeric.take(norms, first) * Numeric.take(norms, second))
+    elif measure == DISTANCE:
+        shape = Numeric.shape(genomes)
+        packed = pack_genomes(genomes)
+        mismatches = popcount(Numeric.bitwise_xor(Numeric.take(packed, first),
+                                                  Numeric.take(packed, second)))
+        return Numeric.add.reduce(Numeric.add.reduce(mismatches, 2), 1) / \
+               float(shape[1] * shape[2])
+    else:
+        raise Exception("Unknown diversity measure: %s" % measure)
+
+def mean_diversity(genomes, measure=SIMILARITY):
+    """
+    @param array genomes (organisms x instruments x length) genome array
+    @param string measure SIMILARITY or DISTANCE
+    @return float the mean measure over all pairs of distinct organisms
+    """
+    count = Numeric.shape(genomes)[0]
+    if measure == SIMILARITY:
+        matrix = similarity_matrix(genomes)
+    elif measure == DISTANCE:
+        matrix = distance_matrix(genomes)
+    else:
+        raise Exception("Unknown diversity measure: %s" % measure)
+
+    # Sum the pairs above the diagonal.
+    total = (Numeric.add.reduce(Numeric.ravel(matrix)) -
+             Numeric.add.reduce(Numeric.diagonal(matrix))) / 2.0
+    return total / (count * (count - 1) / 2)
+
+def estimate_diversity(genomes, samples, measure=SIMILARITY, z=CONFIDENCE_Z):
+    """
+    Estimate the mean measure over all pairs of distinct organisms from a
+    random sample of pairs.
+
+    @param array genomes (organisms x instruments x length) genome array
+    @param int samples the number of pairs to sample
+    @param string measure SIMILARITY or DISTANCE
+    @param float z the normal quantile of the confidence bounds
+    @return tuple the estimate and its lower and upper confidence bounds
+    """
+    count = Numeric.shape(genomes)[0]
+
+    # Draw the second genome of each pair from the other genomes.
+    first = RandomArray.randint(0, count, (samples,))
+    second = RandomArray.randint(0, count - 1, (samples,))
+    second = second + Numeric.greater_equal(second, first)
+
+    values = pair_measures(genomes, first, second, measure)
+    mean = Numeric.add.reduce(values) / samples
+    if samples > 1:
+        variance = Numeric.add.reduce((values - mean) ** 2) / (samples - 1)
+        error = z * (variance / samples) ** 0.5
+    else:
+        error = 0.0
+
+    return (mean, mean - error, mean + error)
+
+def diversity_interval(genomes, measure=SIMILARITY, samples=None):
+    """
+    >>> genomes = Numeric.zeros((4, 2, 8), Numeric.Int8)
+    >>> genomes[0, 0, :4] = 1
+    >>> diversity_interval(genomes, DISTANCE)
+    (0.125, 0.125, 0.125)
+    >>> estimate, low, high = diversity_interval(genomes, DISTANCE, 3)
+    >>> low <= estimate <= high
+    True
+
+    @param array genomes (organisms x instruments x length) genome array
+    @param string measure SIMILARITY or DISTANCE
+    @param int samples estimate the diversity from this many random pairs
+                       when there are more pairs than that
+    @return tuple the mean measure over all pairs of distinct organisms and
+                  its lower and upper confidence bounds, which equal the mean
+                  when every pair is compared
+    """
+    count = Numeric.shape(genomes)[0]
+    if samples and samples < count * (count - 1) / 2:
+        return estimate_diversity(genomes, samples, measure)
+    mean = mean_diversity(genomes, measure)
+    return (mean, mean, mean)
+
+def genome_diversity(genomes, measure=SIMILARITY, samples=None):
+    """
+    @param array genomes (organisms x instruments x length) genome array
+    @param string measure SIMILARITY or DISTANCE
+    @param int samples estimate the diversity from this many random pairs
+                       when there are more pairs than that
+    @return float the mean measure over all pairs of distinct organisms
+    """
+    return diversity_interval(genomes, measure, samples)[0]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,190 @@
+"""
+evaluator.py
+
+Fitness evaluators score batches of genomes for every fitness trajectory of a
+species.
+
+SerialEvaluator scores genomes in the calling process.  ProcessPoolEvaluator
+splits each batch into chunks of packed genomes and scores the chunks in a
+pool of worker processes.  Each worker receives the compiled trajectory data
+once, when it starts, so only genome bytes and fitness values are sent to the
+workers for each batch.  Both evaluators score genomes with the same code and
+return identical values.
+"""
+import Numeric
+from genome import GENOME_TYPECODE
+from registry import compile_fitness_plan
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+
+class CompiledFunction(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class CompiledTrajectory(object):
+    """
+    Copy of the fitness trajectory data used by the fitness functions, which
+    can be sent to other processes without a database connection.
+    """
+    def __init__(self, name, values, rows=None, master_row=None):
+        """
+        @param string name the name of the trajectory's fitness function
+        @param list values the calculated trajectory values
+        @param string rows comma separated instrument rows, for trajectories
+                           that compare rows
+        @param int master_row
+        """
+        self.function = CompiledFunction(name)
+        self.values = values
+        self.rows = rows
+        self.master_row = master_row
+
+    def __repr__(self):
+        return "<CompiledTrajectory: %s>" % self.function.name
+
+
+def compile_trajectories(trajectory_set):
+    """
+    @param list trajectory_set fitness trajectories with calculated values
+    @return list a CompiledTrajectory for each trajectory
+    """
+    return [CompiledTrajectory(str(trajectory.function.name),
+                               list(trajectory.values),
+                               getattr(trajectory, 'rows', None),
+                               getattr(trajectory, 'master_row', None))
+            for trajectory in trajectory_set]
+
+
+class EvaluationGenome(object):
+    """
+    The parts of an organism that fitness functions use.
+    """
+    def __init__(self, genes, instrument_length, length):
+        self.genes = genes
+        self.instrument_length = instrument_length
+        self.length = length
+
+
+def evaluate_genomes(genomes, fitness_plan):
+    """
+    Evaluate each trajectory for a batch of genomes.  Fitness functions with a
+    registered batch form score the whole batch at once; other functions are
+    applied to each genome in turn.
+
+    @param array genomes (organisms x instruments x length) genome array
+    @param list fitness_plan (fitness function, trajectory) pairs
+    @return list an array of fitness values for each trajectory
+    """
+    count, instrument_length, length = Numeric.shape(genomes)
+    objectives = []
+
+    for fitness_function, trajectory in fitness_plan:
+        if hasattr(fitness_function, 'batch'):
+            objectives.append(fitness_function.batch(genomes, trajectory))
+        else:
+            objectives.append(Numeric.array(
+                [fitness_function(EvaluationGenome(genomes[i], instrument_length,
+                                                   length), trajectory)
+                 for i in xrange(count)], Numeric.Float))
+
+    return objectives
+
+
+class SerialEvaluator(object):
+    """
+    Evaluates genomes in the calling process.
+    """
+    def __init__(self, species):
+        """
+        @param class species a configured organism class
+        """
+        self.instrument_length = species.instrument_length
+        self.length = species.length
+        self.trajectories = compile_trajectories(species.trajectory_set)
+        self.fitness_plan = compile_fitness_plan(self.trajectories)
+
+    def evaluate(self, genomes):
+        """
+        @param array genomes (organisms x instruments x length) genome array
+        @return list an array of fitness values for each trajectory
+        """
+        return evaluate_genomes(genomes, self.fitness_plan)
+
+    def close(self):
+        pass
+
+
+class ProcessPoolEvaluator(SerialEvaluator):
+    """
+    Evaluates chunks of genomes in a pool of worker processes.
+    """
+    def __init__(self, species, processes=None, chunksize=32):
+        """
+        @param class species a configured organism class
+        @param int processes the number of worker processes, or None for one
+                             per CPU
+        @param int chunksize the number of genomes sent to a worker at once
+        """
+        SerialEvaluator.__init__(self, species)
+        self.chunksize = chunksize
+        self.pool = multiprocessing.Pool(processes, _initialize_worker,
+                                         (self.instrument_length, self.length,
+                                          self.trajectories))
+
+    def evaluate(self, genomes):
+        count = Numeric.shape(genomes)[0]
+        if count == 0:
+            return SerialEvaluator.evaluate(self, genomes)
+
+        genomes = genomes.astype(GENOME_TYPECODE)
+        chunks = [genomes[i:i + self.chunksize].tostring()
+                  for i in xrange(0, count, self.chunksize)]
+        results = self.pool.map(_evaluate_chunk, chunks)
+
+        objectives = []
+        for t in xrange(len(self.fitness_plan)):
+            values = []
+            for result in results:
+                values.extend(result[t])
+            objectives.append(Numeric.array(values, Numeric.Float))
+        return objectives
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+def make_evaluator(species, processes, chunksize=32):
+    """
+    Create an evaluator with the given number of worker processes.  A single
+    process, or a platform without the multiprocessing module, evaluates
+    genomes serially.
+
+    @param class species a configured organism class
+    @param int processes
+    @param int chunksize
+    @return SerialEvaluator
+    """
+    if processes > 1 and multiprocessing is not None:
+        return ProcessPoolEvaluator(species, processes, chunksize)
+    return SerialEvaluator(species)
+
+
+# Genome shape and fitness plan of a worker process.
+_worker = None
+
+def _initialize_worker(instrument_length, length, trajectories):
+    global _worker
+    _worker = (instrument_length, length, compile_fitness_plan(trajectories))
+
+def _evaluate_chunk(data):
+    instrument_length, length, fitness_plan = _worker
+    genomes = Numeric.reshape(Numeric.fromstring(data, GENOME_TYPECODE),
+                              (-1, instrument_length, length))
+    return [objective.tolist()
+            for objective in evaluate_genomes(genomes, fitness_plan)]
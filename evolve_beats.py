@@ -5,19 +5,39 @@ evolve_beats.py
 Evolves a pattern of beats based on a collection of user-defined fitness
 trajectories.  The genetic algorithm is based on the pygene library.
 
+Patterns are loaded from the database, or from a run spec file exported with
+--export-spec (see spec.py), in which case Django and the database are not
+needed.
+
 @author John Huddleston
 """
-import os
 import sys
 import pickle
-os.environ['DJANGO_SETTINGS_MODULE'] = "fitbeat_project.settings"
 
 from random import choice, random
 from optparse import OptionParser
-from pattern import PatternGene, PatternOrganism, PatternPopulation
-from fitbeat_project.fitbeats.models import *
-from selector import RouletteSelector, TournamentSelector, NewRouletteSelector
-from crossover import OnePointCrossover
+from pattern import PatternOrganism, PackedPatternOrganism, PatternPopulation, TensorPatternPopulation
+from registry import selectors
+from spec import RunSpec, SpecException, pattern_models
+from snapshot import SnapshotCache, load_spec
+from cache import FitnessCache
+from evaluator import make_evaluator
+from distributed import Coordinator
+from steady_state import SteadyState, REPLACEMENTS, REPLACE_WORST
+from island import Archipelago, IslandException, make_islands, TOPOLOGIES, RING
+from diversity import SIMILARITY, DISTANCE
+from timing import PhaseTimer, BEST, DIVERSITY, REPORT, STATS
+
+def split_names(names, suffix):
+    """
+    @param string names comma separated operator names, such as "One Point"
+    @param string suffix the operator type, such as "Crossover"
+    @return list the registered names of the operators
+    """
+    if not names:
+        return []
+    return ["%s%s" % (name.strip(), suffix) for name in names.split(",")
+            if name.strip()]
 
 def main(pattern_id=None):
     if pattern_id:
@@ -25,7 +45,7 @@ def main(pattern_id=None):
     else:
         return_best = False
     
-    usage = "usage: %prog [-p] [[options] pattern_id]"
+    usage = "usage: %prog [-p] [[options] pattern_id | --spec FILE [options]]"
     parser = OptionParser(usage)
     parser.add_option("-f", "--prefix",
                       dest="pisa_prefix", type="string", default="PISA_",
@@ -48,11 +68,120 @@ def main(pattern_id=None):
     parser.add_option("-p",
                       dest="list_patterns", action="store_true", default=False,
                       help="list available patterns and their ids")
+    parser.add_option("--spec",
+                      dest="spec", type="string", default=None,
+                      help="evolve the pattern of a run spec file instead of a\
+                            pattern in the database")
+    parser.add_option("--export-spec",
+                      dest="export_spec", type="string", default=None,
+                      help="write the pattern's run spec to this file and exit")
+    parser.add_option("--no-snapshots",
+                      dest="use_snapshots", action="store_false", default=True,
+                      help="always read the pattern from the database instead of\
+                            its run spec snapshot, which is kept in the\
+                            FITBEATS_SNAPSHOTS directory")
+    parser.add_option("-k", "--packed",
+                      dest="packed", action="store_true", default=False,
+                      help="store organism genomes as packed integer arrays")
+    parser.add_option("-c", "--cache-size",
+                      dest="cache_size", type="int", default=10000,
+                      help="the number of genome fitness values to cache, or 0 to\
+                            disable the fitness cache")
+    parser.add_option("-t", "--tensor",
+                      dest="tensor", action="store_true", default=False,
+                      help="store the whole population in a single genome array")
+    parser.add_option("-j", "--processes",
+                      dest="processes", type="int", default=0,
+                      help="the number of processes that evaluate fitness, or 0\
+                            to evaluate each organism when it is needed")
+    parser.add_option("--chunk-size",
+                      dest="chunk_size", type="int", default=32,
+                      help="the number of genomes sent to an evaluation process\
+                            at once")
+    parser.add_option("--coordinator",
+                      dest="coordinator", type="string", default=None,
+                      help="evaluate fitness on workers that connect to this\
+                            host:port, see distributed.py")
+    parser.add_option("--local-workers",
+                      dest="local_workers", type="int", default=0,
+                      help="start this many evaluation workers on this machine\
+                            (implies --coordinator=localhost:0)")
+    parser.add_option("--min-workers",
+                      dest="min_workers", type="int", default=1,
+                      help="the number of workers to wait for before evolving")
+    parser.add_option("--worker-timeout",
+                      dest="worker_timeout", type="float", default=None,
+                      help="seconds a worker has to answer a batch before it is\
+                            sent to another worker as well (default: 30 plus\
+                            0.5 per genome in a batch)")
+    parser.add_option("--steady-state",
+                      dest="steady_state", action="store_true", default=False,
+                      help="insert children into the population as soon as\
+                            they are scored instead of a generation at a time;\
+                            -j sets the number of breeding processes")
+    parser.add_option("--replacement",
+                      dest="replacement", type="choice", choices=REPLACEMENTS,
+                      default=REPLACE_WORST,
+                      help="the organism a steady state child replaces: the\
+                            worst organism or the worst of a tournament")
+    parser.add_option("--replacement-size",
+                      dest="replacement_size", type="int", default=2,
+                      help="the size of replacement tournaments")
+    parser.add_option("--max-evaluations",
+                      dest="max_evaluations", type="int", default=0,
+                      help="the number of children a steady state run scores,\
+                            by default as many as the generations of the\
+                            pattern would")
+    parser.add_option("--islands",
+                      dest="islands", type="int", default=0,
+                      help="evolve this many populations in separate processes,\
+                            exchanging their best organisms")
+    parser.add_option("--topology",
+                      dest="topology", type="choice", choices=TOPOLOGIES,
+                      default=RING,
+                      help="the islands each island sends its best organisms to")
+    parser.add_option("--migration-interval",
+                      dest="migration_interval", type="int", default=10,
+                      help="the number of generations between migrations")
+    parser.add_option("--migrants",
+                      dest="migrants", type="int", default=2,
+                      help="the number of organisms each island sends")
+    parser.add_option("--island-selectors",
+                      dest="island_selectors", type="string", default=None,
+                      help="comma separated selectors assigned to the islands in\
+                            turn, such as 'Tournament,Rank'")
+    parser.add_option("--island-crossovers",
+                      dest="island_crossovers", type="string", default=None,
+                      help="comma separated crossovers assigned to the islands in\
+                            turn, such as 'One Point,Two Point'")
+    parser.add_option("--island-mutators",
+                      dest="island_mutators", type="string", default=None,
+                      help="semicolon separated groups of comma separated\
+                            mutators assigned to the islands in turn, such as\
+                            'Classic,Invert;Rotate'")
+    parser.add_option("--timing",
+                      dest="timing", action="store_true", default=False,
+                      help="time the phases of each generation")
+    parser.add_option("--timing-report",
+                      dest="timing_report", type="string", default=None,
+                      help="write the timing report to this JSON file\
+                            (implies --timing)")
+    parser.add_option("--diversity-samples",
+                      dest="diversity_samples", type="int", default=0,
+                      help="estimate the diversity of the whole population from\
+                            this many random pairs instead of comparing the top\
+                            10 organisms")
+    parser.add_option("--diversity-measure",
+                      dest="diversity_measure", type="choice",
+                      choices=[SIMILARITY, DISTANCE], default=SIMILARITY,
+                      help="measure diversity by the mean cosine similarity or\
+                            the mean fraction of differing beats of pairs of\
+                            organisms")
     
     (options, args) = parser.parse_args()
     
     if options.list_patterns:
-        patterns = Pattern.objects.all()
+        patterns = pattern_models().Pattern.objects.all()
         print "Id | Dimensions | Name"
         print "----------------------"
         for p in patterns:
@@ -64,6 +193,9 @@ def main(pattern_id=None):
             except:
                 pass
         sys.exit()
+    elif options.spec:
+        if args:
+            parser.error("A pattern id cannot be used with --spec.")
     elif pattern_id is None and len(args) != 1:
         parser.error("""You must supply a pattern id as an argument or use the
                         -p flag to list the available patterns.""")
@@ -72,6 +204,16 @@ def main(pattern_id=None):
             pattern_id = pattern_id or int(args[0])
         except ValueError:
             parser.error("You must supply an integer value for the pattern id.")
+
+    if options.steady_state and options.tensor:
+        parser.error("Steady state evolution cannot use a tensor population.")
+    if options.steady_state and options.islands > 0:
+        parser.error("Steady state evolution cannot be combined with --islands.")
+    if options.steady_state and (options.coordinator or options.local_workers > 0):
+        parser.error("Steady state evolution cannot use --coordinator or --local-workers.")
+    if (options.timing or options.timing_report) and \
+       (options.islands > 0 or options.steady_state):
+        parser.error("--timing cannot be used with --islands or --steady-state.")
     
     # Set option variables    
     limit_mutation = options.limit_mutation
@@ -82,58 +224,96 @@ def main(pattern_id=None):
     pisa_prefix = options.pisa_prefix
     
     try:
-        pattern = Pattern.objects.get(pk=pattern_id)
-    except Pattern.DoesNotExist:
-        print "Error: could not load pattern %s" % pattern_id
+        if options.spec:
+            spec = RunSpec.load(options.spec)
+        else:
+            cache = None
+            if options.use_snapshots:
+                cache = SnapshotCache()
+            spec = load_spec(pattern_id, cache)
+    except SpecException, e:
+        print "Error: %s" % e
         sys.exit(1)
-    
-    length = pattern.length
-    instrument_length = pattern.instrument_length
 
-    selector = eval(pattern.selector.get_short_name())
-    crossover = eval(pattern.crossover.get_short_name())
-    mutators = ["%sMutator" % m.name for m in pattern.mutators.all()]
-    
-    trajectory_set = pattern.fitnesstrajectory_set.all()
-    for trajectory in trajectory_set:
-        trajectory.calculate_trajectory()
-        
-    parameters = pattern.parameters.all()
-    parameter_dict = {}
-    for parameter in parameters:
-        parameter_dict[parameter.name] = parameter.value
-    parameters = parameter_dict
+    if options.export_spec:
+        spec.save(options.export_spec)
+        if not quiet:
+            print "Wrote %s" % options.export_spec
+        sys.exit()
+
+    if database_dump and spec.pattern_id is None:
+        parser.error("The run spec has no pattern id to dump the best pattern to.")
     
-    # Prepare gene
-    PatternGene.mutProb = parameters['gene_mutation_probability']
+    length = spec.length
+    instrument_length = spec.instrument_length
+    selector = selectors.resolve(spec.selector)
+    mutators = spec.mutators
+    parameters = spec.parameters
     
     # Prepare organism
-    PatternOrganism.mutProb = parameters['organism_mutation_probability']
-    PatternOrganism.crossoverRate = parameters['organism_crossover_rate']
-    PatternOrganism.instrument_length = instrument_length
-    PatternOrganism.instruments = pattern.instruments.all()
-    PatternOrganism.length = length
-    PatternOrganism.crossover = crossover()
-    PatternOrganism.mutators = mutators
-    PatternOrganism.limit_mutation = limit_mutation
-    PatternOrganism.trajectory_set = trajectory_set
-    PatternOrganism.gene = PatternGene
+    if options.packed or options.tensor or options.islands > 0 or \
+       (options.steady_state and options.processes > 1):
+        species = PackedPatternOrganism
+    else:
+        species = PatternOrganism
+    spec.configure(species, limit_mutation)
+    if options.cache_size > 0:
+        species.fitness_cache = FitnessCache(options.cache_size)
     
     # Prepare population
-    PatternPopulation.selector=selector()
-    ph = PatternPopulation(init=int(parameters['population_initial_size']),
-                           species=PatternOrganism)
-    ph.childCount = int(parameters['population_new_children'])
     max_generations = int(parameters['population_max_generations'])
+    evaluator = None
+    if options.islands > 0:
+        islands = make_islands(options.islands, spec.selector, spec.selector_parameters,
+                               split_names(options.island_selectors, "Selector"),
+                               split_names(options.island_crossovers, "Crossover"),
+                               [split_names(group, "Mutator")
+                                for group in (options.island_mutators or "").split(";")
+                                if group.strip()])
+
+        archipelago = Archipelago(species, islands,
+                                  int(parameters['population_initial_size']),
+                                  int(parameters['population_new_children']),
+                                  int(parameters.get('population_survivors', 0)) or None,
+                                  options.topology, options.migration_interval,
+                                  options.migrants, options.cache_size)
+    else:
+        if options.tensor:
+            population = TensorPatternPopulation
+        else:
+            population = PatternPopulation
+        population.selector=selector(**spec.selector_parameters)
+        if options.coordinator or options.local_workers > 0:
+            host, port = (options.coordinator or "localhost:0").split(":")
+            evaluator = Coordinator(species, host, int(port), options.chunk_size,
+                                    options.worker_timeout)
+            evaluator.startLocalWorkers(options.local_workers)
+            if not quiet:
+                print "Waiting for %i workers on %s:%i" % ((options.min_workers,) +
+                                                           evaluator.address)
+            evaluator.waitForWorkers(options.min_workers)
+        elif options.processes > 0 and not options.steady_state:
+            evaluator = make_evaluator(species, options.processes,
+                                       options.chunk_size)
+        population.evaluator = evaluator
+        ph = population(init=int(parameters['population_initial_size']),
+                        species=species)
+        ph.childCount = int(parameters['population_new_children'])
+        ph.survivorCount = int(parameters.get('population_survivors', 0)) or None
+
+    timer = None
+    if options.timing or options.timing_report:
+        timer = PhaseTimer()
+        ph.timer = timer
     
     if not quiet:
         print "Pattern Length: %i, Instruments: %i" % (length, instrument_length)
         print "Generations: %i" % max_generations
-        print "Selector: %s" % pattern.selector.name
-        print "Crossover: %s" % pattern.crossover.name
+        print "Selector: %s" % spec.selector
+        print "Crossover: %s" % spec.crossover
         print "Mutators:\n\t%s" % "\n\t".join(mutators)
         print "Fitness Trajectories:"
-        print trajectory_set
+        print spec.trajectories
         #print "Parameters:"
         #print parameters
     
@@ -145,62 +325,126 @@ def main(pattern_id=None):
     statfile = "/home/huddlej/fitbeats/testData.txt"
     stopfile = "/home/huddlej/fitbeats/stopfile.txt"
 
-    while i < max_generations:
-        # Check for file-based exit command.
-        if database_dump:
-            try:
-                fhandle = open(stopfile, "r")
-                stop = pickle.load(fhandle)
-                if stop:
-                    break
-            except:
-                pass
-    
+    if options.islands > 0:
         try:
-            b = ph.best()
-            diversity = ph.diversity()
-            #b = ph.worst()
-            
+            results = archipelago.run(max_generations)
+        except IslandException, e:
+            print "Error: %s" % e
+            sys.exit(1)
+        b = archipelago.best(results)
+        lastBest = b.fitness()
+
+        if not quiet:
+            for result in results:
+                print "island %i (%s): best=%f" % (result.index,
+                                                   islands[result.index],
+                                                   result.best[0][1])
+    elif options.steady_state:
+        steady_state = SteadyState(ph, options.replacement,
+                                   options.replacement_size, options.processes)
+        # Report as often as a generational run would.
+        interval = 2 * ph.childCount
+        max_evaluations = options.max_evaluations or max_generations * interval
+
+        def report(evaluations, population):
+            b = population.best()
             if not quiet:
-                print "generation %i:\n%s best=%f, average=%f, diversity=%f)" % (i, 
-                                                                                 repr(b),
-                                                                                 b.fitness(),
-                                                                                 ph.fitness(),
-                                                                                 diversity)
+                print "evaluations %i:\n%s best=%f, average=%f" % (evaluations,
+                                                                   repr(b),
+                                                                   b.fitness(),
+                                                                   population.fitness())
+            stats[evaluations] = {'evaluations': evaluations,
+                                  'bestfitness': b.fitness(),
+                                  'popfitness': population.fitness(),
+                                  'best_pattern': b,
+                                  'is_done': False}
+
+        try:
+            steady_state.run(max_evaluations, report, interval)
+        except KeyboardInterrupt:
+            pass
+        steady_state.close()
+
+        b = ph.best()
+        lastBest = b.fitness()
+        if not quiet:
+            print "%i evaluations, %i children inserted" % (steady_state.evaluations,
+                                                           steady_state.inserted)
+    else:
+        while i < max_generations:
+            # Check for file-based exit command.
+            if database_dump:
+                try:
+                    fhandle = open(stopfile, "r")
+                    stop = pickle.load(fhandle)
+                    if stop:
+                        break
+                except:
+                    pass
+    
+            try:
+                b = ph.best()
+                if timer is not None:
+                    timer.lap(BEST)
+
+                if options.diversity_samples > 0:
+                    diversity, low, high = ph.diversityInterval(None,
+                                                                options.diversity_measure,
+                                                                options.diversity_samples)
+                else:
+                    diversity = low = high = ph.diversity(measure=options.diversity_measure)
+                #b = ph.worst()
+                if timer is not None:
+                    timer.lap(DIVERSITY)
             
-            stats[i] = {'generation': i, 
-                        'bestfitness': b.fitness(), 
-                        'popfitness': ph.fitness(),
-                        'diversity': diversity,
-                        'best_pattern': b,
-                        'is_done': False}
-            webstats = stats[i]            
-            # Store for web, TODO: make this better
-            fhandle = open(statfile, "w")
-            pickle.dump(webstats, fhandle)
-            fhandle.close()
+                if not quiet:
+                    print "generation %i:\n%s best=%f, average=%f, diversity=%f)" % (i, 
+                                                                                     repr(b),
+                                                                                     b.fitness(),
+                                                                                     ph.fitness(),
+                                                                                     diversity)
+                    if options.diversity_samples > 0:
+                        print "diversity 95%% confidence interval: %f - %f" % (low, high)
+                if timer is not None:
+                    timer.lap(REPORT)
             
-            if b.fitness() <= 0:
-                break
+                stats[i] = {'generation': i, 
+                            'bestfitness': b.fitness(), 
+                            'popfitness': ph.fitness(),
+                            'diversity': diversity,
+                            'diversity_low': low,
+                            'diversity_high': high,
+                            'best_pattern': b,
+                            'is_done': False}
+                webstats = stats[i]            
+                # Store for web, TODO: make this better
+                fhandle = open(statfile, "w")
+                pickle.dump(webstats, fhandle)
+                fhandle.close()
+                if timer is not None:
+                    timer.lap(STATS)
+            
+                if b.fitness() <= 0:
+                    break
                 
-            if lastBest > b.fitness():
-                lastBest = b.fitness()
-                lastBestCount = 1
-            else:
-                lastBestCount += 1
+                if lastBest > b.fitness():
+                    lastBest = b.fitness()
+                    lastBestCount = 1
+                else:
+                    lastBestCount += 1
                 
-            #if lastBestCount > 10:
-            #    break
-            ph.gen()
+                #if lastBestCount > 10:
+                #    break
+                ph.gen()
 
-            i += 1
-        except KeyboardInterrupt:
-            break
+                i += 1
+            except KeyboardInterrupt:
+                break
 
     if database_dump:
-        p = PatternInstance(pattern=pattern,
-                            fitness=b.fitness(),
-                            value=b.xmlDumps())
+        p = pattern_models().PatternInstance(pattern_id=spec.pattern_id,
+                                             fitness=b.fitness(),
+                                             value=b.xmlDumps())
         p.save()
     
     if webstats:
@@ -209,8 +453,21 @@ def main(pattern_id=None):
         pickle.dump(webstats, fhandle)
         fhandle.close()
             
+    if evaluator is not None:
+        evaluator.close()
+
+    if options.timing_report:
+        timer.write(options.timing_report)
+
     if not quiet:
         print "Stopped:\n%f" % lastBest
+        if isinstance(evaluator, Coordinator):
+            for worker in evaluator.stats():
+                print "Worker %s" % worker
+        if species.fitness_cache is not None:
+            print "Fitness cache: %(hits)i hits, %(misses)i misses, %(size)i entries" % species.fitness_cache.stats()
+        if timer is not None:
+            print timer
         #print "Average diversity: %f" % ph.diversity()
     
     # Store new statistics data
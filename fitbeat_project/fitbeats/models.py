@@ -5,6 +5,8 @@ from django.db import models
 from django.db.models import permalink
 from django.contrib.auth.models import User
 from django.template.defaultfilters import slugify
+from django.db.models import signals
+from django.dispatch import dispatcher
 from functions import bezier
 
 TRAJECTORY_TYPES = (
@@ -51,6 +53,15 @@ class Selector(models.Model):
     def get_short_name(self):
         return "%s%s" % (self.name.replace(" ", ""), self.__class__.__name__)
 
+    def get_parameters(self):
+        """
+        @return dict the value of each of the selector's parameters by name
+        """
+        parameters = {}
+        for parameter in self.parameters.all():
+            parameters[str(parameter.name)] = parameter.value
+        return parameters
+
     class Admin:
         pass
 
@@ -296,6 +307,63 @@ class PatternInstance(models.Model):
     class Admin:
         pass
 
+# Run spec snapshots (see snapshot.py) are invalidated whenever a row they were
+# exported from is saved or deleted, so the next run exports them again.  Rows
+# are handled before they are deleted, while their relations can still be
+# followed.
+#
+# Django sends no signal when only the many to many relations of a pattern
+# (its instruments, mutators and parameters) change.  Code that changes them
+# must save the pattern afterwards or call invalidate_snapshots itself.
+
+# Rows shared by many patterns; changing one invalidates every snapshot.
+SHARED_MODELS = (Selector, Crossover, Mutator, Instrument, FitnessFunction)
+
+TRAJECTORY_VALUE_MODELS = (FitnessTrajectoryCoordinate, FitnessTrajectoryInteger,
+                           FitnessTrajectoryBoolean, FitnessTrajectoryFloat)
+
+def snapshot_patterns(instance):
+    """
+    @param Model instance a pattern, parameter, trajectory or trajectory value
+    @return list the ids of the patterns whose run specs depend on the row
+    """
+    if isinstance(instance, Pattern):
+        return [instance.id]
+    elif isinstance(instance, FitnessTrajectory):
+        return [instance.pattern_id]
+    elif isinstance(instance, Parameter):
+        patterns = Pattern.objects.filter(parameters__id=instance.id)
+        selector_patterns = Pattern.objects.filter(selector__parameters__id=instance.id)
+        return [pattern.id for pattern in patterns] + \
+               [pattern.id for pattern in selector_patterns]
+    elif instance.trajectory_id:
+        try:
+            return [FitnessTrajectory.objects.get(pk=instance.trajectory_id).pattern_id]
+        except FitnessTrajectory.DoesNotExist:
+            pass
+    return []
+
+def invalidate_snapshots(sender, instance):
+    """
+    @param class sender the model of the changed row
+    @param Model instance the changed row
+    """
+    # Imported here so the web application does not load the evolution
+    # engine.
+    from snapshot import SnapshotCache
+
+    snapshots = SnapshotCache()
+    if sender in SHARED_MODELS:
+        snapshots.clear()
+    else:
+        for pattern_id in snapshot_patterns(instance):
+            if pattern_id is not None:
+                snapshots.invalidate(pattern_id)
+
+for model in (Pattern, Parameter, FitnessTrajectory) + TRAJECTORY_VALUE_MODELS + SHARED_MODELS:
+    dispatcher.connect(invalidate_snapshots, signal=signals.post_save, sender=model)
+    dispatcher.connect(invalidate_snapshots, signal=signals.pre_delete, sender=model)
+
 """
 class PatternInstanceComplete:
     length = models.IntegerField(help_text="The number of beats in this pattern.")
@@ -92,6 +92,8 @@ def edit_pattern(request, id):
         form = PatternForm(request.POST)
         if form.is_valid():
             form.save()
+            # The form saves the pattern before its instruments and mutators.
+            invalidate_snapshots(Pattern, pattern)
             return HttpResponseRedirect(pattern.get_absolute_url())
     else:
         form = PatternForm()
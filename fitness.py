@@ -11,7 +11,12 @@ a joining function and its linear parameters, "a" and "b".
 from random import randint
 from math import floor, ceil
 from collections import deque
+import Numeric
+from genome import bit_count, gene_values, pack_genomes, pack_row, popcount
+from registry import fitness_functions, batch_form, partial_form, delta_form
+from cache import FitnessCache
 
+@fitness_functions.register('temporal_beat_density', 'fTemporalBeatDensity')
 def temporal_beat_density(individual, ft):
     """
     @param PatternOrganism individual
@@ -26,7 +31,7 @@ def temporal_beat_density(individual, ft):
         actual_total = 0
         for row_index in row_range:
             # Calculate actual values
-            if(individual.genes[row_index][column_index].value > 0):
+            if(individual.genes[row_index][column_index] > 0):
                 actual_total += 1
 
         #Calculate expected values
@@ -35,6 +40,7 @@ def temporal_beat_density(individual, ft):
         #print "Expected: %i, Actual: %i" % (expected_total, actual_total)
     return fitness
 
+@fitness_functions.register('instrument_beat_density', 'fInstrumentBeatDensity')
 def instrument_beat_density(individual, ft):
     """
     Calculate beat density over the length of a pattern for each instrument.
@@ -53,7 +59,7 @@ def instrument_beat_density(individual, ft):
 
         for column_index in column_range:
             # Calculate actual values
-            if(individual.genes[row_index][column_index].value > 0):
+            if(individual.genes[row_index][column_index] > 0):
                 actual_value += 1
 
         # Calculate fitness as square of the difference between expected and 
@@ -62,6 +68,176 @@ def instrument_beat_density(individual, ft):
         
     return fitness
 
+@batch_form(temporal_beat_density)
+def temporal_beat_density_batch(genomes, ft):
+    """
+    Calculate temporal beat density for a batch of genomes at once.  Returns
+    the same values as temporal_beat_density for each genome.
+
+    >>> import benchmark, RandomArray
+    >>> from evaluator import EvaluationGenome
+    >>> ft = benchmark.synthetic_trajectories(8, 4)[0]
+    >>> genomes = RandomArray.randint(0, 2, (20, 4, 8))
+    >>> batch = temporal_beat_density_batch(genomes, ft)
+    >>> [abs(batch[i] - temporal_beat_density(EvaluationGenome(genomes[i], 4, 8), ft)) < 1e-9
+    ...  for i in xrange(20)] == [True] * 20
+    True
+
+    @param array genomes (organisms x instruments x length) genome array
+    @param FitnessTrajectory ft
+    @return array the fitness of each genome
+    """
+    dim_col = Numeric.shape(genomes)[2]
+    beats = Numeric.greater(genomes, 0).astype(Numeric.Int)
+
+    # Count the beats in each column of each genome.
+    actual = Numeric.add.reduce(beats, 1)
+    expected = Numeric.array([value[1] for value in ft.values[:dim_col]],
+                             Numeric.Float)
+
+    return Numeric.add.reduce((expected - actual) ** 2, 1)
+
+@batch_form(instrument_beat_density)
+def instrument_beat_density_batch(genomes, ft):
+    """
+    Calculate instrument beat density for a batch of genomes at once.  Returns
+    the same values as instrument_beat_density for each genome.
+
+    >>> import benchmark, RandomArray
+    >>> from evaluator import EvaluationGenome
+    >>> ft = benchmark.synthetic_trajectories(8, 4)[1]
+    >>> genomes = RandomArray.randint(0, 2, (20, 4, 8))
+    >>> batch = instrument_beat_density_batch(genomes, ft)
+    >>> [abs(batch[i] - instrument_beat_density(EvaluationGenome(genomes[i], 4, 8), ft)) < 1e-9
+    ...  for i in xrange(20)] == [True] * 20
+    True
+
+    @param array genomes (organisms x instruments x length) genome array
+    @param FitnessTrajectory ft
+    @return array the fitness of each genome
+    """
+    beats = Numeric.greater(genomes, 0).astype(Numeric.Int)
+
+    # Count the beats in each requested row of each genome.
+    rows = [value[0] for value in ft.values]
+    actual = Numeric.take(Numeric.add.reduce(beats, 2), rows, 1)
+    expected = Numeric.array([value[1] for value in ft.values], Numeric.Float)
+
+    return Numeric.add.reduce((expected - actual) ** 2, 1)
+
+@partial_form(temporal_beat_density)
+def temporal_beat_density_partials(individual, ft):
+    """
+    @param PatternOrganism individual
+    @param FitnessTrajectory ft
+    @return tuple the fitness and the number of beats in each column
+    """
+    dim_row = individual.instrument_length
+    genes = individual.genes
+
+    counts = []
+    for column_index in xrange(individual.length):
+        actual_total = 0
+        for row_index in xrange(dim_row):
+            if(genes[row_index][column_index] > 0):
+                actual_total += 1
+        counts.append(actual_total)
+
+    return _temporal_beat_density_fitness(counts, ft), counts
+
+@delta_form(temporal_beat_density)
+def temporal_beat_density_delta(individual, ft, counts, changes):
+    """
+    Update the column beat counts from the changed genes.
+
+    >>> import benchmark, random, RandomArray
+    >>> from evaluator import EvaluationGenome
+    >>> ft = benchmark.synthetic_trajectories(8, 4)[0]
+    >>> individual = EvaluationGenome(RandomArray.randint(0, 2, (4, 8)), 4, 8)
+    >>> fitness, counts = temporal_beat_density_partials(individual, ft)
+    >>> fitness == temporal_beat_density(individual, ft)
+    True
+    >>> changes = [(index / 8, index % 8, individual.genes[index / 8, index % 8])
+    ...            for index in random.sample(xrange(32), 5)]
+    >>> for row, column, value in changes:
+    ...     individual.genes[row, column] = 1 - value
+    >>> fitness, counts = temporal_beat_density_delta(individual, ft, counts, changes)
+    >>> abs(fitness - temporal_beat_density(individual, ft)) < 1e-9
+    True
+    """
+    counts = counts[:]
+    for row_index, column_index, value in changes:
+        if value > 0:
+            counts[column_index] -= 1
+        else:
+            counts[column_index] += 1
+
+    return _temporal_beat_density_fitness(counts, ft), counts
+
+def _temporal_beat_density_fitness(counts, ft):
+    fitness = 0.0
+    for column_index in xrange(len(counts)):
+        expected_total = ft.values[column_index][1]
+        fitness += (expected_total - counts[column_index])**2
+    return fitness
+
+@partial_form(instrument_beat_density)
+def instrument_beat_density_partials(individual, ft):
+    """
+    @param PatternOrganism individual
+    @param FitnessTrajectory ft
+    @return tuple the fitness and the number of beats in each requested row
+    """
+    genes = individual.genes
+
+    counts = {}
+    for value in ft.values:
+        row_index = value[0]
+        actual_value = 0
+        for column_index in xrange(individual.length):
+            if(genes[row_index][column_index] > 0):
+                actual_value += 1
+        counts[row_index] = actual_value
+
+    return _instrument_beat_density_fitness(counts, ft), counts
+
+@delta_form(instrument_beat_density)
+def instrument_beat_density_delta(individual, ft, counts, changes):
+    """
+    Update the row beat counts from the changed genes of requested rows.
+
+    >>> import benchmark, random, RandomArray
+    >>> from evaluator import EvaluationGenome
+    >>> ft = benchmark.synthetic_trajectories(8, 4)[1]
+    >>> individual = EvaluationGenome(RandomArray.randint(0, 2, (4, 8)), 4, 8)
+    >>> fitness, counts = instrument_beat_density_partials(individual, ft)
+    >>> fitness == instrument_beat_density(individual, ft)
+    True
+    >>> changes = [(index / 8, index % 8, individual.genes[index / 8, index % 8])
+    ...            for index in random.sample(xrange(32), 5)]
+    >>> for row, column, value in changes:
+    ...     individual.genes[row, column] = 1 - value
+    >>> fitness, counts = instrument_beat_density_delta(individual, ft, counts, changes)
+    >>> fitness == instrument_beat_density(individual, ft)
+    True
+    """
+    counts = counts.copy()
+    for row_index, column_index, value in changes:
+        if counts.has_key(row_index):
+            if value > 0:
+                counts[row_index] -= 1
+            else:
+                counts[row_index] += 1
+
+    return _instrument_beat_density_fitness(counts, ft), counts
+
+def _instrument_beat_density_fitness(counts, ft):
+    fitness = 0.0
+    for value in ft.values:
+        fitness += (value[1] - counts[value[0]])**2
+    return fitness
+
+@fitness_functions.register('unison', 'fUnison')
 def unison(individual, ft):
     """
     Determine the degree to which the requested number of instruments are
@@ -70,72 +246,204 @@ def unison(individual, ft):
     @param PatternOrganism individual
     @param FitnessTrajectory ft
     """
-    dim_col = individual.length
-    fitness = 0.0    
-    actual_value = 0
+    # If there is only one instrument, it is already in unison with itself.
+    if len(ft.values) == 1:
+        return 0
+
+    genomes = Numeric.reshape(gene_values(individual.genes),
+                              (1, individual.instrument_length, individual.length))
+    return unison_batch(genomes, ft)[0]
+
+@batch_form(unison)
+def unison_batch(genomes, ft):
+    """
+    Calculate unison for a batch of genomes at once.  The requested rows of
+    each genome are packed into bytes so the number of beats that differ
+    between two rows is the population count of the rows' exclusive or.
+
+    Every requested row is compared to each row after the first and the
+    mismatches accumulate across rows.  After each row, the square of the
+    accumulated mismatches is added to the fitness.  The result is the same
+    as comparing the rows beat by beat:
 
+    >>> import benchmark, RandomArray
+    >>> ft = benchmark.synthetic_trajectories(10, 6)[2]
+    >>> genomes = RandomArray.randint(0, 2, (20, 6, 10))
+    >>> def compare_beats(genes, rows):
+    ...     fitness = actual_value = 0.0
+    ...     for row_a in rows[:-1]:
+    ...         for row_b in rows[1:]:
+    ...             actual_value += len([column for column in xrange(10)
+    ...                                  if genes[row_a, column] != genes[row_b, column]])
+    ...         fitness += actual_value ** 2
+    ...     return fitness
+    >>> batch = unison_batch(genomes, ft)
+    >>> [batch[i] == compare_beats(genomes[i], ft.values) for i in xrange(20)] == [True] * 20
+    True
+
+    @param array genomes (organisms x instruments x length) genome array
+    @param FitnessTrajectory ft
+    @return array the fitness of each genome
+    """
+    count = Numeric.shape(genomes)[0]
+    fitness = Numeric.zeros(count, Numeric.Float)
     value_count = len(ft.values)
-    
+
     # If there is only one instrument, it is already in unison with itself.
-    if value_count == 1:
-        return 0
+    if value_count <= 1:
+        return fitness
 
-    rows_a = xrange(value_count - 1)
-    rows_b = xrange(1, value_count)
-    for i in rows_a:
-        row_a = ft.values[i]
-        for j in rows_b:
-            row_b = ft.values[j]
-                
-            for column_index in xrange(dim_col):
-                # If value in instrument i is not the same as value in master_row, 
-                # decrease fitness by increasing total
-                if individual.genes[row_a][column_index] != individual.genes[row_b][column_index]:
-                    actual_value += 1
+    rows = pack_genomes(Numeric.take(genomes, ft.values, 1))
+    actual_value = Numeric.zeros(count, Numeric.Float)
+    for i in xrange(value_count - 1):
+        mismatches = popcount(Numeric.bitwise_xor(rows[:, i:i + 1], rows[:, 1:]))
+        actual_value = actual_value + Numeric.add.reduce(
+            Numeric.add.reduce(mismatches, 2), 1)
 
-        # Calculate fitness as square of the difference between expected and 
+        # Calculate fitness as square of the difference between expected and
         # actual values.
         expected_value = 0
-        fitness += (expected_value - actual_value)**2
+        fitness = fitness + (expected_value - actual_value) ** 2
+
+    return fitness
+
+@partial_form(unison)
+def unison_partials(individual, ft):
+    """
+    @param PatternOrganism individual
+    @param FitnessTrajectory ft
+    @return tuple the fitness and a pair of the bitmask of each requested row
+                  and the matrix of mismatched beats between requested rows
+    """
+    if len(ft.values) <= 1:
+        return unison(individual, ft), None
+
+    genes = gene_values(individual.genes)
+    masks = [pack_row(genes[row].tolist()) for row in ft.values]
+    mismatches = [[bit_count(first ^ second) for second in masks]
+                  for first in masks]
+
+    return _unison_fitness(mismatches), (masks, mismatches)
+
+@delta_form(unison)
+def unison_delta(individual, ft, partials, changes):
+    """
+    Flip the changed beats in the bitmasks of the requested rows and recount
+    the mismatches of those rows only.
+
+    >>> import benchmark, random, RandomArray
+    >>> from evaluator import EvaluationGenome
+    >>> ft = benchmark.synthetic_trajectories(10, 6)[2]
+    >>> individual = EvaluationGenome(RandomArray.randint(0, 2, (6, 10)), 6, 10)
+    >>> fitness, partials = unison_partials(individual, ft)
+    >>> fitness == unison(individual, ft)
+    True
+    >>> changes = [(index / 10, index % 10, individual.genes[index / 10, index % 10])
+    ...            for index in random.sample(xrange(60), 8)]
+    >>> for row, column, value in changes:
+    ...     individual.genes[row, column] = 1 - value
+    >>> fitness, partials = unison_delta(individual, ft, partials, changes)
+    >>> fitness == unison(individual, ft)
+    True
+    """
+    if partials is None:
+        return unison(individual, ft), None
+
+    masks = partials[0][:]
+    changed = {}
+    for row_index, column_index, value in changes:
+        for i in xrange(len(masks)):
+            if ft.values[i] == row_index:
+                masks[i] ^= 1 << column_index
+                changed[i] = True
+
+    mismatches = [row[:] for row in partials[1]]
+    for i in changed.keys():
+        for j in xrange(len(masks)):
+            mismatches[i][j] = mismatches[j][i] = bit_count(masks[i] ^ masks[j])
+
+    return _unison_fitness(mismatches), (masks, mismatches)
 
+def _unison_fitness(mismatches):
+    """
+    Accumulate mismatches in the same order as unison_batch.
+    """
+    fitness = 0.0
+    actual_value = 0.0
+    for i in xrange(len(mismatches) - 1):
+        actual_value += sum(mismatches[i][1:])
+        expected_value = 0
+        fitness += (expected_value - actual_value) ** 2
     return fitness
 
+@fitness_functions.register('double_rhythms', 'fDoubleRhythms')
 def double_rhythms(individual, ft):
     """
     Determine the degree to which the requested number of instruments are
     not playing in double rhythm.
+
+    Two rows play in double rhythm when the spacing between their beats is the
+    same up to a rotation, which is the case exactly when one row is a
+    rotation of the other.  Rows are compared by the canonical rotation of
+    their bitmasks; rows without beats never match.
+
+    The silence after the last beat of every row counts towards its first
+    gap.  Before rows were compared by rotation only the last row listed had
+    its trailing silence counted, so this master row did not match:
+
+    >>> from genome import GENOME_TYPECODE
+    >>> from evaluator import CompiledTrajectory, EvaluationGenome
+    >>> genes = Numeric.zeros((2, 8), GENOME_TYPECODE)
+    >>> genes[0, 1] = genes[0, 5] = genes[1, 2] = genes[1, 6] = 1
+    >>> ft = CompiledTrajectory("double_rhythms", [], "0,1", 0)
+    >>> double_rhythms(EvaluationGenome(genes, 2, 8), ft)
+    0.0
+    >>> genes[1, 6] = 0
+    >>> double_rhythms(EvaluationGenome(genes, 2, 8), ft)
+    2.0
     
     @param PatternOrganism individual
     @param FitnessTrajectory ft
     """
-    dim_row = individual.instrument_length
-    dim_col = individual.length
-    fitness = 0.0
+    return double_rhythms_partials(individual, ft)[0]
 
+@partial_form(double_rhythms)
+def double_rhythms_partials(individual, ft):
+    """
+    @param PatternOrganism individual
+    @param FitnessTrajectory ft
+    @return tuple the fitness and the bitmask of the master and each
+                  instrument row
+    """
+    genes = gene_values(individual.genes)
+    masks = {}
+    for row in [ft.master_row] + _double_rhythm_rows(ft):
+        masks[row] = pack_row(genes[row].tolist())
+
+    return _double_rhythms_fitness(individual, ft, masks), masks
+
+@delta_form(double_rhythms)
+def double_rhythms_delta(individual, ft, masks, changes):
+    """
+    Flip the changed beats in the bitmasks of the compared rows.
+    """
+    masks = masks.copy()
+    for row_index, column_index, value in changes:
+        if masks.has_key(row_index):
+            masks[row_index] ^= 1 << column_index
+
+    return _double_rhythms_fitness(individual, ft, masks), masks
+
+def _double_rhythm_rows(ft):
+    """
+    @return list the instrument rows compared to the master row
+    """
     unified_instruments = [int(i) for i in ft.rows.split(",")]
     master_row = ft.master_row
 
     if not master_row in unified_instruments:
         unified_instruments.append(master_row)
 
-    # Calculate distances between beats for each instrument row.
-    distances = {}
-    column_range = xrange(dim_col)
-    for instrument_row in unified_instruments:
-        distances[instrument_row] = []
-        count = 0
-        
-        for column_index in column_range:
-            beat = individual.genes[instrument_row][column_index].toscalar()
-            if beat:
-                distances[instrument_row].append(count)
-                count = 0
-                continue
-            count += 1
-
-    if len(distances[instrument_row]) > 0:
-        distances[instrument_row][0] += count
-
     # Remove the master row from the list if it is listed
     try:
         index = unified_instruments.index(master_row)
@@ -143,34 +451,148 @@ def double_rhythms(individual, ft):
     except ValueError:
         pass
 
+    return unified_instruments
+
+def _double_rhythms_fitness(individual, ft, masks):
+    fitness = 0.0
+
     # Compare each instrument row's beat spacings to the master row's
-    actual_value = 0
-    master_distance = deque(distances[master_row])
-    
-    for instrument_row in unified_instruments:
-        distance = deque(distances[instrument_row])
-        match = False
-        for j in xrange(len(distance)):
-            if j > 0:
-                distance.rotate(1)
-            
-            if distance == master_distance:
-                match = True
-                break
-            
-        if match:
-            """
-            print "Match!"
-            print "---"
-            print individual
-            print distances
-            """
+    table = rhythm_table(individual.length)
+    master_rotation = table.canonical(masks[ft.master_row])
+
+    for instrument_row in _double_rhythm_rows(ft):
+        mask = masks[instrument_row]
+        if mask and table.canonical(mask) == master_rotation:
             continue
         else:
             fitness += 2
 
     return fitness
 
+"""
+Rhythm tables
+
+Row-level rhythm features are looked up by the bitmask of an instrument row,
+where bit i is set when the row has a beat in column i.
+"""
+
+# Longest pattern for which rhythm features are kept in a table.
+RHYTHM_TABLE_MAX_LENGTH = 32
+
+# Longest pattern for which tables are filled for every bitmask up front.
+RHYTHM_TABLE_PRECOMPUTED_LENGTH = 12
+
+# The number of bitmasks whose canonical rotations are kept for patterns
+# longer than RHYTHM_TABLE_PRECOMPUTED_LENGTH.
+RHYTHM_TABLE_CACHE_SIZE = 65536
+
+def beat_gaps(mask, length):
+    """
+    Calculate the number of silent beats before each beat of a row.  The
+    silence at the end of the row wraps around to the first beat.  This is
+    the definition of the rhythm that canonical rotations compare.
+
+    >>> beat_gaps(int('0100010001', 2), 10)
+    (1, 3, 3)
+
+    @param int mask
+    @param int length
+    @return tuple
+    """
+    gaps = []
+    count = 0
+    for column in xrange(length):
+        if (mask >> column) & 1:
+            gaps.append(count)
+            count = 0
+        else:
+            count += 1
+
+    if len(gaps) > 0:
+        gaps[0] += count
+
+    return tuple(gaps)
+
+def canonical_rotation(mask, length):
+    """
+    Find the smallest bitmask among all rotations of a row.  Two rows have
+    the same beat gaps up to rotation when their canonical rotations match.
+
+    >>> canonical_rotation(int('0110', 2), 4)
+    3
+
+    Rows with beats match exactly when their beat gaps are rotations of each
+    other:
+
+    >>> from random import Random
+    >>> def rotations(gaps):
+    ...     return [gaps[i:] + gaps[:i] for i in xrange(len(gaps))]
+    >>> generator = Random(1)
+    >>> rows = [generator.randint(0, 1023) for i in xrange(200)]
+    >>> rows += [((row << 3) | (row >> 7)) & 1023 for row in rows]
+    >>> [(a, b) for a in rows[:50] for b in rows
+    ...  if (a != 0 and canonical_rotation(a, 10) == canonical_rotation(b, 10)) !=
+    ...     (beat_gaps(b, 10) in rotations(beat_gaps(a, 10)))]
+    []
+
+    @param int mask
+    @param int length
+    @return int
+    """
+    high_bit = length - 1
+    smallest = rotation = mask
+    for i in xrange(length - 1):
+        rotation = (rotation >> 1) | ((rotation & 1) << high_bit)
+        if rotation < smallest:
+            smallest = rotation
+    return smallest
+
+class RhythmTable(object):
+    """
+    Canonical rotations of row bitmasks for one pattern length.  Short
+    patterns have every bitmask computed up front; longer ones keep the
+    RHYTHM_TABLE_CACHE_SIZE most recently seen rows.  Patterns longer than
+    RHYTHM_TABLE_MAX_LENGTH are computed on every lookup.
+    """
+    def __init__(self, length):
+        self.length = length
+        self._table = None
+        self._cache = None
+
+        if length <= RHYTHM_TABLE_PRECOMPUTED_LENGTH:
+            self._table = [canonical_rotation(mask, length)
+                           for mask in xrange(1 << length)]
+        elif length <= RHYTHM_TABLE_MAX_LENGTH:
+            self._cache = FitnessCache(RHYTHM_TABLE_CACHE_SIZE)
+
+    def canonical(self, mask):
+        """
+        @param int mask
+        @return int the canonical rotation of the row
+        """
+        if self._table is not None:
+            return self._table[mask]
+        if self._cache is None:
+            return canonical_rotation(mask, self.length)
+
+        rotation = self._cache.get(mask)
+        if rotation is None:
+            rotation = self._cache.put(mask, canonical_rotation(mask, self.length))
+        return rotation
+
+_rhythm_tables = {}
+
+def rhythm_table(length):
+    """
+    @param int length
+    @return RhythmTable the shared rhythm table for the given pattern length
+    """
+    try:
+        return _rhythm_tables[length]
+    except KeyError:
+        table = _rhythm_tables[length] = RhythmTable(length)
+        return table
+
 if __name__ == "__main__":
     import os
     os.environ['DJANGO_SETTINGS_MODULE'] = "fitbeat_project.settings"
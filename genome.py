@@ -0,0 +1,190 @@
+"""
+genome.py
+
+Helpers for the compact genome representation used by PackedPatternOrganism.
+
+A packed genome is a two dimensional Numeric array of unsigned bytes with one
+row per instrument and one column per beat.  Each instrument row can also be
+packed into a single integer bitmask where bit i is set when beat i is played.
+"""
+import Numeric
+import copy
+
+# Typecode used for packed genomes: one unsigned byte per beat.
+GENOME_TYPECODE = Numeric.UnsignedInt8
+
+# Weight of each beat within a byte of a bit packed row.
+BIT_WEIGHTS = Numeric.array([1 << i for i in xrange(8)], Numeric.Int)
+
+def _popcount(value):
+    count = 0
+    while value:
+        value &= value - 1
+        count += 1
+    return count
+
+# Number of set bits in each possible byte value.
+BYTE_BIT_COUNTS = [_popcount(i) for i in xrange(256)]
+POPCOUNT = Numeric.array(BYTE_BIT_COUNTS, Numeric.Int)
+
+
+def is_packed(genes):
+    """
+    @param array genes
+    @return boolean whether the genes are stored as plain integer values
+    """
+    return genes.typecode() != Numeric.PyObject
+
+def gene_values(genes):
+    """
+    Return the values of a genome as an integer array regardless of whether
+    the genome stores PatternGene objects or packed integer values.
+
+    @param array genes
+    @return array
+    """
+    if is_packed(genes):
+        return genes
+    return Numeric.array([[gene.value for gene in row]
+                          for row in genes.tolist()], GENOME_TYPECODE)
+
+def copy_genes(genes):
+    """
+    Copy a genome.  Packed genomes are copied with a single memory copy while
+    gene objects are copied individually.
+
+    @param array genes
+    @return array
+    """
+    if is_packed(genes):
+        return Numeric.array(genes, GENOME_TYPECODE)
+    return copy.deepcopy(genes)
+
+def genome_key(genes):
+    """
+    Build a hashable key that is equal for genomes with equal gene values,
+    whichever way the genomes are stored.
+
+    @param array genes
+    @return string
+    """
+    return gene_values(genes).tostring()
+
+def pack_row(row):
+    """
+    Pack a sequence of beat values into an integer bitmask.
+
+    >>> pack_row([1, 0, 1, 1])
+    13
+
+    @param list row
+    @return int
+    """
+    mask = 0
+    bit = 1
+    for value in row:
+        if value > 0:
+            mask |= bit
+        bit <<= 1
+    return mask
+
+def unpack_row(mask, length):
+    """
+    Unpack an integer bitmask into a list of beat values.
+
+    >>> unpack_row(13, 4)
+    [1, 0, 1, 1]
+
+    @param int mask
+    @param int length
+    @return list
+    """
+    return [(mask >> i) & 1 for i in xrange(length)]
+
+def pack_rows(genes):
+    """
+    @param array genes
+    @return list the bitmask for each instrument row
+    """
+    return [pack_row(row) for row in gene_values(genes).tolist()]
+
+def pack_genomes(genomes):
+    """
+    Pack the beats in the last dimension of a genome array into bytes, eight
+    beats per byte with beat i stored in bit i % 8 of byte i / 8.  The bytes
+    of a row hold the same bits as the row's pack_row bitmask, and their
+    popcount adds up to its bit_count:
+
+    >>> import RandomArray
+    >>> genomes = RandomArray.randint(0, 2, (10, 4, 19))
+    >>> packed = pack_genomes(genomes)
+    >>> Numeric.shape(packed)
+    (10, 4, 3)
+    >>> rows = [(genome, row) for genome in xrange(10) for row in xrange(4)]
+    >>> [sum([int(byte) << (8 * i) for i, byte in enumerate(packed[g, r])])
+    ...  for g, r in rows] == [pack_row(genomes[g, r]) for g, r in rows]
+    True
+    >>> ([sum(popcount(packed[g, r])) for g, r in rows] ==
+    ...  [bit_count(pack_row(genomes[g, r])) for g, r in rows])
+    True
+    >>> unpack_genomes(packed, 19).tolist() == genomes.tolist()
+    True
+
+    @param array genomes array of beat values whose last dimension is length
+    @return array array of bytes whose last dimension is (length + 7) / 8
+    """
+    shape = Numeric.shape(genomes)
+    axis = len(shape) - 1
+    length = shape[axis]
+    byte_count = (length + 7) / 8
+    beats = Numeric.greater(genomes, 0).astype(Numeric.Int)
+
+    padding = byte_count * 8 - length
+    if padding:
+        beats = Numeric.concatenate(
+            (beats, Numeric.zeros(shape[:axis] + (padding,), Numeric.Int)), axis)
+
+    beats = Numeric.reshape(beats, shape[:axis] + (byte_count, 8))
+    return Numeric.add.reduce(beats * BIT_WEIGHTS, axis + 1).astype(GENOME_TYPECODE)
+
+def popcount(packed):
+    """
+    @param array packed array of bytes
+    @return array the number of set bits in each byte
+    """
+    return Numeric.take(POPCOUNT, packed)
+
+def bit_count(mask):
+    """
+    >>> bit_count(13)
+    3
+
+    @param int mask a packed row
+    @return int the number of beats in the row
+    """
+    count = 0
+    while mask:
+        count += BYTE_BIT_COUNTS[mask & 0xff]
+        mask >>= 8
+    return count
+
+def unpack_genomes(packed, length):
+    """
+    Unpack bytes built by pack_genomes into beat values.
+
+    @param array packed array of bytes whose last dimension is (length + 7) / 8
+    @param int length the number of beats in the last dimension
+    @return array array of beat values whose last dimension is length
+    """
+    shape = Numeric.shape(packed)
+    axis = len(shape) - 1
+    byte_count = shape[axis]
+    packed = Numeric.reshape(packed, (-1, byte_count, 1))
+    beats = Numeric.greater(Numeric.bitwise_and(packed, BIT_WEIGHTS), 0)
+    beats = Numeric.reshape(beats, (-1, byte_count * 8))[:, :length]
+    return Numeric.reshape(beats, shape[:axis] + (length,)).astype(GENOME_TYPECODE)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
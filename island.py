@@ -0,0 +1,364 @@
+"""
+island.py
+
+Island model evolution.
+
+An archipelago evolves several PatternPopulations, the islands, in separate
+processes.  Each island may use its own selector, crossover and mutators.
+Every interval generations each island sends copies of its best organisms to
+the islands it is connected to by the migration topology, where they replace
+the worst organisms.  Islands use packed genomes and only genome bytes and
+fitness values are sent between processes.
+
+An island that raises an exception sends its traceback instead of its
+result, and the archipelago stops the other islands and raises an
+IslandException.  The archipelago also fails the run if an island process
+dies without a result, and an island fails if its immigrants do not arrive
+within the migration timeout.
+"""
+import random
+import traceback
+import Queue
+import Numeric
+import RandomArray
+from genome import GENOME_TYPECODE, genome_key
+from registry import selectors, crossovers
+from evaluator import compile_trajectories
+from cache import FitnessCache
+from pattern import PatternPopulation
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Migration topologies
+RING = "ring"
+COMPLETE = "complete"
+ISOLATED = "isolated"
+TOPOLOGIES = (RING, COMPLETE, ISOLATED)
+
+# Seconds between checks that the island processes are alive.
+POLL_INTERVAL = 1.0
+
+
+class IslandException(Exception):
+    pass
+
+
+def migration_targets(topology, count):
+    """
+    @param string topology RING sends migrants to the next island, COMPLETE
+                           to every other island and ISOLATED to none
+    @param int count the number of islands
+    @return list the islands each island sends migrants to
+    """
+    if topology == RING:
+        if count < 2:
+            return [[] for i in xrange(count)]
+        return [[(i + 1) % count] for i in xrange(count)]
+    elif topology == COMPLETE:
+        return [[j for j in xrange(count) if j != i] for i in xrange(count)]
+    elif topology == ISOLATED:
+        return [[] for i in xrange(count)]
+    else:
+        raise IslandException("Unknown migration topology: %s" % topology)
+
+
+class Island(object):
+    """
+    The operators used by one island.  Operators that are None are those of
+    the archipelago's species.
+    """
+    def __init__(self, selector, selector_parameters=None, crossover=None,
+                 mutators=None):
+        """
+        @param string selector the name of a registered selector
+        @param dict selector_parameters
+        @param string crossover the name of a registered crossover
+        @param list mutators the names of registered mutators
+        """
+        self.selector = selector
+        self.selector_parameters = selector_parameters or {}
+        self.crossover = crossover
+        self.mutators = mutators
+
+    def __str__(self):
+        return "%s, %s, %s" % (self.selector, self.crossover or "default crossover",
+                               ", ".join(self.mutators or ["default mutators"]))
+
+
+def make_islands(count, selector, selector_parameters=None, selector_names=None,
+                 crossover_names=None, mutator_names=None):
+    """
+    Assign operators to islands in turn.  Only the islands that use the
+    pattern's own selector get its selector parameters; the other selectors
+    keep their defaults, since selectors reject parameters they don't define.
+
+    >>> islands = make_islands(4, "TournamentSelector", {'tournament_size': 5.0},
+    ...                        ["TournamentSelector", "RankSelector"])
+    >>> [island.selector_parameters for island in islands]
+    [{'tournament_size': 5.0}, {}, {'tournament_size': 5.0}, {}]
+    >>> [selectors.resolve(island.selector)(**island.selector_parameters).__class__.__name__
+    ...  for island in islands]
+    ['TournamentSelector', 'RankSelector', 'TournamentSelector', 'RankSelector']
+
+    @param int count the number of islands
+    @param string selector the name of the pattern's selector
+    @param dict selector_parameters the pattern's selector parameters
+    @param list selector_names the selectors of the islands, or None for the
+                               pattern's selector
+    @param list crossover_names the crossovers of the islands, or None for the
+                                species' crossover
+    @param list mutator_names lists of mutator names for the islands, or None
+                              for the species' mutators
+    @return list Island objects
+    """
+    selector_names = selector_names or [selector]
+    crossover_names = crossover_names or [None]
+    mutator_names = mutator_names or [None]
+    default = selectors.resolve(selector)
+
+    islands = []
+    for island in xrange(count):
+        name = selector_names[island % len(selector_names)]
+        if selectors.resolve(name) is default:
+            parameters = selector_parameters
+        else:
+            parameters = {}
+        islands.append(Island(name, parameters,
+                              crossover_names[island % len(crossover_names)],
+                              mutator_names[island % len(mutator_names)]))
+    return islands
+
+
+class IslandResult(object):
+    def __init__(self, index, best, history, error=None):
+        """
+        @param int index
+        @param list best (genome bytes, fitness) of the island's best organisms
+        @param list history the best fitness after each generation
+        @param string error the traceback of an island that failed
+        """
+        self.index = index
+        self.best = best
+        self.history = history
+        self.error = error
+
+
+class Archipelago(object):
+    """
+    Evolves islands of a configured packed species in separate processes.
+    """
+    def __init__(self, species, islands, initial_size, child_count,
+                 survivor_count=None, topology=RING, interval=10, migrants=2,
+                 cache_size=10000, seed=None, timeout=600.0):
+        """
+        @param class species a configured PackedPatternOrganism class
+        @param list islands an Island for each island
+        @param int initial_size the initial size of each island's population
+        @param int child_count the number of parents selected per generation
+        @param int survivor_count see PatternPopulation.survivorCount
+        @param string topology see migration_targets
+        @param int interval the number of generations between migrations, or
+                            0 for no migration
+        @param int migrants the number of organisms each island sends
+        @param int cache_size the size of each island's fitness cache
+        @param int seed seed for the islands' random numbers, or None
+        @param float timeout the seconds an island waits for its immigrants
+        """
+        if multiprocessing is None:
+            raise IslandException("Island evolution requires the multiprocessing module.")
+
+        self.species = species
+        self.islands = islands
+        self.initial_size = initial_size
+        self.child_count = child_count
+        self.survivor_count = survivor_count
+        self.topology = topology
+        self.interval = interval
+        self.migrants = migrants
+        self.cache_size = cache_size
+        self.seed = seed
+        self.timeout = timeout
+        self.trajectories = compile_trajectories(species.trajectory_set)
+
+    def run(self, generations):
+        """
+        Evolve every island for the given number of generations.
+
+        @param int generations
+        @return list an IslandResult for each island
+        """
+        count = len(self.islands)
+        targets = migration_targets(self.topology, count)
+        sources = [0] * count
+        for island_targets in targets:
+            for target in island_targets:
+                sources[target] += 1
+
+        inboxes = [multiprocessing.Queue() for i in xrange(count)]
+        results = multiprocessing.Queue()
+        processes = [multiprocessing.Process(target=_run_island,
+                                             args=(self, i, generations,
+                                                   targets[i], sources[i],
+                                                   inboxes, results))
+                     for i in xrange(count)]
+        for process in processes:
+            process.start()
+
+        # Collect the results before joining so no process blocks on a full
+        # results queue.
+        island_results = []
+        try:
+            while len(island_results) < count:
+                try:
+                    result = results.get(timeout=POLL_INTERVAL)
+                except Queue.Empty:
+                    reported = [result.index for result in island_results]
+                    dead = [i for i in xrange(count)
+                            if i not in reported and not processes[i].is_alive()]
+                    if not dead:
+                        continue
+                    # A result sent just before the process exited may still
+                    # be on its way.
+                    try:
+                        result = results.get(timeout=POLL_INTERVAL)
+                    except Queue.Empty:
+                        raise IslandException("Island %i stopped without a result (exit code %s)." %
+                                              (dead[0], processes[dead[0]].exitcode))
+
+                if result.error is not None:
+                    raise IslandException("Island %i failed:\n%s" % (result.index,
+                                                                      result.error))
+                island_results.append(result)
+        except:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            for process in processes:
+                process.join()
+            raise
+
+        for process in processes:
+            process.join()
+
+        island_results.sort(lambda a, b: cmp(a.index, b.index))
+        return island_results
+
+    def organism(self, genome, fitness=None):
+        """
+        @param string genome genome bytes, see genome.genome_key
+        @param float fitness
+        @return PackedPatternOrganism
+        """
+        species = self.species
+        genes = Numeric.reshape(Numeric.fromstring(genome, GENOME_TYPECODE),
+                                (species.instrument_length, species.length))
+        return species.fromGenes(genes, fitness)
+
+    def best(self, results):
+        """
+        @param list results IslandResults
+        @return PackedPatternOrganism the best organism of all islands
+        """
+        genome, fitness = min([result.best[0] for result in results],
+                              key=lambda best: best[1])
+        return self.organism(genome, fitness)
+
+    def configure(self, island):
+        """
+        Configure the species for an island in the island's own process.
+
+        @param Island island
+        """
+        species = self.species
+        species.trajectory_set = self.trajectories
+        if island.crossover is not None:
+            species.crossover = crossovers.resolve(island.crossover)()
+        if island.mutators is not None:
+            species.mutators = island.mutators
+        if self.cache_size > 0:
+            species.fitness_cache = FitnessCache(self.cache_size)
+        else:
+            species.fitness_cache = None
+        species.compile()
+
+    def migrate(self, population, immigrants):
+        """
+        Replace the worst organisms of a population with immigrants.
+
+        @param PatternPopulation population
+        @param list immigrants (genome bytes, fitness) pairs
+        """
+        population.sort()
+        count = min(len(immigrants), len(population.organisms) - 1)
+        if count <= 0:
+            return
+
+        population.organisms[-count:] = [self.organism(genome, fitness)
+                                         for genome, fitness in immigrants[:count]]
+        population.sorted = False
+
+    def emigrants(self, population):
+        """
+        @param PatternPopulation population
+        @return list (genome bytes, fitness) of the population's best organisms
+        """
+        population.sort()
+        return [(genome_key(organism.genes), organism.fitness())
+                for organism in population.organisms[:max(1, self.migrants)]]
+
+
+def _run_island(archipelago, index, generations, targets, source_count,
+                inboxes, results):
+    try:
+        results.put(_evolve_island(archipelago, index, generations, targets,
+                                   source_count, inboxes))
+    except Exception:
+        results.put(IslandResult(index, None, None, traceback.format_exc()))
+
+def _evolve_island(archipelago, index, generations, targets, source_count,
+                   inboxes):
+    # Processes start with copies of the parent's random state.
+    if archipelago.seed is None:
+        random.seed()
+    else:
+        random.seed(archipelago.seed + index)
+    RandomArray.seed(random.randint(1, 2 ** 30), random.randint(1, 2 ** 30))
+
+    island = archipelago.islands[index]
+    archipelago.configure(island)
+
+    population = PatternPopulation(init=archipelago.initial_size,
+                                   species=archipelago.species)
+    population.selector = selectors.resolve(island.selector)(**island.selector_parameters)
+    population.childCount = archipelago.child_count
+    population.survivorCount = archipelago.survivor_count
+
+    history = []
+    interval = archipelago.interval
+    for generation in xrange(1, generations + 1):
+        population.gen()
+        history.append(population.best().fitness())
+
+        if interval and generation % interval == 0 and generation < generations:
+            emigrants = archipelago.emigrants(population)
+            for target in targets:
+                inboxes[target].put(emigrants)
+
+            immigrants = []
+            for i in xrange(source_count):
+                try:
+                    immigrants.extend(inboxes[index].get(timeout=archipelago.timeout))
+                except Queue.Empty:
+                    raise IslandException("No immigrants arrived after generation %i." %
+                                          generation)
+            archipelago.migrate(population, immigrants)
+
+    return IslandResult(index, archipelago.emigrants(population), history)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -12,9 +12,38 @@ for the following organism-level mutations:
  * TimbreExchange - randomly swap two instrument parts
 """
 
-from random import choice, randint
+from random import choice, randint, random
+from math import floor, log
 from collections import deque
-import operator
+import Numeric
+from registry import mutators
+
+def skip_sample(count, probability):
+    """
+    Generate, in increasing order, the positions in range(count) that are
+    selected when each position is selected independently with the given
+    probability.  Rather than drawing a random number for every position, the
+    number of positions skipped before the next selected one is drawn from a
+    geometric distribution, so the cost is proportional to the number of
+    selected positions.
+
+    @param int count
+    @param float probability
+    """
+    if probability <= 0:
+        return
+    if probability >= 1:
+        for index in xrange(count):
+            yield index
+        return
+
+    log_q = log(1.0 - probability)
+    index = -1
+    while True:
+        index += 1 + int(floor(log(1.0 - random()) / log_q))
+        if index >= count:
+            return
+        yield index
 
 class Mutator(object):
     """
@@ -54,6 +83,7 @@ class Mutator(object):
         """
         raise Exception("The mutate method must be overridden") 
         
+@mutators.register()
 class ClassicMutator(Mutator):
     """
     Perform simple, classic mutation on a randomly selected gene
@@ -62,6 +92,10 @@ class ClassicMutator(Mutator):
 
     mutationImpact = "SMALL"
 
+    # Whether to draw the gap to the next mutated gene instead of drawing a
+    # random number for each gene when conditionally mutating all genes.
+    skipSampling = True
+
     def __repr__(self):
         return "ClassicMutator"
     
@@ -79,16 +113,60 @@ class ClassicMutator(Mutator):
             # Choose random row and column.
             rowIndex = randint(0, self.organism.instrument_length - 1)
             columnIndex = randint(0, self.organism.length - 1)
-            gene = self.organism.genes[rowIndex][columnIndex].toscalar()
-            gene.mutate()
+            self.organism.mutateGene(rowIndex, columnIndex)
+        elif self.skipSampling:
+            # Mutate each gene with the gene's mutation probability, visiting
+            # only the genes that are mutated.
+            length = self.organism.length
+            for index in skip_sample(self.organism.instrument_length * length,
+                                     self.organism.gene.mutProb):
+                self.organism.mutateGene(index / length, index % length)
         else:
             # Conditionally mutate all genes.
-            for row in self.organism.genes:
-                for gene in row:
-                    gene.maybeMutate()
+            for rowIndex in xrange(self.organism.instrument_length):
+                for columnIndex in xrange(self.organism.length):
+                    self.organism.maybeMutateGene(rowIndex, columnIndex)
                 
         return self.organism
 
+    def mutateBatch(cls, species, genomes, indices):
+        """
+        Mutate the given genomes of a population array in place, mutating each
+        gene with the gene's mutation probability and its mutate method.
+        Genomes that are not given are left alone:
+
+        >>> import benchmark
+        >>> from pattern import PatternGene, PackedPatternOrganism
+        >>> species = benchmark.configure(PackedPatternOrganism, 8, 4)
+        >>> PatternGene.mutProb = 0.5
+        >>> genomes = Numeric.zeros((6, 4, 8), Numeric.UnsignedInt8)
+        >>> ClassicMutator.mutateBatch(species, genomes, [1, 4])
+        >>> [genomes[i].tolist() == [[0] * 8] * 4 for i in (0, 2, 3, 5)]
+        [True, True, True, True]
+
+        @param class species the population's organism class
+        @param array genomes (organisms x instruments x length) genome array
+        @param list indices the genomes to mutate
+        """
+        if species.mutateOneOnly:
+            for index in indices:
+                cls(species.fromGenes(genomes[index])).mutate()
+            return
+
+        # Sample only the genes of the given genomes, so the cost is
+        # proportional to the number of mutated genes, and mutate each of
+        # them on its own.
+        gene = species.gene
+        cells = Numeric.shape(genomes)[1] * Numeric.shape(genomes)[2]
+        positions = [int(indices[position / cells]) * cells + position % cells
+                     for position in skip_sample(len(indices) * cells, gene.mutProb)]
+        if len(positions) > 0:
+            values = Numeric.take(Numeric.ravel(genomes), positions)
+            Numeric.put(genomes, positions,
+                        [gene.mutatedValue(int(value)) for value in values])
+    mutateBatch = classmethod(mutateBatch)
+
+@mutators.register()
 class InvertMutator(Mutator):
     """
     Invert the values of an organism's genes by swapping silence for noise and 
@@ -148,16 +226,17 @@ class InvertMutator(Mutator):
             instruments = xrange(self.organism.instrument_length)
         
         for instrument in instruments:
-            row = self.organism.genes[instrument].tolist()
-            for gene in row:
-                if gene.value > self.minValue:
-                    gene.value = self.minValue
+            row = self.organism.getRow(instrument)
+            for column in xrange(len(row)):
+                if row[column] > self.minValue:
+                    row[column] = self.minValue
                 else:
-                    gene.value = self.maxValue
-            self.organism.genes[instrument] = row
+                    row[column] = self.maxValue
+            self.organism.setRow(instrument, row)
 
         return self.organism
         
+@mutators.register()
 class ReverseMutator(Mutator):
     """
     Reverse the order of beats in one or more instrument rows.
@@ -199,12 +278,13 @@ class ReverseMutator(Mutator):
             instruments = xrange(self.organism.instrument_length)
 
         for instrument in instruments:
-            row = self.organism.genes[instrument].tolist()
+            row = self.organism.getRow(instrument)
             row.reverse()
-            self.organism.genes[instrument] = row
+            self.organism.setRow(instrument, row)
         
         return self.organism
         
+@mutators.register()
 class RotateMutator(Mutator):
     """
     Rotate one or more instrument rows to the right by a specified or random 
@@ -275,12 +355,13 @@ class RotateMutator(Mutator):
             instruments = xrange(self.organism.instrument_length)
 
         for instrument in instruments:
-            row = self.organism.genes[instrument]
+            row = self.organism.getRow(instrument)
             row = row[self.rotateAmount:] + row[:self.rotateAmount]
-            self.organism.genes[instrument] = row
+            self.organism.setRow(instrument, row)
 
         return self.organism
 
+@mutators.register()
 class TimbreExchangeMutator(Mutator):
     """
     Exchange instrument parts between two randomly selected instruments.
@@ -309,9 +390,14 @@ class TimbreExchangeMutator(Mutator):
             instrument2 = randint(0, self.organism.instrument_length - 1)
 
         # Exchange instrument rows
-        row1 = self.organism.genes[instrument1].tolist()
-        row2 = self.organism.genes[instrument2].tolist()
-        self.organism.genes[instrument1] = row2
-        self.organism.genes[instrument2] = row1
+        row1 = self.organism.getRow(instrument1)
+        row2 = self.organism.getRow(instrument2)
+        self.organism.setRow(instrument1, row2)
+        self.organism.setRow(instrument2, row1)
 
         return self.organism
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
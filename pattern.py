@@ -8,17 +8,22 @@ Represents all elements population of organisms:
  * Population
 """
 import Numeric
+import RandomArray
 import copy
+import heapq
 import time
-from random import random, choice
+from random import random, choice, randint
 from pygene.gene import IntGene
 from pygene.organism import Organism
 from pygene.population import Population
 from fitness import *
 from mutator import *
-from hydrogen import savePatternToXml
-from fitbeat_project.fitbeats.functions import similarity
-import pisa
+from genome import GENOME_TYPECODE, copy_genes, gene_values, genome_key, is_packed
+from registry import compile_fitness_plan, mutators
+from diversity import SIMILARITY, diversity_interval
+from evaluator import evaluate_genomes
+from timing import SELECT, PAIR, MATE, MUTATE, EVALUATE, SORT, WAIT, READ, \
+     ARCHIVE, WRITE, OTHER
 
 
 class PatternGene(IntGene):
@@ -35,10 +40,44 @@ class PatternGene(IntGene):
         else:
             return cmp(this.value, other.value)
 
+    def mutatedValue(cls, value):
+        """
+        Mutate a gene value the way the gene's mutate method does, for
+        genomes that store plain integers instead of genes.
+
+        @param int value
+        @return int the mutated value
+        """
+        gene = cls()
+        gene.value = value
+        gene.mutate()
+        return gene.value
+    mutatedValue = classmethod(mutatedValue)
+
 
 class PatternOrganism(Organism):
     mutProb = 0.02
     crossoverRate = 0.9
+    _fitnessPlan = None
+    _mutatorPlan = None
+
+    # Whether the genome may be shared with copies of this organism.
+    _sharedGenes = False
+
+    # Whether fitness is updated from the genes changed since the last
+    # evaluation when the fitness functions support it.
+    deltaEvaluation = True
+
+    # Partial fitness values from the last evaluation and the original values
+    # of the genes changed since then.
+    _fitnessState = None
+    _changes = None
+
+    # Fitness cache shared by every organism, see cache.FitnessCache.
+    fitness_cache = None
+
+    # Objective values evaluated outside of the organism, see setObjectives.
+    _objectives = None
     
     def __init__(self, **kw):
         self.genes = Numeric.array([[self.gene() 
@@ -83,6 +122,14 @@ class PatternOrganism(Organism):
             raise IndexError("""Request key %i is greater than the length 
                               of the object: %i""" % (key.start, length))
 
+        if isinstance(key, slice):
+            self._write(columns=range(length)[key])
+        else:
+            self._write(columns=[key])
+
+        if not is_packed(self.genes):
+            # Give this organism its own copy of the assigned gene objects.
+            value = copy.deepcopy(value)
         self.genes[:, key] = value
     
     def fitness(self):
@@ -93,21 +140,109 @@ class PatternOrganism(Organism):
         except:
             pass
 
-        trajectory_set = self.trajectory_set
-        n = len(trajectory_set)
+        objectives = self.objectives()
+        n = len(objectives)
         fitness = 0
 
         if n == 0:
             return fitness
 
-        # Calculate fitness for each trajectory
-        for trajectory in trajectory_set:
-            fitness_function = eval(trajectory.function.name)
-            fitness += fitness_function(self, trajectory)
+        # Average the fitness of each trajectory
+        for objective in objectives:
+            fitness += objective
 
         self._fitness = float(fitness) / n
         return self._fitness
 
+    def objectives(self):
+        """
+        Calculate the fitness of the organism for each trajectory, using the
+        shared fitness cache when one is configured.
+
+        @return tuple
+        """
+        if self._objectives is not None:
+            return self._objectives
+
+        cache = self.fitness_cache
+        if cache is None:
+            return self.evaluateObjectives()
+
+        key = genome_key(self.genes)
+        objectives = cache.get(key)
+        if objectives is None:
+            objectives = cache.put(key, self.evaluateObjectives())
+        return objectives
+
+    def setObjectives(self, objectives):
+        """
+        Set the fitness of the organism for each trajectory after evaluating
+        it elsewhere, such as with an evaluator.
+
+        @param tuple objectives
+        """
+        if self.fitness_cache is not None:
+            self.fitness_cache.put(genome_key(self.genes), objectives)
+        self._objectives = objectives
+        self._fitness = None
+
+    def evaluated(self):
+        """
+        @return boolean whether the organism's fitness is known
+        """
+        return self._objectives is not None or \
+               getattr(self, '_fitness', None) is not None
+
+    def evaluateObjectives(self):
+        """
+        Evaluate each trajectory.  Fitness functions that keep partial values
+        are updated from the genes changed since the last evaluation, unless
+        more than half of the genes have changed.
+
+        @return tuple the fitness of the organism for each trajectory
+        """
+        fitness_plan = self.fitnessPlan()
+        state = None
+        changes = None
+        if self._fitnessState is not None and self._fitnessState[0] is fitness_plan:
+            changes = self.changedCells()
+            if len(changes) * 2 <= self.length * self.instrument_length:
+                state = self._fitnessState[1]
+
+        objectives = []
+        partial_values = []
+        for i in xrange(len(fitness_plan)):
+            fitness_function, trajectory = fitness_plan[i]
+            partials = None
+
+            if state is not None and state[i] is not None:
+                fitness, partials = fitness_function.delta(self, trajectory,
+                                                           state[i], changes)
+            elif self.deltaEvaluation and hasattr(fitness_function, 'partials'):
+                fitness, partials = fitness_function.partials(self, trajectory)
+            else:
+                fitness = fitness_function(self, trajectory)
+
+            objectives.append(fitness)
+            partial_values.append(partials)
+
+        if self.deltaEvaluation:
+            self._fitnessState = (fitness_plan, partial_values)
+            self._changes = {}
+
+        return tuple(objectives)
+
+    def changedCells(self):
+        """
+        @return list (row, column, original value) for each gene whose beat
+                     has changed since the organism's fitness was evaluated
+        """
+        cells = []
+        for (row, column), value in self._changes.items():
+            if (self.getGene(row, column) > 0) != (value > 0):
+                cells.append((row, column, value))
+        return cells
+
     def mate(self, partner):
         """
         Mate this organism with another using the organism's crossover method. 
@@ -123,11 +258,15 @@ class PatternOrganism(Organism):
 
     def copy(self):
         """
-        Perform copy as parent would but make sure fitness value is cleared.
+        Copy the organism without copying its genome.  The organism and its
+        copy share the genome, and the fitness value that goes with it, until
+        either of them writes to the genome.
         """
-        #copy = self.__class__(**genes)
-        self_copy = copy.deepcopy(self)
-        self_copy._fitness = None
+        self_copy = self.__class__.__new__(self.__class__)
+        self_copy.__dict__.update(self.__dict__)
+        self._sharedGenes = self_copy._sharedGenes = True
+        if self._changes is not None:
+            self_copy._changes = self._changes.copy()
         return self_copy
 
     def mutate(self):
@@ -137,13 +276,15 @@ class PatternOrganism(Organism):
         organism.
         """
         mutant = self.copy()
-        fitness = self.fitness()
         
         # If random value meets mutation probability, then mutate!
         if len(self.mutators) > 0 and random() < self.mutProb:
+            if self.limit_mutation:
+                fitness = self.fitness()
+
             # choose a random mutator
             while True:
-                mutator = eval(choice(self.mutators))
+                mutator = choice(self.mutatorPlan())
                 operator = mutator(mutant)
                 #mutator, args = mutatorSet
                 #operator = mutator(mutant, **args)
@@ -162,15 +303,186 @@ class PatternOrganism(Organism):
             mutant = operator.mutate()
         
         return mutant
+
+    def compile(cls):
+        """
+        Resolve the fitness functions and mutators of the organism once, when
+        a run starts, instead of on every call.
+        """
+        cls._fitnessPlan = (cls.trajectory_set,
+                            compile_fitness_plan(cls.trajectory_set))
+        cls._mutatorPlan = (cls.mutators, mutators.resolveAll(cls.mutators))
+    compile = classmethod(compile)
+
+    def fitnessPlan(cls):
+        """
+        @return list (fitness function, trajectory) pairs for the organism's
+                     trajectory set
+        """
+        if cls._fitnessPlan is None or cls._fitnessPlan[0] is not cls.trajectory_set:
+            cls.compile()
+        return cls._fitnessPlan[1]
+    fitnessPlan = classmethod(fitnessPlan)
+
+    def mutatorPlan(cls):
+        """
+        @return list the mutator classes named by the organism's mutators
+        """
+        if cls._mutatorPlan is None or cls._mutatorPlan[0] is not cls.mutators:
+            cls.compile()
+        return cls._mutatorPlan[1]
+    mutatorPlan = classmethod(mutatorPlan)
         
+    def _write(self, rows=(), columns=(), cells=()):
+        """
+        Prepare the genome to be written to.  A genome shared with copies of
+        the organism is copied first, and the fitness value is cleared.  The
+        original values of the rows, columns and (row, column) cells about to
+        be written are recorded for incremental fitness evaluation.
+        """
+        if self._sharedGenes:
+            self.genes = copy_genes(self.genes)
+            self._sharedGenes = False
+        self._fitness = None
+        self._objectives = None
+
+        if self._fitnessState is not None:
+            changes = self._changes
+            for row in rows:
+                for column in xrange(self.length):
+                    if not changes.has_key((row, column)):
+                        changes[(row, column)] = self.getGene(row, column)
+            for column in columns:
+                for row in xrange(self.instrument_length):
+                    if not changes.has_key((row, column)):
+                        changes[(row, column)] = self.getGene(row, column)
+            for row, column in cells:
+                if not changes.has_key((row, column)):
+                    changes[(row, column)] = self.getGene(row, column)
+
+    def getGene(self, row, column):
+        """
+        @return int the value of a single gene
+        """
+        return self.genes[row][column].value
+
+    def getRow(self, row):
+        """
+        @param int row
+        @return list the gene values of an instrument row
+        """
+        return [gene.value for gene in self.genes[row].tolist()]
+
+    def setRow(self, row, values):
+        """
+        Set the gene values of an instrument row.
+
+        @param int row
+        @param list values
+        """
+        self._write(rows=[row])
+        genes = self.genes[row]
+        for column in xrange(len(values)):
+            genes[column].value = values[column]
+
+    def setGene(self, row, column, value):
+        """
+        Set the value of a single gene.
+        """
+        self._write(cells=[(row, column)])
+        self.genes[row][column].value = value
+
+    def mutateGene(self, row, column):
+        """
+        Unconditionally mutate a single gene.
+        """
+        self._write(cells=[(row, column)])
+        self.genes[row][column].mutate()
+
+    def maybeMutateGene(self, row, column):
+        """
+        Mutate a single gene with the gene's mutation probability.
+        """
+        if random() < self.gene.mutProb:
+            self.mutateGene(row, column)
+
     def xmlDump(self, fileobject):
+        from hydrogen import savePatternToXml
         savePatternToXml(self, fileobject, False)
 
     def xmlDumps(self):
+        from hydrogen import savePatternToXml
         song = savePatternToXml(self, None, True)
         return song.toxml()
 
 
+class PackedPatternOrganism(PatternOrganism):
+    """
+    Pattern Organism that stores its genome as a packed array of integer beat
+    values instead of an array of PatternGene objects.  Genes are read and
+    written as plain integers and copying a genome is a single array copy.
+    """
+    def __init__(self, **kw):
+        gene = self.gene
+        self.genes = Numeric.array([[randint(gene.randMin, gene.randMax)
+                                     for i in xrange(self.length)]
+                                    for j in xrange(self.instrument_length)],
+                                   GENOME_TYPECODE)
+
+    def fromGenes(cls, genes, fitness=None):
+        """
+        Create an organism around an existing genome without copying it.  Any
+        changes made to the organism are made to the given genome.
+
+        @param array genes
+        @param float fitness the genome's fitness, if it is already known
+        """
+        organism = cls.__new__(cls)
+        organism.genes = genes
+        organism._fitness = fitness
+        return organism
+    fromGenes = classmethod(fromGenes)
+
+    def getGene(self, row, column):
+        return self.genes[row, column]
+
+    def getRow(self, row):
+        return self.genes[row].tolist()
+
+    def setRow(self, row, values):
+        self._write(rows=[row])
+        self.genes[row] = values
+
+    def setGene(self, row, column, value):
+        self._write(cells=[(row, column)])
+        self.genes[row, column] = value
+
+    def mutateGene(self, row, column):
+        """
+        Unconditionally mutate a single gene with the gene's mutate method,
+        like PatternOrganism does.
+
+        >>> import benchmark, random
+        >>> species = benchmark.configure(PackedPatternOrganism, 8, 4)
+        >>> organism = species()
+        >>> for value in (0, 1, 0, 1):
+        ...     organism.setGene(0, 0, value)
+        ...     random.seed(value)
+        ...     organism.mutateGene(0, 0)
+        ...     random.seed(value)
+        ...     gene = PatternGene()
+        ...     gene.value = value
+        ...     gene.mutate()
+        ...     print organism.getGene(0, 0) == gene.value
+        True
+        True
+        True
+        True
+        """
+        self._write(cells=[(row, column)])
+        self.genes[row, column] = self.gene.mutatedValue(int(self.genes[row, column]))
+
+
 class MultiObjectivePatternOrganism(PatternOrganism):
     """
     Pattern Organism that treats fitness as a vector of objective values
@@ -179,12 +491,7 @@ class MultiObjectivePatternOrganism(PatternOrganism):
     def fitness(self):
         # Evaluate the fitness once.
         if not hasattr(self, '_fitness') or self._fitness is None:
-            self._fitness = []
-            if len(self.trajectory_set) > 0:
-                # Evaluate each trajectory.
-                for trajectory in self.trajectory_set:
-                    fitness_function = eval(trajectory.function.name)
-                    self._fitness.append(fitness_function(self, trajectory))
+            self._fitness = list(self.objectives())
         return self._fitness
         
     def mutate(self):
@@ -193,41 +500,203 @@ class MultiObjectivePatternOrganism(PatternOrganism):
         if len(self.mutators) > 0 and random() < self.mutProb:
             # TODO: Mutators should handle mutation with a static method.
             # Choose a random mutator.
-            mutator = eval(choice(self.mutators))
+            mutator = choice(self.mutatorPlan())
             operator = mutator(mutant)
             mutant = operator.mutate()
 
         return mutant
 
 
+class MultiObjectivePackedPatternOrganism(PackedPatternOrganism,
+                                          MultiObjectivePatternOrganism):
+    """
+    Multiobjective Pattern Organism with a packed genome.
+    """
+    pass
+
+
+def evaluate_organisms(evaluator, organisms):
+    """
+    Evaluate every organism whose fitness is not known yet with an evaluator,
+    see evaluator.SerialEvaluator.  Genomes found in the fitness cache are not
+    evaluated again and each distinct genome is evaluated once.
+
+    @param SerialEvaluator evaluator
+    @param list organisms
+    """
+    pending = {}
+    for organism in organisms:
+        if organism.evaluated():
+            continue
+
+        key = genome_key(organism.genes)
+        cache = organism.fitness_cache
+        if cache is not None and not pending.has_key(key):
+            objectives = cache.get(key)
+            if objectives is not None:
+                organism.setObjectives(objectives)
+                continue
+        pending.setdefault(key, []).append(organism)
+
+    if len(pending) == 0:
+        return
+
+    groups = pending.values()
+    genomes = Numeric.array([gene_values(group[0].genes) for group in groups],
+                            GENOME_TYPECODE)
+    evaluated = evaluator.evaluate(genomes)
+    for j in xrange(len(groups)):
+        objectives = tuple([objective[j] for objective in evaluated])
+        for organism in groups[j]:
+            organism.setObjectives(objectives)
+
+
+def distinct_pairs(keys, count):
+    """
+    Choose count pairs of parents from a list of parent genome keys.  The
+    first parent of each pair is chosen at random and the second at random
+    from the parents whose genome differs from the first's.  Parents are
+    grouped into classes of equal genomes so the second parent is drawn
+    directly from the other classes.  If every parent has the same genome,
+    the second parent is chosen at random from all parents.
+
+    @param list keys the genome key of each parent, see genome.genome_key
+    @param int count
+    @return list (first, second) pairs of indices into keys
+    """
+    classes = {}
+    for i in xrange(len(keys)):
+        classes.setdefault(keys[i], []).append(i)
+
+    # Order the parents by class so the parents of every other class form
+    # the ranges before and after the class's own range.
+    ordered = []
+    offsets = {}
+    for key, members in classes.items():
+        offsets[key] = len(ordered)
+        ordered.extend(members)
+
+    total = len(keys)
+    pairs = []
+    for c in xrange(count):
+        first = randint(0, total - 1)
+        size = len(classes[keys[first]])
+        if size == total:
+            second = randint(0, total - 1)
+        else:
+            index = randint(0, total - size - 1)
+            if index >= offsets[keys[first]]:
+                index += size
+            second = ordered[index]
+        pairs.append((first, second))
+
+    return pairs
+
+
 class PatternPopulation(Population):
     """
     Contains and manages a population of 2 dimensional patterns (arrays).
     """    
-    def diversity(self, n=10):
+    # The number of organisms kept after each generation, or None to keep
+    # every child and parent.
+    survivorCount = None
+
+    # Evaluator for organisms whose fitness is not known, see evaluator.py,
+    # or None to let organisms evaluate themselves.
+    evaluator = None
+
+    # Timer for the phases of each generation, see timing.PhaseTimer, or
+    # None to disable timing.
+    timer = None
+
+    def sort(self):
         """
-        Calculate the diversity of the top n organisms in the population.
+        Order the organisms from best to worst fitness.
         """
-        similarities = []
-        
-        for i in xrange(n - 1):
-            g1 = [y.value for x in self.organisms[i].genes.tolist() for y in x]
-            
-            for j in xrange(i+1, n):
-                g2 = [y.value for x in self.organisms[j].genes.tolist() for y in x]
-                s = similarity(g1, g2)
-                similarities.append(s)
-                
-        total = sum(similarities)
-        length = len(similarities)
-        diversity = total / length
-        
-        return diversity
+        if not self.sorted:
+            self.setSurvivors(self.organisms, len(self.organisms))
+
+    def setSurvivors(self, organisms, count):
+        """
+        Keep the count fittest organisms ordered from best to worst fitness.
+        Each organism's fitness is computed once and the organisms are ordered
+        by those values, selecting only the fittest when some are dropped.
+        The fitness values are kept in the same order as the organisms.
+
+        The survivors have the same fitness values as the first organisms of
+        a full sort:
+
+        >>> from benchmark import configure
+        >>> species = configure(PackedPatternOrganism, 8, 4)
+        >>> population = PatternPopulation(init=20, species=species)
+        >>> organisms = list(population.organisms)
+        >>> population.setSurvivors(organisms, 7)
+        >>> population.fitnesses == [organism.fitness() for organism in sorted(organisms)[:7]]
+        True
+        >>> population.setSurvivors(organisms, 20)
+        >>> population.fitnesses == [organism.fitness() for organism in sorted(organisms)]
+        True
+
+        @param list organisms
+        @param int count
+        """
+        timer = self.timer
+        if self.evaluator is not None:
+            evaluate_organisms(self.evaluator, organisms)
+
+        keys = [organism.fitness() for organism in organisms]
+        if timer is not None:
+            timer.lap(EVALUATE)
+
+        indices = xrange(len(organisms))
+        if count < len(organisms):
+            order = heapq.nsmallest(count, indices, key=keys.__getitem__)
+        else:
+            order = sorted(indices, key=keys.__getitem__)
+
+        self.organisms = [organisms[i] for i in order]
+        self.fitnesses = [keys[i] for i in order]
+        self.sorted = True
+        if timer is not None:
+            timer.lap(SORT)
+
+    def fitness(self):
+        """
+        @return float the average fitness of the population
+        """
+        self.sort()
+        return sum(self.fitnesses) / float(len(self.fitnesses))
+
+    def diversity(self, n=10, measure=SIMILARITY, samples=None):
+        """
+        Calculate the diversity of the top n organisms in the population, or
+        of every organism if n is None.
+
+        @param int n
+        @param string measure diversity.SIMILARITY or diversity.DISTANCE
+        @param int samples estimate diversity from this many random pairs
+        """
+        return self.diversityInterval(n, measure, samples)[0]
+
+    def diversityInterval(self, n=10, measure=SIMILARITY, samples=None):
+        """
+        @return tuple the diversity (see diversity) and its lower and upper
+                      confidence bounds, which equal the diversity unless it
+                      is estimated from samples
+        """
+        genomes = Numeric.array([gene_values(organism.genes)
+                                 for organism in self.organisms[:n]],
+                                GENOME_TYPECODE)
+        return diversity_interval(genomes, measure, samples)
         
     def gen(self, nfittest=None, nchildren=None):
         """
         Executes a generation of the population.
         """
+        timer = self.timer
+        if timer is not None:
+            timer.lap(OTHER)
+
         # Add new random organisms, if required
         if self.numNewOrganisms:
             for i in xrange(self.numNewOrganisms):
@@ -236,47 +705,381 @@ class PatternPopulation(Population):
         # Select n individuals to be parents
         parents = self.selector.select(self.organisms, self.childCount)
         children = []
+        if timer is not None:
+            timer.lap(SELECT)
         
-        for i in xrange(self.childCount):
-            # Choose first parent
-            parent1 = parent2 = choice(parents)
-        
-            # Choose second parent not equal to first parent
-            maxwait = 400
-            i = 0
-            while parent1.genes.tolist() == parent2.genes.tolist():
-                if i > maxwait:
-                    # Try another random set of parents if the first one didn't work.
-                    parent1 = parent2 = choice(parents)
-                parent2 = choice(parents)
-                i += 1
+        # Pair each parent with a parent whose genome differs
+        keys = [genome_key(parent.genes) for parent in parents]
+        pairs = distinct_pairs(keys, self.childCount)
+        if timer is not None:
+            timer.lap(PAIR)
+
+        for index1, index2 in pairs:
+            parent1 = parents[index1]
+            parent2 = parents[index2]
         
             # Reproduce
             child1, child2 = parent1 + parent2
+            if timer is not None:
+                timer.lap(MATE)
 
             # Mutate children
             child1 = child1.mutate()
             child2 = child2.mutate()
+            if timer is not None:
+                timer.lap(MUTATE)
         
             children.extend([child1, child2])
 
         children.extend(parents)
-        children.sort()
 
         # Set parents and children as the new population
-        self.organisms = children
+        self.setSurvivors(children, self.survivorCount or len(children))
+        if timer is not None:
+            timer.endGeneration()
+
+    def worst(self):
+        self.sort()
+        return self.organisms[-1]
+
+
+class TensorPatternPopulation(Population):
+    """
+    Population of packed patterns whose genomes are stored together in a single
+    (organisms x instruments x length) array with a matching fitness vector.
+    Selection, crossover, mutation and evaluation operate on whole batches of
+    genomes at once.
+
+    Organisms handed out by the population are views onto the genome array.
+    Mutation is applied without regard to the limit_mutation setting because
+    children are mutated before they are evaluated.
+    """
+    # The number of organisms kept after each generation, or None to keep
+    # every child and parent.
+    survivorCount = None
+
+    # Evaluator for batches of genomes, see evaluator.py, or None to evaluate
+    # them in this process.
+    evaluator = None
+
+    # Timer for the phases of each generation, see timing.PhaseTimer, or
+    # None to disable timing.
+    timer = None
+
+    species = PackedPatternOrganism
+
+    def __init__(self, *items, **kwargs):
+        if kwargs.has_key('species'):
+            self.species = kwargs['species']
+
+        if kwargs.has_key('init'):
+            init = self.initPopulation = kwargs['init']
+        else:
+            init = self.initPopulation
+
+        if kwargs.has_key('childCount'):
+            self.childCount = kwargs['childCount']
+
+        self.genomes = self.randomGenomes(init)
+        self.fitnesses = self.evaluate(self.genomes)
+        self.sort()
+        self.add(*items)
+
+    def __len__(self):
+        return Numeric.shape(self.genomes)[0]
+
+    def __getitem__(self, index):
+        return self.organism(index)
+
+    def _organisms(self):
+        return [self.organism(i) for i in xrange(len(self))]
+    organisms = property(_organisms)
+
+    def organism(self, index):
+        """
+        @param int index
+        @return PackedPatternOrganism a view onto the genome at the given index
+        """
+        return self.species.fromGenes(self.genomes[index],
+                                      self.fitnesses[index])
+
+    def add(self, *args):
+        """
+        Add organisms or lists of organisms to the population.
+        """
+        genomes = []
+        for arg in args:
+            if isinstance(arg, list) or isinstance(arg, tuple):
+                genomes.extend([organism.genes for organism in arg])
+            elif isinstance(arg, Organism):
+                genomes.append(arg.genes)
+
+        if len(genomes) > 0:
+            genomes = Numeric.array([gene_values(genes) for genes in genomes],
+                                    GENOME_TYPECODE)
+            self.extend(genomes, self.evaluate(genomes))
+
+    def extend(self, genomes, fitnesses):
+        """
+        Append already evaluated genomes to the population.
+        """
+        self.genomes = Numeric.concatenate((self.genomes, genomes))
+        self.fitnesses = Numeric.concatenate((self.fitnesses, fitnesses))
+        self.sorted = False
+
+    def sort(self):
+        """
+        Order the genomes from best to worst fitness.
+        """
+        order = Numeric.argsort(self.fitnesses)
+        self.genomes = Numeric.take(self.genomes, order)
+        self.fitnesses = Numeric.take(self.fitnesses, order)
+        self.sorted = True
+
+    def best(self):
+        if not self.sorted:
+            self.sort()
+        return self.organism(0)
 
     def worst(self):
-        return max(self)
+        if not self.sorted:
+            self.sort()
+        return self.organism(len(self) - 1)
+
+    def fitness(self):
+        """
+        @return float the average fitness of the population
+        """
+        return Numeric.add.reduce(self.fitnesses) / len(self)
+
+    def diversity(self, n=10, measure=SIMILARITY, samples=None):
+        """
+        Calculate the diversity of the top n organisms in the population, or
+        of every organism if n is None.
+
+        @param int n
+        @param string measure diversity.SIMILARITY or diversity.DISTANCE
+        @param int samples estimate diversity from this many random pairs
+        """
+        return self.diversityInterval(n, measure, samples)[0]
+
+    def diversityInterval(self, n=10, measure=SIMILARITY, samples=None):
+        """
+        @return tuple the diversity (see diversity) and its lower and upper
+                      confidence bounds, which equal the diversity unless it
+                      is estimated from samples
+        """
+        if not self.sorted:
+            self.sort()
+
+        return diversity_interval(self.genomes[:n], measure, samples)
+
+    def randomGenomes(self, count):
+        """
+        @param int count
+        @return array count random genomes
+        """
+        species = self.species
+        gene = species.gene
+        shape = (count, species.instrument_length, species.length)
+        return RandomArray.randint(gene.randMin, gene.randMax + 1,
+                                   shape).astype(GENOME_TYPECODE)
+
+    def evaluate(self, genomes):
+        """
+        Calculate the fitness of a batch of genomes.
+
+        @param array genomes
+        @return array the fitness of each genome
+        """
+        objectives = self.objectives(genomes)
+        fitnesses = Numeric.zeros(Numeric.shape(genomes)[0], Numeric.Float)
+
+        if len(objectives) == 0:
+            return fitnesses
+
+        for objective in objectives:
+            fitnesses = fitnesses + objective
+
+        return fitnesses / len(objectives)
+
+    def objectives(self, genomes):
+        """
+        Calculate the fitness of a batch of genomes for each trajectory.  When
+        the species has a fitness cache, only genomes missing from the cache
+        are evaluated and each distinct genome is evaluated once.
+
+        @param array genomes
+        @return list an array of fitness values for each trajectory
+        """
+        cache = self.species.fitness_cache
+        if cache is None:
+            return self.evaluateObjectives(genomes)
+
+        count = Numeric.shape(genomes)[0]
+        keys = [genome_key(genomes[i]) for i in xrange(count)]
+        values = [cache.get(key) for key in keys]
+
+        missing = {}
+        for i in xrange(count):
+            if values[i] is None and not missing.has_key(keys[i]):
+                missing[keys[i]] = i
+
+        if len(missing) > 0:
+            indices = missing.values()
+            evaluated = self.evaluateObjectives(Numeric.take(genomes, indices))
+            for j in xrange(len(indices)):
+                key = keys[indices[j]]
+                missing[key] = cache.put(key, tuple([objective[j]
+                                                     for objective in evaluated]))
+
+            for i in xrange(count):
+                if values[i] is None:
+                    values[i] = missing[keys[i]]
+
+        return [Numeric.array([value[t] for value in values], Numeric.Float)
+                for t in xrange(len(self.species.fitnessPlan()))]
+
+    def evaluateObjectives(self, genomes):
+        """
+        Evaluate each trajectory for a batch of genomes with the population's
+        evaluator or, without one, in this process.  See
+        evaluator.evaluate_genomes.
+
+        @param array genomes
+        @return list an array of fitness values for each trajectory
+        """
+        if self.evaluator is not None:
+            return self.evaluator.evaluate(genomes)
+        return evaluate_genomes(genomes, self.species.fitnessPlan())
+
+    def pair(self, parents, count):
+        """
+        Choose count pairs of parents, preferring pairs of distinct genomes.
+
+        @param array parents indices of the selected parents
+        @param int count
+        @return tuple arrays with the indices of the first and second parents
+        """
+        parents = parents.tolist()
+        keys = [self.genomes[i].tostring() for i in parents]
+        first = []
+        second = []
+        for index1, index2 in distinct_pairs(keys, count):
+            first.append(parents[index1])
+            second.append(parents[index2])
+
+        return (Numeric.array(first, Numeric.Int),
+                Numeric.array(second, Numeric.Int))
+
+    def mate(self, first, second):
+        """
+        Mate pairs of parents with the species' crossover operator.  Pairs that
+        do not cross over are copied unchanged.
+
+        @return array the children of every pair
+        """
+        species = self.species
+        crossing = Numeric.less(RandomArray.random(len(first)),
+                                species.crossoverRate)
+        crossing_indices = Numeric.nonzero(crossing)
+        copying_indices = Numeric.nonzero(Numeric.logical_not(crossing))
+
+        children = [species.crossover.mateBatch(self.genomes,
+                                                Numeric.take(first, crossing_indices),
+                                                Numeric.take(second, crossing_indices)),
+                    Numeric.take(self.genomes, Numeric.take(first, copying_indices)),
+                    Numeric.take(self.genomes, Numeric.take(second, copying_indices))]
+        return Numeric.concatenate(children)
+
+    def mutate(self, genomes):
+        """
+        Mutate a batch of genomes in place.  Each genome is mutated by a random
+        mutator with the species' mutation probability.  Mutators with a batch
+        form mutate all of their genomes at once.
+        """
+        species = self.species
+        mutator_plan = species.mutatorPlan()
+        if len(mutator_plan) == 0:
+            return
+
+        batches = {}
+        mutating = Numeric.less(RandomArray.random(Numeric.shape(genomes)[0]),
+                                species.mutProb)
+        for i in Numeric.nonzero(mutating).tolist():
+            mutator = choice(mutator_plan)
+            if hasattr(mutator, 'mutateBatch'):
+                batches.setdefault(mutator, []).append(i)
+            else:
+                mutator(species.fromGenes(genomes[i])).mutate()
+
+        for mutator, indices in batches.items():
+            mutator.mutateBatch(species, genomes, indices)
+
+    def gen(self, nfittest=None, nchildren=None):
+        """
+        Executes a generation of the population.
+        """
+        timer = self.timer
+        if timer is not None:
+            timer.lap(OTHER)
+
+        # Add new random organisms, if required
+        if self.numNewOrganisms:
+            genomes = self.randomGenomes(self.numNewOrganisms)
+            self.extend(genomes, self.evaluate(genomes))
+            if timer is not None:
+                timer.lap(EVALUATE)
+
+        # Select parents, mate them and mutate their children
+        parents = self.selector.selectIndices(self.fitnesses, self.childCount)
+        if timer is not None:
+            timer.lap(SELECT)
+        first, second = self.pair(parents, self.childCount)
+        if timer is not None:
+            timer.lap(PAIR)
+        children = self.mate(first, second)
+        if timer is not None:
+            timer.lap(MATE)
+        self.mutate(children)
+        if timer is not None:
+            timer.lap(MUTATE)
+        fitnesses = self.evaluate(children)
+        if timer is not None:
+            timer.lap(EVALUATE)
+
+        # Set parents and children as the new population
+        self.genomes = Numeric.concatenate((children,
+                                            Numeric.take(self.genomes, parents)))
+        self.fitnesses = Numeric.concatenate((fitnesses,
+                                              Numeric.take(self.fitnesses, parents)))
+        self.sort()
+        if self.survivorCount:
+            self.genomes = self.genomes[:self.survivorCount]
+            self.fitnesses = self.fitnesses[:self.survivorCount]
+        if timer is not None:
+            timer.lap(SORT)
+            timer.endGeneration()
 
 
 class DictPopulation(Population):
+    # Evaluator for organisms whose fitness is not known, see evaluator.py,
+    # or None to let organisms evaluate themselves.
+    evaluator = None
+
+    # Timer for the phases of each generation, see timing.PhaseTimer, or
+    # None to disable timing.
+    timer = None
+
     def __init__(self, childCount, selector, *items, **kwargs):
         self.max_id = 0
         self.organisms = {}
         self.childCount = childCount
         self.selector = selector
 
+        if kwargs.has_key('evaluator'):
+            self.evaluator = kwargs['evaluator']
+
         if kwargs.has_key('species'):
             species = self.species = kwargs['species']
         else:
@@ -314,29 +1117,45 @@ class DictPopulation(Population):
     def worst(self):
         return min(self.organisms.values())
 
-    def diversity(self, n=10):
+    def diversity(self, n=10, measure=SIMILARITY, samples=None):
+        """
+        Calculate the diversity of the first n organisms added to the
+        population, or of every organism if n is None.
+
+        >>> from benchmark import configure
+        >>> species = configure(PackedPatternOrganism, 8, 4)
+        >>> population = DictPopulation(2, None, init=6, species=species)
+        >>> 0.0 <= population.diversity(4) <= 1.0
+        True
+
+        @param int n
+        @param string measure diversity.SIMILARITY or diversity.DISTANCE
+        @param int samples estimate diversity from this many random pairs
         """
-        Calculate the diversity of the top n organisms in the population.
+        return self.diversityInterval(n, measure, samples)[0]
+
+    def diversityInterval(self, n=10, measure=SIMILARITY, samples=None):
         """
-        similarities = []
-        
-        for i in xrange(n - 1):
-            g1 = [y.value for x in self.organisms[i].genes.tolist() for y in x]
-            
-            for j in xrange(i+1, n):
-                g2 = [y.value for x in self.organisms[j].genes.tolist() for y in x]
-                s = similarity(g1, g2)
-                similarities.append(s)
-                
-        total = sum(similarities)
-        length = len(similarities)
-        diversity = total / length
-        
-        return diversity
+        @return tuple the diversity (see diversity) and its lower and upper
+                      confidence bounds, which equal the diversity unless it
+                      is estimated from samples
+        """
+        keys = self.organisms.keys()
+        keys.sort()
+        genomes = Numeric.array([gene_values(self.organisms[key].genes)
+                                 for key in keys[:n]],
+                                GENOME_TYPECODE)
+        return diversity_interval(genomes, measure, samples)
 
 
 class MultiObjectiveDictPopulation(DictPopulation):
+    """
+    Population whose selection is made by a PISA selector process.  The pisa
+    module is imported when the population is used, so single objective runs
+    do not load it.
+    """
     def __init__(self, pisa_prefix, pisa_period, dimensions, *items, **kwargs):
+        import pisa
         self.pisa_prefix = pisa_prefix
         self.pisa_period = pisa_period
         self.pisa_files = {}
@@ -359,6 +1178,8 @@ class MultiObjectiveDictPopulation(DictPopulation):
         super(MultiObjectiveDictPopulation, self).__init__(*items, **kwargs)
 
         # Write initial population into init pop file
+        if self.evaluator is not None:
+            evaluate_organisms(self.evaluator, self.organisms.values())
         fitnesses = [[key] + org.fitness() for key, org in self.organisms.items()]
         pisa.write_file(self.pisa_files['initial_population'], fitnesses, self.pisa_parameters['dim'])
 
@@ -366,12 +1187,18 @@ class MultiObjectiveDictPopulation(DictPopulation):
         pisa.write_file(self.pisa_files['state'], pisa.STATE_1)
 
     def __del__(self):
+        import pisa
         if hasattr(self, 'state') and self.state != pisa.STATE_4:
             # Write 6 to state file
             pisa.write_file(self.pisa_files['state'], pisa.STATE_6)
  
     def gen(self, nfittest=None, nchildren=None):
         """Executes a generation of the population."""
+        import pisa
+        timer = self.timer
+        if timer is not None:
+            timer.lap(OTHER)
+
         # If state is 4, return False. If state is 2, process selector output.
         # Otherwise, read state file every n seconds where n is the poll time.
         while True:
@@ -386,6 +1213,8 @@ class MultiObjectiveDictPopulation(DictPopulation):
                 #print "Waiting for selector\n"
                 time.sleep(self.pisa_period)
                 continue
+        if timer is not None:
+            timer.lap(WAIT)
 
         # Load sample from sample file.
         #print "Read sample file\n"
@@ -393,15 +1222,19 @@ class MultiObjectiveDictPopulation(DictPopulation):
         
         # Load archive from archive file.
         archive = pisa.read_data_file(self.pisa_files['archive'])
+        if timer is not None:
+            timer.lap(READ)
 
         # Clean up local population based on archive contents.
         ids = self.organisms.keys()
         for id in ids:
             if id not in archive:
                 del(self.organisms[id])
+        if timer is not None:
+            timer.lap(ARCHIVE)
     
         # Pair up and mate parents from sample with mutation.
-        offspring = {}
+        children = []
         for i in xrange(self.pisa_parameters['lambda']):
             # Choose the first parent.
             parent_index_1 = parent_index_2 = choice(sample)
@@ -410,14 +1243,27 @@ class MultiObjectiveDictPopulation(DictPopulation):
             while parent_index_1 == parent_index_2:
                 parent_index_2 = choice(sample)
 
+            if timer is not None:
+                timer.lap(SELECT)
+
             # Reproduce and mutate.
-            children = self.organisms[parent_index_1] + self.organisms[parent_index_2]
-            child = choice(children)
-            child = child.mutate()
+            child = choice(self.organisms[parent_index_1] + self.organisms[parent_index_2])
+            if timer is not None:
+                timer.lap(MATE)
+            children.append(child.mutate())
+            if timer is not None:
+                timer.lap(MUTATE)
 
-            # Calculate fitness and add child.
+        # Calculate fitness and add children.
+        if self.evaluator is not None:
+            evaluate_organisms(self.evaluator, children)
+
+        offspring = {}
+        for child in children:
             offspring[self.max_id] = child.fitness()
             self.add(child)
+        if timer is not None:
+            timer.lap(EVALUATE)
 
         # Write offspring to offspring file
         pisa.write_file(self.pisa_files['offspring'], offspring, 
@@ -428,3 +1274,11 @@ class MultiObjectiveDictPopulation(DictPopulation):
         
         # Save the sample.
         self.sample = sample
+        if timer is not None:
+            timer.lap(WRITE)
+            timer.endGeneration()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
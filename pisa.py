@@ -1,4 +1,5 @@
 """Lower level method to support the PISA variator interface."""
+from random import randint
 
 files = {
          "configuration": "cfg", 
@@ -136,3 +137,96 @@ def write_configuration_file(filename, data):
     for key in order:
         f.write("%s %s\n" % (key, data[key]))
     f.close()
+
+def read_population_file(filename, dimensions):
+    """
+    Read an initial population or offspring file, whose first line is the
+    number of values rather than the number of individuals.
+
+    @param string filename
+    @param int dimensions the number of objective values of each individual
+    @return dict the objective values of each individual by id
+    """
+    f = open(filename)
+    try:
+        tokens = f.read().split()
+    finally:
+        f.close()
+
+    if len(tokens) < 2 or tokens[-1] != "END":
+        raise CorruptedDataException("File %s is empty or improperly formatted." % filename)
+
+    expected_number_of_elements = int(tokens[0])
+    values = tokens[1:-1]
+    if len(values) != expected_number_of_elements or \
+       len(values) % (dimensions + 1) != 0:
+        raise CorruptedDataException("File %s does not contain the expected number of values.  Expected %s values, found %s." % (filename, expected_number_of_elements, len(values)))
+
+    data = {}
+    for i in xrange(0, len(values), dimensions + 1):
+        data[int(values[i])] = map(float, values[i + 1:i + dimensions + 1])
+
+    f = open(filename, "w")
+    try:
+        f.write("0")
+    finally:
+        f.close()
+
+    return data
+
+
+class LocalSelector(object):
+    """
+    Stand-in for a PISA selector process that runs in the variator's process
+    so the variator can be tested and benchmarked without a selector binary.
+    It keeps the alpha individuals with the smallest sum of objective values
+    and samples mu parents from them by binary tournament.  It is not a
+    multiobjective selector like SPEA2.
+    """
+    def __init__(self, prefix):
+        """
+        @param string prefix the prefix of the PISA files
+        """
+        self.files = {}
+        for key, value in files.items():
+            self.files[key] = "%s%s" % (prefix, value)
+        self.parameters = read_configuration_file(self.files['configuration'])
+        self.population = {}
+
+    def step(self):
+        """
+        Select the archive and sample if the variator is waiting for them.
+
+        @return int the state of the PISA run after the step
+        """
+        state = read_state_file(self.files['state'])
+        dimensions = self.parameters['dim']
+        if state == STATE_1:
+            self.population.update(read_population_file(self.files['initial_population'],
+                                                        dimensions))
+        elif state == STATE_3:
+            self.population.update(read_population_file(self.files['offspring'],
+                                                        dimensions))
+        else:
+            return state
+
+        self.select()
+        write_file(self.files['state'], STATE_2)
+        return STATE_2
+
+    def select(self):
+        population = self.population
+        ranked = population.keys()
+        ranked.sort(lambda a, b: cmp(sum(population[a]), sum(population[b])))
+        archive = ranked[:self.parameters['alpha']]
+        for id in ranked[len(archive):]:
+            del population[id]
+
+        # Archive members are ordered by rank, so the smaller of two random
+        # positions wins each tournament.
+        count = len(archive)
+        sample = [archive[min(randint(0, count - 1), randint(0, count - 1))]
+                  for i in xrange(self.parameters['mu'])]
+
+        write_file(self.files['archive'], archive)
+        write_file(self.files['sample'], sample)
@@ -5,19 +5,24 @@ pisa_beats.py
 Evolves a pattern of beats based on a collection of user-defined fitness
 trajectories.  The genetic algorithm is based on the pygene library.
 
+Patterns are loaded from the database, or from a run spec file exported with
+--export-spec (see spec.py), in which case Django and the database are not
+needed.
+
 @author John Huddleston
 """
-import os
 import sys
 import pickle
-os.environ['DJANGO_SETTINGS_MODULE'] = "fitbeat_project.settings"
 
 from random import choice, random
 from optparse import OptionParser
-from pattern import PatternGene, MultiObjectivePatternOrganism, MultiObjectiveDictPopulation
-from fitbeat_project.fitbeats.models import *
-from selector import RouletteSelector, TournamentSelector, NewRouletteSelector
-from crossover import OnePointCrossover
+from pattern import MultiObjectivePatternOrganism, MultiObjectivePackedPatternOrganism, MultiObjectiveDictPopulation
+from registry import selectors
+from spec import RunSpec, SpecException, pattern_models
+from snapshot import SnapshotCache, load_spec
+from cache import FitnessCache
+from evaluator import make_evaluator
+from timing import PhaseTimer, BEST, STATS
 
 def main(pattern_id=None):
     if pattern_id:
@@ -25,7 +30,7 @@ def main(pattern_id=None):
     else:
         return_best = False
     
-    usage = "usage: %prog [-p] [[options] pattern_id]"
+    usage = "usage: %prog [-p] [[options] pattern_id | --spec FILE [options]]"
     parser = OptionParser(usage)
     parser.add_option("-f", "--prefix",
                       dest="pisa_prefix", type="string", default="PISA_",
@@ -52,11 +57,45 @@ def main(pattern_id=None):
     parser.add_option("-p",
                       dest="list_patterns", action="store_true", default=False,
                       help="list available patterns and their ids")
+    parser.add_option("--spec",
+                      dest="spec", type="string", default=None,
+                      help="evolve the pattern of a run spec file instead of a\
+                            pattern in the database")
+    parser.add_option("--export-spec",
+                      dest="export_spec", type="string", default=None,
+                      help="write the pattern's run spec to this file and exit")
+    parser.add_option("--no-snapshots",
+                      dest="use_snapshots", action="store_false", default=True,
+                      help="always read the pattern from the database instead of\
+                            its run spec snapshot, which is kept in the\
+                            FITBEATS_SNAPSHOTS directory")
+    parser.add_option("-k", "--packed",
+                      dest="packed", action="store_true", default=False,
+                      help="store organism genomes as packed integer arrays")
+    parser.add_option("-c", "--cache-size",
+                      dest="cache_size", type="int", default=10000,
+                      help="the number of genome fitness values to cache, or 0 to\
+                            disable the fitness cache")
+    parser.add_option("-j", "--processes",
+                      dest="processes", type="int", default=0,
+                      help="the number of processes that evaluate fitness, or 0\
+                            to evaluate each organism when it is needed")
+    parser.add_option("--chunk-size",
+                      dest="chunk_size", type="int", default=32,
+                      help="the number of genomes sent to an evaluation process\
+                            at once")
+    parser.add_option("--timing",
+                      dest="timing", action="store_true", default=False,
+                      help="time the phases of each generation")
+    parser.add_option("--timing-report",
+                      dest="timing_report", type="string", default=None,
+                      help="write the timing report to this JSON file\
+                            (implies --timing)")
     
     (options, args) = parser.parse_args()
     
     if options.list_patterns:
-        patterns = Pattern.objects.all()
+        patterns = pattern_models().Pattern.objects.all()
         print "Id | Dimensions | Name"
         print "----------------------"
         for p in patterns:
@@ -69,6 +108,9 @@ def main(pattern_id=None):
             except:
                 pass
         sys.exit()
+    elif options.spec:
+        if args:
+            parser.error("A pattern id cannot be used with --spec.")
     elif pattern_id is None and len(args) != 1:
         parser.error("""You must supply a pattern id as an argument or use the
                       -p flag to list the available patterns.""")
@@ -79,54 +121,66 @@ def main(pattern_id=None):
             parser.error("You must supply an integer value for the pattern id.")
     
     try:
-        pattern = Pattern.objects.get(pk=pattern_id)
-    except Pattern.DoesNotExist:
-        print "Error: could not load pattern %s" % pattern_id
+        if options.spec:
+            spec = RunSpec.load(options.spec)
+        else:
+            cache = None
+            if options.use_snapshots:
+                cache = SnapshotCache()
+            spec = load_spec(pattern_id, cache)
+    except SpecException, e:
+        print "Error: %s" % e
         sys.exit(1)
-    
-    selector = eval(pattern.selector.get_short_name())
-    crossover = eval(pattern.crossover.get_short_name())
-    mutators = ["%sMutator" % m.name for m in pattern.mutators.all()]
-    
-    trajectory_set = pattern.fitnesstrajectory_set.all()
-    for trajectory in trajectory_set:
-        trajectory.calculate_trajectory()
 
-    parameters = dict([(parameter.name, parameter.value) for parameter in pattern.parameters.all()])
+    if options.export_spec:
+        spec.save(options.export_spec)
+        if not options.quiet:
+            print "Wrote %s" % options.export_spec
+        sys.exit()
+
+    if options.database_dump and spec.pattern_id is None:
+        parser.error("The run spec has no pattern id to dump the best pattern to.")
     
-    # Prepare gene
-    PatternGene.mutProb = parameters['gene_mutation_probability']
+    selector = selectors.resolve(spec.selector)
+    mutators = spec.mutators
+    trajectory_set = spec.trajectories
+    parameters = spec.parameters
     
     # Prepare organism
-    MultiObjectivePatternOrganism.mutProb = parameters['organism_mutation_probability']
-    MultiObjectivePatternOrganism.crossoverRate = parameters['organism_crossover_rate']
-    MultiObjectivePatternOrganism.instrument_length = pattern.instrument_length
-    MultiObjectivePatternOrganism.instruments = pattern.instruments.all()
-    MultiObjectivePatternOrganism.length = pattern.length
-    MultiObjectivePatternOrganism.crossover = crossover()
-    MultiObjectivePatternOrganism.mutators = mutators
-    MultiObjectivePatternOrganism.limit_mutation = options.limit_mutation
-    MultiObjectivePatternOrganism.trajectory_set = trajectory_set
-    MultiObjectivePatternOrganism.gene = PatternGene
+    if options.packed:
+        species = MultiObjectivePackedPatternOrganism
+    else:
+        species = MultiObjectivePatternOrganism
+    spec.configure(species, options.limit_mutation)
+    if options.cache_size > 0:
+        species.fitness_cache = FitnessCache(options.cache_size)
     
     # Prepare population
     dimensions = len(trajectory_set)
     childCount = int(parameters['population_new_children'])
-    selector=selector()
+    selector=selector(**spec.selector_parameters)
     initial_population_size = int(parameters['population_initial_size'])
+    if options.processes > 0:
+        evaluator = make_evaluator(species, options.processes, options.chunk_size)
+    else:
+        evaluator = None
     ph = MultiObjectiveDictPopulation(options.pisa_prefix, options.pisa_period, dimensions,
                                       childCount, selector, init=initial_population_size,
-                                      species=MultiObjectivePatternOrganism)
+                                      species=species, evaluator=evaluator)
     max_generations = int(parameters['population_max_generations'])
+
+    timer = None
+    if options.timing or options.timing_report:
+        timer = ph.timer = PhaseTimer()
     
     if not options.quiet:
-        print "Pattern Length: %i" % pattern.length
+        print "Pattern Length: %i" % spec.length
         print "Instruments:"
-        for i in pattern.instruments.all():
+        for i in spec.instruments:
             print "\t%s" % i
         print "Generations: %i" % max_generations
-        print "Selector: %s" % pattern.selector.name
-        print "Crossover: %s" % pattern.crossover.name
+        print "Selector: %s" % spec.selector
+        print "Crossover: %s" % spec.crossover
         print "Mutators:\n\t%s" % "\n\t".join(mutators)
         print "Fitness Trajectories:"
         for t in trajectory_set:
@@ -155,6 +209,8 @@ def main(pattern_id=None):
     
         try:
             b = ph.best()
+            if timer is not None:
+                timer.lap(BEST)
             
             if not options.quiet:
                 print "generation %i:\n%s best=%s)" % (i, 
@@ -170,6 +226,8 @@ def main(pattern_id=None):
             fhandle = open(options.statfile, "w")
             pickle.dump(webstats, fhandle)
             fhandle.close()
+            if timer is not None:
+                timer.lap(STATS)
             
             if b.fitness() <= 0:
                 break
@@ -180,11 +238,17 @@ def main(pattern_id=None):
             break
 
     if options.database_dump:
-        p = PatternInstance(pattern=pattern,
-                            fitness=b.fitness(),
-                            value=b.xmlDumps())
+        p = pattern_models().PatternInstance(pattern_id=spec.pattern_id,
+                                             fitness=b.fitness(),
+                                             value=b.xmlDumps())
         p.save()
     
+    if evaluator is not None:
+        evaluator.close()
+
+    if options.timing_report:
+        timer.write(options.timing_report)
+
     if webstats:
         webstats['is_done'] = True
         fhandle = open(options.statfile, "w")
@@ -194,6 +258,10 @@ def main(pattern_id=None):
     if not options.quiet:
         for p in ph.sample:
             print ph[p]
+        if species.fitness_cache is not None:
+            print "Fitness cache: %(hits)i hits, %(misses)i misses, %(size)i entries" % species.fitness_cache.stats()
+        if timer is not None:
+            print timer
     
     # Store new statistics data
     #fileHandle = open(options.statfile, 'w')
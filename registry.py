@@ -0,0 +1,143 @@
+"""
+registry.py
+
+Name registries for fitness functions and evolutionary operators.
+
+Patterns refer to fitness functions, mutators, selectors and crossovers by
+name.  Each registry maps those names to the functions or classes that
+implement them so names are resolved once when a run starts instead of on
+every call.  Functions and classes register themselves with a decorator:
+
+    @fitness_functions.register('unison', 'fUnison')
+    def unison(individual, ft):
+        ...
+
+Names are compared without spaces, so "Timbre ExchangeMutator" and
+"TimbreExchangeMutator" resolve to the same mutator.
+"""
+
+
+class RegistryException(Exception):
+    pass
+
+
+class Registry(object):
+    """
+    Maps names to registered functions or classes.
+    """
+    def __init__(self, kind, module):
+        """
+        @param string kind what the registry contains, for error messages
+        @param string module the module whose import registers the entries
+        """
+        self.kind = kind
+        self.module = module
+        self._entries = {}
+
+    def __contains__(self, name):
+        self._load()
+        return self._entries.has_key(self.normalize(name))
+
+    def normalize(self, name):
+        return name.replace(" ", "")
+
+    def register(self, *names):
+        """
+        Decorator that registers a function or class under the given names or,
+        if no names are given, under its own name.
+        """
+        def decorator(obj):
+            self.add(obj, *names)
+            return obj
+        return decorator
+
+    def add(self, obj, *names):
+        if len(names) == 0:
+            names = (obj.__name__,)
+
+        for name in names:
+            self._entries[self.normalize(name)] = obj
+
+    def names(self):
+        self._load()
+        names = self._entries.keys()
+        names.sort()
+        return names
+
+    def resolve(self, name):
+        """
+        @param string name
+        @return mixed the function or class registered under the given name
+        """
+        self._load()
+        try:
+            return self._entries[self.normalize(name)]
+        except KeyError:
+            raise RegistryException("Unknown %s: %s" % (self.kind, name))
+
+    def resolveAll(self, names):
+        return [self.resolve(name) for name in names]
+
+    def _load(self):
+        if len(self._entries) == 0:
+            __import__(self.module)
+
+
+fitness_functions = Registry("fitness function", "fitness")
+mutators = Registry("mutator", "mutator")
+selectors = Registry("selector", "selector")
+crossovers = Registry("crossover", "crossover")
+
+
+def batch_form(function):
+    """
+    Decorator that registers a batch kernel for a fitness function.  The
+    kernel scores an (organisms x instruments x length) genome array at once
+    and must return the same values as the function itself.
+
+    @param function function the registered fitness function
+    """
+    def decorator(kernel):
+        function.batch = kernel
+        return kernel
+    return decorator
+
+def partial_form(function):
+    """
+    Decorator that registers the partial form of a fitness function.  The
+    partial form takes the same arguments as the function and returns the
+    fitness together with the partial values (such as per-row or per-column
+    beat counts) it was computed from.
+
+    @param function function the registered fitness function
+    """
+    def decorator(partials):
+        function.partials = partials
+        return partials
+    return decorator
+
+def delta_form(function):
+    """
+    Decorator that registers the delta form of a fitness function.  The delta
+    form takes an organism, a trajectory, the partial values of the organism's
+    last evaluation and a list of (row, column, original value) for each gene
+    whose beat has changed since then.  It returns the new fitness and partial
+    values, which must equal those of the partial form.  The given partial
+    values may be shared with other organisms and must not be modified.
+
+    @param function function the registered fitness function
+    """
+    def decorator(delta):
+        function.delta = delta
+        return delta
+    return decorator
+
+def compile_fitness_plan(trajectory_set):
+    """
+    Resolve the fitness function of each trajectory.
+
+    @param list trajectory_set
+    @return list (fitness function, trajectory) pairs
+    """
+    return [(fitness_functions.resolve(trajectory.function.name), trajectory)
+            for trajectory in trajectory_set]
@@ -2,13 +2,27 @@
 Selector classes implementing various selection algorithms
 """
 import sys
+import Numeric
+import RandomArray
 from random import choice, randint, shuffle, random
+from registry import selectors
 
 class Selector(object):
     """
     Abstract base selection object contains standard methods 
     """
 
+    def __init__(self, **parameters):
+        """
+        @param dict parameters values for the selector's parameters, such as
+                               those of a Selector model, by name
+        """
+        for name, value in parameters.items():
+            if not hasattr(self.__class__, name):
+                raise Exception("Unknown parameter for %s: %s" %
+                                (self.__class__.__name__, name))
+            setattr(self, name, value)
+
     def select(self, organisms=None, n=None):
         """
         @param list organisms a list of organisms from which individuals are 
@@ -18,125 +32,283 @@ class Selector(object):
         """
         raise Exception("select method is not implemented.")
 
+    def selectIndices(self, fitnesses, n):
+        """
+        Select individuals by their fitness values alone.  Selectors that
+        only need fitness values can use this method on populations that
+        store their organisms as arrays.
+
+        @param array fitnesses the fitness value of each individual
+        @param int n number of individuals to select
+        @return array the indices of the selected individuals
+        """
+        candidates = [IndexedCandidate(i, fitness)
+                      for i, fitness in enumerate(fitnesses.tolist())]
+        selected = self.select(candidates, n)
+        return Numeric.array([candidate.index for candidate in selected],
+                             Numeric.Int)
+
+class IndexedCandidate(object):
+    """
+    Stand-in for an organism that only knows its position in a population and
+    its fitness value.
+    """
+    def __init__(self, index, fitness):
+        self.index = index
+        self._fitness = fitness
+
+    def __cmp__(self, other):
+        return cmp(self.fitness(), other.fitness())
+
+    def fitness(self):
+        return self._fitness
+
+@selectors.register()
 class TournamentSelector(Selector):
     """
+    Selects the best of tournament_size random organisms for each pick.  The
+    contestants of a tournament are drawn with replacement unless replacement
+    is false.
     """
-    
+    tournament_size = 5
+    replacement = True
+
     def select(self, organisms, n):
-        tournament_size = 5
-        candidates = []
-        for i in xrange(n):
-            # Choose x random organisms
-            tournament_candidates = [choice(organisms) for i in xrange(tournament_size)]
-            best_candidate = tournament_candidates[0]
+        fitnesses = Numeric.array([organism.fitness() for organism in organisms],
+                                  Numeric.Float)
+        return [organisms[i] for i in self.selectIndices(fitnesses, n).tolist()]
 
-            # Compare candidates to find the best of the group.
-            for candidate in tournament_candidates[1:]:                   
-                if candidate.fitness() < best_candidate.fitness():
-                    best_candidate = candidate
+    def selectIndices(self, fitnesses, n):
+        count = len(fitnesses)
+        size = int(self.tournament_size)
+        if self.replacement:
+            contestants = RandomArray.randint(0, count, (n, size))
+        else:
+            contestants = self.distinctContestants(count, min(size, count), n)
+        size = Numeric.shape(contestants)[1]
 
-            candidates.append(best_candidate)
+        # The winner of each tournament is its first contestant with the
+        # smallest fitness.
+        contestants = Numeric.ravel(contestants)
+        scores = Numeric.reshape(Numeric.take(fitnesses, contestants), (n, size))
+        winners = Numeric.argmin(scores, 1) + Numeric.arange(n) * size
+        return Numeric.take(contestants, winners)
 
-        return candidates
-    
-class RouletteSelector(Selector):
+    def distinctContestants(self, count, size, n):
+        """
+        Draw n tournaments of size distinct contestants each.
+
+        @param int count the number of organisms
+        @param int size
+        @param int n
+        @return array (n x size) array of organism indices
+        """
+        if size * 2 > count:
+            # Take the first contestants of a random permutation.
+            order = Numeric.argsort(RandomArray.random((n, count)), 1)
+            return order[:, :size]
+
+        # Redraw the tournaments that drew a contestant twice.
+        contestants = RandomArray.randint(0, count, (n, size))
+        while 1:
+            ordered = Numeric.sort(contestants, 1)
+            repeated = Numeric.nonzero(Numeric.sometrue(
+                Numeric.equal(ordered[:, 1:], ordered[:, :-1]), 1))
+            if len(repeated) == 0:
+                return contestants
+
+            for i in repeated.tolist():
+                contestants[i] = RandomArray.randint(0, count, (size,))
+
+class AliasTable(object):
     """
-    Based on the algorithm presented by Holland (1975) and Goldberg (1989b)
+    Samples indices in proportion to their weights with Vose's alias method.
+    Building the table takes O(n) time and each draw takes O(1) time.
     """
-    
-    def select(self, organisms, n):
-        # Evaluate the fitness of each organism
-        organism_count = len(organisms)
-        shuffle(organisms)
-        fitnesses = [organism.fitness() for organism in organisms]
-        f_total = sum(fitnesses)
-        
-        # Invert fitness so smallest fitnesses have the most weight.
-        f_inv = [f_total / f for f in fitnesses]
-        f_inv_total = sum(f_inv)
-
-        # Calculate selection probability of inverted fitnesses.
-        p = [f_inv_i / f_inv_total for f_inv_i in f_inv]
-        
-        # Calculate the cumulative selection probability.
-        p_total = 0
-        q = []
-        for p_i in p:
-            p_total += p_i
-            q.append(p_total)
-
-        
-        # Select candidates for reproduction
-        organism_range = xrange(1, organism_count)
-        candidates = []
-        for c in xrange(n):
-            # Select r in (0, 1]
-            r = 0
-            while r == 0:
-                r = random()
-
-            if r < q[0]:
-                i = 0
+    def __init__(self, weights):
+        """
+        @param list weights non-negative weights with a positive sum
+        """
+        count = len(weights)
+        total = float(sum(weights))
+        scaled = [weight * count / total for weight in weights]
+
+        self.count = count
+        self.probability = [1.0] * count
+        self.alias = range(count)
+
+        small = [i for i in xrange(count) if scaled[i] < 1.0]
+        large = [i for i in xrange(count) if scaled[i] >= 1.0]
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+
+            scaled[more] = (scaled[more] + scaled[less]) - 1.0
+            if scaled[more] < 1.0:
+                small.append(more)
             else:
-                for i in organism_range:
-                    if q[i - 1] < r <= q[i]:
-                        break
+                large.append(more)
 
-            candidates.append(organisms[i])
+    def draw(self):
+        """
+        @return int a random index
+        """
+        i = int(random() * self.count)
+        if random() < self.probability[i]:
+            return i
+        return self.alias[i]
 
-        print "Return candidates", len(candidates)
-        return candidates
+def alias_sample(weights, n):
+    """
+    @param list weights
+    @param int n
+    @return list n indices drawn independently in proportion to the weights
+    """
+    table = AliasTable(weights)
+    return [table.draw() for i in xrange(n)]
 
-class NewRouletteSelector(Selector):
+def universal_sample(weights, n):
     """
-    Based on the algorithm presented by Holland (1975) and Goldberg (1989b)
+    Stochastic universal sampling (Baker 1987): n equally spaced pointers
+    with a single random offset are laid over the cumulative weights, so each
+    index is selected within one of its expected number of times.  Indices
+    are drawn uniformly if every weight is 0.
+
+    >>> universal_sample([1.0, 2.0], 0)
+    []
+    >>> universal_sample([0.0, 0.0, 0.0], 3)
+    [0, 1, 2]
+    >>> universal_sample([0.0, 5.0, 0.0], 4)
+    [1, 1, 1, 1]
+
+    @param list weights
+    @param int n
+    @return list n indices in increasing order
     """
-    
+    if n <= 0:
+        return []
+    total = float(sum(weights))
+    if total <= 0:
+        weights = [1.0] * len(weights)
+        total = float(len(weights))
+
+    step = total / n
+    pointer = random() * step
+    indices = []
+    i = 0
+    cumulative = weights[0]
+    for c in xrange(n):
+        while cumulative <= pointer and i < len(weights) - 1:
+            i += 1
+            cumulative += weights[i]
+        indices.append(i)
+        pointer += step
+
+    return indices
+
+class ProportionalSelector(Selector):
+    """
+    Base class for fitness-proportionate selection.  Subclasses assign each
+    organism a weight from the population's fitness values; lower fitness is
+    better, so better organisms get larger weights.  Organisms are drawn with
+    an alias table or, when sampling is "universal", with stochastic
+    universal sampling.
+    """
+    sampling = "alias"
+
+    def weights(self, fitnesses):
+        """
+        @param list fitnesses the fitness value of each organism
+        @return list the selection weight of each organism
+        """
+        raise Exception("weights method is not implemented.")
+
+    def sample(self, fitnesses, n):
+        """
+        @param list fitnesses
+        @param int n
+        @return list the indices of the selected organisms
+        """
+        weights = self.weights(fitnesses)
+        if sum(weights) <= 0:
+            weights = [1.0] * len(fitnesses)
+
+        if self.sampling == "universal":
+            return universal_sample(weights, n)
+        return alias_sample(weights, n)
+
     def select(self, organisms, n):
-        # Evaluate the fitness of each organism
-        organism_count = len(organisms)
-        #shuffle(organisms)
         fitnesses = [organism.fitness() for organism in organisms]
-        f_total = sum(fitnesses)
-        
-        # Calculate selection probability of inverted fitnesses.
-        p = [f / f_total for f in fitnesses]
+        return [organisms[i] for i in self.sample(fitnesses, n)]
+
+    def selectIndices(self, fitnesses, n):
+        return Numeric.array(self.sample(fitnesses.tolist(), n), Numeric.Int)
+
+@selectors.register()
+class RouletteSelector(ProportionalSelector):
+    """
+    Based on the algorithm presented by Holland (1975) and Goldberg (1989b).
+    Each organism is selected in proportion to the inverse of its fitness.
+    Organisms with a fitness of zero are perfect and, if there are any, are
+    the only ones selected.
+
+    >>> RouletteSelector().weights([2.0, 4.0])
+    [0.5, 0.25]
+    >>> RouletteSelector().weights([2.0, 0.0, 4.0, 0.0])
+    [0.0, 1.0, 0.0, 1.0]
+    >>> fitnesses = Numeric.array([2.0, 0.0, 4.0])
+    >>> RouletteSelector().selectIndices(fitnesses, 10).tolist()
+    [1, 1, 1, 1, 1, 1, 1, 1, 1, 1]
+    >>> StochasticUniversalSelector().selectIndices(fitnesses, 3).tolist()
+    [1, 1, 1]
+    """
+    def weights(self, fitnesses):
+        perfect = [float(f == 0) for f in fitnesses]
+        if sum(perfect) > 0:
+            return perfect
 
         # Invert fitness so smallest fitnesses have the most weight.
-        p.reverse()
-
-        #print p
-        #sys.exit()
-        
-        # Calculate the cumulative selection probability.
-        p_total = 0
-        q = []
-        for p_i in p:
-            p_total += p_i
-            q.append(p_total)
-
-        
-        # Select candidates for reproduction
-        organism_range = xrange(1, organism_count)
-        candidates = []
-        for c in xrange(n):
-            # Select r in (0, 1]
-            r = 0
-            while r == 0:
-                r = random()
-
-            if r < q[0]:
-                i = 0
-            else:
-                for i in organism_range:
-                    if q[i - 1] < r <= q[i]:
-                        break
+        return [1.0 / f for f in fitnesses]
+
+@selectors.register()
+class StochasticUniversalSelector(RouletteSelector):
+    """
+    Roulette selection with stochastic universal sampling.
+    """
+    sampling = "universal"
 
-            candidates.append(organisms[i])
+@selectors.register()
+class NewRouletteSelector(ProportionalSelector):
+    """
+    Based on the algorithm presented by Holland (1975) and Goldberg (1989b).
+    Each organism is selected with the probability proportional to the
+    fitness of the organism at the mirrored position in the population, so in
+    a sorted population the best organism takes the worst one's share.
+    """
+    def weights(self, fitnesses):
+        # Invert fitness so smallest fitnesses have the most weight.
+        weights = [float(f) for f in fitnesses]
+        weights.reverse()
+        return weights
+
+@selectors.register()
+class RankSelector(ProportionalSelector):
+    """
+    Linear ranking selection.  The best of n organisms has weight n and the
+    worst has weight 1, whatever their fitness values.
+    """
+    def weights(self, fitnesses):
+        order = range(len(fitnesses))
+        order.sort(lambda a, b: cmp(fitnesses[a], fitnesses[b]))
 
-        print "Return candidates", len(candidates)
-        return candidates
+        weights = [0] * len(fitnesses)
+        for rank in xrange(len(order)):
+            weights[order[rank]] = len(order) - rank
+        return weights
 
+@selectors.register()
 class SpeaSelector(Selector):
     """
     Interfaces with the PISA-based multiobjective optimization algorithm SPEA2.
@@ -157,3 +329,8 @@ class SpeaSelector(Selector):
     
     def select(self, organisms, n):
         pass
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
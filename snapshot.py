@@ -0,0 +1,311 @@
+"""
+snapshot.py
+
+Compiled run spec snapshots of the patterns in the database.
+
+Exporting a run spec (see spec.py) reads the pattern, its parameters and
+instruments and calculates every trajectory, which takes a database round
+trip per row.  A SnapshotCache stores each exported spec as a binary
+snapshot, so later runs of the same pattern load the snapshot without
+touching the database.
+
+Snapshot files are named by a content hash of the spec, and an index file
+per pattern names the snapshot of the pattern's current configuration.
+models.py removes a pattern's index file whenever the pattern, its
+parameters or its trajectories are saved or deleted, so the next run
+exports the spec again.  Django sends no signal for changes to many to many
+relations alone, so code that changes a pattern's instruments or mutators
+saves the pattern afterwards or calls models.invalidate_snapshots.
+
+Snapshots are kept in the directory named by the FITBEATS_SNAPSHOTS
+environment variable, or in snapshots/ next to this module.  The model
+signals only invalidate that directory, so runs and the web application must
+see the same FITBEATS_SNAPSHOTS value.  A SnapshotCache created with another
+directory is never invalidated and may return stale specs.
+
+Snapshots are encoded like the specs that distributed.py sends to workers:
+trajectory values as typed network order numbers, and names as length
+prefixed strings.  Operators are stored by their registered names and
+resolved when the spec configures a species.
+"""
+import os
+import struct
+import tempfile
+from hashlib import sha1
+from distributed import encode_string, decode_string, encode_number, \
+     decode_number, encode_spec, decode_spec
+from spec import RunSpec, SpecInstrument, spec_from_database
+
+SNAPSHOT_MAGIC = "FBSS"
+SNAPSHOT_VERSION = 1
+
+# Snapshot header: magic, version and the SHA-1 digest of the spec.
+HEADER = struct.Struct("!4sH20s")
+
+SNAPSHOT_SUFFIX = ".snapshot"
+INDEX_PREFIX = "pattern-"
+
+DEFAULT_DIRECTORY = os.environ.get('FITBEATS_SNAPSHOTS',
+                                   os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                "snapshots"))
+
+
+class SnapshotException(Exception):
+    pass
+
+
+def encode_values(values):
+    """
+    @param dict values numbers by name
+    @return string
+    """
+    names = values.keys()
+    names.sort()
+    return struct.pack("!H", len(names)) + \
+           "".join([encode_string(name) + encode_number(values[name])
+                    for name in names])
+
+def decode_values(data, offset):
+    count, = struct.unpack_from("!H", data, offset)
+    offset += 2
+    values = {}
+    for i in xrange(count):
+        name, offset = decode_string(data, offset)
+        values[name], offset = decode_number(data, offset)
+    return values, offset
+
+def encode_snapshot_body(spec):
+    """
+    @param RunSpec spec
+    @return string the snapshot without its header, from which the spec's
+                   content hash is calculated
+    """
+    trajectories = encode_spec(spec.instrument_length, spec.length, spec.trajectories)
+    parts = [struct.pack("!I", len(trajectories)), trajectories]
+
+    if spec.pattern_id is None:
+        parts.append(struct.pack("!i", -1))
+    else:
+        parts.append(struct.pack("!i", spec.pattern_id))
+    parts.append(encode_string(spec.name or ""))
+
+    for instrument in spec.instruments:
+        parts.append(struct.pack("!i", instrument.sequence_number))
+        parts.append(encode_string(instrument.name) + encode_string(instrument.category))
+
+    parts.append(encode_string(spec.selector))
+    parts.append(encode_values(spec.selector_parameters))
+    parts.append(encode_string(spec.crossover))
+    parts.append(struct.pack("!H", len(spec.mutators)))
+    parts.extend([encode_string(name) for name in spec.mutators])
+    parts.append(encode_values(spec.parameters))
+    return "".join(parts)
+
+def encode_snapshot(spec):
+    """
+    @param RunSpec spec
+    @return string the snapshot of the spec
+    """
+    body = encode_snapshot_body(spec)
+    return HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, sha1(body).digest()) + body
+
+def decode_snapshot(data):
+    """
+    @param string data see encode_snapshot
+    @return tuple the spec's digest and the RunSpec
+    """
+    if len(data) < HEADER.size:
+        raise SnapshotException("Truncated snapshot.")
+    magic, version, digest = HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise SnapshotException("Unsupported snapshot version: %s %s" % (magic, version))
+    if sha1(buffer(data, HEADER.size)).digest() != digest:
+        raise SnapshotException("Corrupt snapshot.")
+
+    offset = HEADER.size
+    size, = struct.unpack_from("!I", data, offset)
+    offset += 4
+    instrument_length, length, trajectories = decode_spec(data[offset:offset + size])
+    offset += size
+
+    pattern_id, = struct.unpack_from("!i", data, offset)
+    offset += 4
+    if pattern_id < 0:
+        pattern_id = None
+    name, offset = decode_string(data, offset)
+
+    instruments = []
+    for i in xrange(instrument_length):
+        sequence_number, = struct.unpack_from("!i", data, offset)
+        instrument_name, offset = decode_string(data, offset + 4)
+        category, offset = decode_string(data, offset)
+        instruments.append(SpecInstrument(sequence_number, instrument_name, category))
+
+    selector, offset = decode_string(data, offset)
+    selector_parameters, offset = decode_values(data, offset)
+    crossover, offset = decode_string(data, offset)
+    count, = struct.unpack_from("!H", data, offset)
+    offset += 2
+    mutators = []
+    for i in xrange(count):
+        mutator, offset = decode_string(data, offset)
+        mutators.append(mutator)
+    parameters, offset = decode_values(data, offset)
+
+    return digest, RunSpec(length, instruments, selector, crossover, mutators,
+                           parameters, trajectories, selector_parameters,
+                           pattern_id, name or None)
+
+
+class SnapshotCache(object):
+    """
+    A directory of run spec snapshots and the index files that name the
+    current snapshot of each pattern.
+    """
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        self.directory = directory
+
+    def snapshotPath(self, digest):
+        return os.path.join(self.directory, digest.encode("hex") + SNAPSHOT_SUFFIX)
+
+    def indexPath(self, pattern_id):
+        return os.path.join(self.directory, "%s%i" % (INDEX_PREFIX, pattern_id))
+
+    def get(self, pattern_id):
+        """
+        @param int pattern_id
+        @return RunSpec the pattern's snapshot, or None if the pattern has no
+                        valid snapshot
+        """
+        try:
+            f = open(self.indexPath(pattern_id), "rb")
+            try:
+                filename = f.read().strip()
+            finally:
+                f.close()
+            f = open(os.path.join(self.directory, filename), "rb")
+            try:
+                data = f.read()
+            finally:
+                f.close()
+        except IOError:
+            return None
+
+        try:
+            digest, spec = decode_snapshot(data)
+        except (SnapshotException, struct.error):
+            return None
+        if os.path.basename(self.snapshotPath(digest)) != filename:
+            return None
+        return spec
+
+    def put(self, spec):
+        """
+        Store a spec's snapshot and make it the current snapshot of its
+        pattern.
+
+        @param RunSpec spec a spec with a pattern id
+        @return string the snapshot's filename
+        """
+        if spec.pattern_id is None:
+            raise SnapshotException("Only specs of patterns in the database are cached.")
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        data = encode_snapshot(spec)
+        magic, version, digest = HEADER.unpack_from(data)
+        path = self.snapshotPath(digest)
+        self._write(path, data)
+        self._write(self.indexPath(spec.pattern_id), os.path.basename(path))
+        return path
+
+    def _write(self, path, data):
+        """
+        Write a file atomically, so a run reading the cache never sees a
+        partly written file.
+        """
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory)
+        try:
+            f = os.fdopen(descriptor, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(temporary, path)
+        except:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def invalidate(self, pattern_id):
+        """
+        Forget the current snapshot of a pattern.  Its snapshot file is
+        removed unless another pattern's index names it.
+
+        @param int pattern_id
+        """
+        try:
+            f = open(self.indexPath(pattern_id), "rb")
+            try:
+                filename = f.read().strip()
+            finally:
+                f.close()
+            os.remove(self.indexPath(pattern_id))
+        except (IOError, OSError):
+            return
+
+        if filename not in self.indexedSnapshots():
+            try:
+                os.remove(os.path.join(self.directory, filename))
+            except OSError:
+                pass
+
+    def indexedSnapshots(self):
+        """
+        @return list the snapshot filenames named by the index files
+        """
+        filenames = []
+        for name in os.listdir(self.directory):
+            if name.startswith(INDEX_PREFIX):
+                try:
+                    f = open(os.path.join(self.directory, name), "rb")
+                    try:
+                        filenames.append(f.read().strip())
+                    finally:
+                        f.close()
+                except IOError:
+                    pass
+        return filenames
+
+    def clear(self):
+        """
+        Remove every snapshot and index file.
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.startswith(INDEX_PREFIX) or name.endswith(SNAPSHOT_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+
+def load_spec(pattern_id, cache=None):
+    """
+    Load a pattern's spec from its snapshot, exporting it from the database
+    and storing its snapshot if it has none.
+
+    @param int pattern_id
+    @param SnapshotCache cache None to always export the spec
+    @return RunSpec
+    """
+    if cache is not None:
+        spec = cache.get(pattern_id)
+        if spec is not None:
+            return spec
+
+    spec = spec_from_database(pattern_id)
+    if cache is not None:
+        cache.put(spec)
+    return spec
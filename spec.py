@@ -0,0 +1,243 @@
+"""
+spec.py
+
+Self-contained run specs.
+
+A run spec holds everything the evolutionary engine needs to evolve a
+pattern: its dimensions and instruments, its selector, crossover and
+mutators, its parameters and the precomputed values of its fitness
+trajectories.  Specs are exported from a pattern in the database once and
+saved as JSON files, so runs, islands and evaluation workers can start from
+a spec file on machines without Django or the database.
+
+Only spec_from_database and pattern_models use Django, and they import it
+when they are called.
+"""
+import os
+import json
+from registry import selectors, crossovers
+from evaluator import CompiledTrajectory, compile_trajectories
+
+SPEC_VERSION = 1
+
+
+class SpecException(Exception):
+    pass
+
+
+class SpecInstrument(object):
+    """
+    The parts of an instrument that organisms and song files use.
+    """
+    def __init__(self, sequence_number, name, category=""):
+        """
+        @param int sequence_number the instrument's position in the song
+                                   template
+        @param string name
+        @param string category
+        """
+        self.sequence_number = sequence_number
+        self.name = name
+        self.category = category
+
+    def __str__(self):
+        return "%i: %s (%s)" % (self.sequence_number, self.name, self.category)
+
+
+class RunSpec(object):
+    """
+    Describes a pattern and how to evolve it without referring to the
+    database.
+    """
+    def __init__(self, length, instruments, selector, crossover, mutators,
+                 parameters, trajectories, selector_parameters=None,
+                 pattern_id=None, name=None):
+        """
+        @param int length the number of beats in the pattern
+        @param list instruments SpecInstrument objects
+        @param string selector the name of a registered selector
+        @param string crossover the name of a registered crossover
+        @param list mutators the names of registered mutators
+        @param dict parameters the gene, organism and population parameters
+        @param list trajectories CompiledTrajectory objects with calculated
+                                 values
+        @param dict selector_parameters
+        @param int pattern_id the id of the pattern the spec was exported from
+        @param string name
+        """
+        self.length = length
+        self.instruments = instruments
+        self.instrument_length = len(instruments)
+        self.selector = selector
+        self.crossover = crossover
+        self.mutators = mutators
+        self.parameters = parameters
+        self.trajectories = trajectories
+        self.selector_parameters = selector_parameters or {}
+        self.pattern_id = pattern_id
+        self.name = name
+
+    def __str__(self):
+        return self.name or "Pattern spec (%ix%i)" % (self.length,
+                                                     self.instrument_length)
+
+    def configure(self, species, limit_mutation=False):
+        """
+        Configure an organism class and its gene class for the spec.
+
+        @param class species PatternOrganism or a subclass
+        @param boolean limit_mutation
+        @return class the species
+        """
+        from pattern import PatternGene
+
+        parameters = self.parameters
+        PatternGene.mutProb = parameters['gene_mutation_probability']
+        species.mutProb = parameters['organism_mutation_probability']
+        species.crossoverRate = parameters['organism_crossover_rate']
+        species.instrument_length = self.instrument_length
+        species.instruments = self.instruments
+        species.length = self.length
+        species.crossover = crossovers.resolve(self.crossover)()
+        species.mutators = list(self.mutators)
+        species.limit_mutation = limit_mutation
+        species.trajectory_set = self.trajectories
+        species.gene = PatternGene
+        species.compile()
+        return species
+
+    def selectorClass(self):
+        return selectors.resolve(self.selector)
+
+    def toDict(self):
+        """
+        @return dict the spec as JSON compatible values
+        """
+        return {'version': SPEC_VERSION,
+                'pattern_id': self.pattern_id,
+                'name': self.name,
+                'length': self.length,
+                'instruments': [{'sequence_number': instrument.sequence_number,
+                                 'name': instrument.name,
+                                 'category': instrument.category}
+                                for instrument in self.instruments],
+                'selector': {'name': self.selector,
+                             'parameters': self.selector_parameters},
+                'crossover': self.crossover,
+                'mutators': self.mutators,
+                'parameters': self.parameters,
+                'trajectories': [{'function': trajectory.function.name,
+                                  'values': trajectory.values,
+                                  'rows': trajectory.rows,
+                                  'master_row': trajectory.master_row}
+                                 for trajectory in self.trajectories]}
+
+    def fromDict(cls, data):
+        """
+        @param dict data see toDict
+        @return RunSpec
+        """
+        if data.get('version') != SPEC_VERSION:
+            raise SpecException("Unsupported run spec version: %s" % data.get('version'))
+
+        instruments = [SpecInstrument(instrument['sequence_number'],
+                                      str(instrument['name']),
+                                      str(instrument['category']))
+                       for instrument in data['instruments']]
+        trajectories = []
+        for trajectory in data['trajectories']:
+            # JSON stores tuples of values as lists.
+            values = [isinstance(value, list) and tuple(value) or value
+                      for value in trajectory['values']]
+            rows = trajectory['rows']
+            if rows is not None:
+                rows = str(rows)
+            trajectories.append(CompiledTrajectory(str(trajectory['function']),
+                                                   values, rows,
+                                                   trajectory['master_row']))
+
+        parameters = {}
+        for name, value in data['parameters'].items():
+            parameters[str(name)] = value
+        selector_parameters = {}
+        for name, value in data['selector']['parameters'].items():
+            selector_parameters[str(name)] = value
+
+        return cls(data['length'], instruments, str(data['selector']['name']),
+                   str(data['crossover']), [str(name) for name in data['mutators']],
+                   parameters, trajectories, selector_parameters,
+                   data.get('pattern_id'), data.get('name'))
+    fromDict = classmethod(fromDict)
+
+    def save(self, filename):
+        f = open(filename, "w")
+        try:
+            json.dump(self.toDict(), f, indent=1)
+        finally:
+            f.close()
+
+    def load(cls, filename):
+        """
+        @param string filename a spec file written by save
+        @return RunSpec
+        """
+        f = open(filename)
+        try:
+            try:
+                data = json.load(f)
+            except ValueError, e:
+                raise SpecException("Could not read run spec %s: %s" % (filename, e))
+        finally:
+            f.close()
+        return cls.fromDict(data)
+    load = classmethod(load)
+
+
+def spec_from_pattern(pattern):
+    """
+    Export a pattern from the database, calculating its trajectory values.
+
+    @param Pattern pattern
+    @return RunSpec
+    """
+    trajectory_set = pattern.fitnesstrajectory_set.all()
+    for trajectory in trajectory_set:
+        trajectory.calculate_trajectory()
+
+    parameters = {}
+    for parameter in pattern.parameters.all():
+        parameters[str(parameter.name)] = parameter.value
+
+    return RunSpec(pattern.length,
+                   [SpecInstrument(instrument.sequence_number, str(instrument.name),
+                                   str(instrument.category))
+                    for instrument in pattern.instruments.all()],
+                   pattern.selector.get_short_name(),
+                   pattern.crossover.get_short_name(),
+                   ["%sMutator" % mutator.name for mutator in pattern.mutators.all()],
+                   parameters,
+                   compile_trajectories(trajectory_set),
+                   pattern.selector.get_parameters(),
+                   pattern.id, str(pattern))
+
+def pattern_models():
+    """
+    Set up Django and import the fitbeats models.
+
+    @return module fitbeat_project.fitbeats.models
+    """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', "fitbeat_project.settings")
+    from fitbeat_project.fitbeats import models
+    return models
+
+def spec_from_database(pattern_id):
+    """
+    @param int pattern_id
+    @return RunSpec the spec of a pattern in the database
+    """
+    models = pattern_models()
+    try:
+        pattern = models.Pattern.objects.get(pk=pattern_id)
+    except models.Pattern.DoesNotExist:
+        raise SpecException("Could not load pattern %s" % pattern_id)
+    return spec_from_pattern(pattern)
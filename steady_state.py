@@ -0,0 +1,252 @@
+"""
+steady_state.py
+
+Asynchronous steady state evolution.
+
+Generational evolution breeds and scores a whole generation of children
+before selecting the next parents, so every worker waits for the slowest
+evaluation of the generation.  Steady state evolution instead selects one
+pair of parents at a time and inserts their children into the population as
+soon as they are scored, replacing either the worst organism or the worst of
+a random tournament.  With worker processes several pairs are bred and
+scored at once and their children are inserted in the order the workers
+finish, so no worker waits for another.  Progress is counted in evaluations
+rather than generations.
+
+Children whose genome is already in the population are not inserted, so the
+population does not fill up with copies of its best organism.
+"""
+import bisect
+import traceback
+import Queue
+import Numeric
+from random import sample
+from genome import GENOME_TYPECODE, genome_key, gene_values
+from evaluator import compile_trajectories
+from pattern import PatternPopulation, distinct_pairs
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+# Replacement strategies
+REPLACE_WORST = "worst"
+TOURNAMENT = "tournament"
+REPLACEMENTS = (REPLACE_WORST, TOURNAMENT)
+
+# The number of parents selected for each pair; the pair is drawn from
+# parents with different genomes where possible.
+PAIR_CANDIDATES = 4
+
+
+class SteadyStateException(Exception):
+    pass
+
+
+class SteadyState(object):
+    """
+    Evolves a PatternPopulation one pair of parents at a time.
+    """
+    def __init__(self, population, replacement=REPLACE_WORST, tournament_size=2,
+                 processes=0, pending=None):
+        """
+        @param PatternPopulation population a population with a selector
+        @param string replacement REPLACE_WORST replaces the worst organism
+                                  and TOURNAMENT the worst of tournament_size
+                                  random organisms, if the child is fitter
+        @param int tournament_size
+        @param int processes the number of worker processes breeding and
+                             scoring children, or 0 or 1 to breed them in
+                             this process.  Workers need a packed species.
+        @param int pending the number of pairs bred at once, by default two
+                           per worker
+        """
+        if not isinstance(population, PatternPopulation):
+            raise SteadyStateException("Steady state evolution requires a PatternPopulation.")
+        if replacement not in REPLACEMENTS:
+            raise SteadyStateException("Unknown replacement strategy: %s" % replacement)
+
+        self.population = population
+        self.replacement = replacement
+        self.tournament_size = tournament_size
+        self.evaluations = 0
+        self.inserted = 0
+
+        population.sort()
+        self.species = population.organisms[0].__class__
+        self.keys = {}
+        for organism in population.organisms:
+            key = genome_key(organism.genes)
+            self.keys[key] = self.keys.get(key, 0) + 1
+
+        self.pool = None
+        if processes > 1:
+            if multiprocessing is None:
+                raise SteadyStateException("Worker processes require the multiprocessing module.")
+            if not hasattr(self.species, 'fromGenes'):
+                raise SteadyStateException("Worker processes require a packed species.")
+
+            self.pending = pending or 2 * processes
+            self.pool = multiprocessing.Pool(processes, _initialize_worker,
+                                             (self.species,
+                                              compile_trajectories(self.species.trajectory_set)))
+
+    def run(self, evaluations, report=None, interval=None):
+        """
+        Breed children until the given number of children have been scored
+        or an organism has a perfect fitness of 0.
+
+        @param int evaluations
+        @param function report called with the number of evaluations and the
+                               population every interval evaluations
+        @param int interval
+        @return int the number of evaluations
+        """
+        population = self.population
+        last_report = self.evaluations
+        if self.pool is None:
+            results = None
+        else:
+            results = Queue.Queue()
+            for i in xrange(self.pending):
+                self.pool.apply_async(_breed, (self.parentGenomes(),),
+                                      callback=results.put)
+
+        while self.evaluations < evaluations and population.fitnesses[0] > 0:
+            if results is None:
+                children = self.breed()
+            else:
+                children = self.receive(results.get())
+                self.pool.apply_async(_breed, (self.parentGenomes(),),
+                                      callback=results.put)
+
+            for child in children:
+                self.evaluations += 1
+                if self.insert(child):
+                    self.inserted += 1
+
+            if report is not None and interval and \
+               self.evaluations - last_report >= interval:
+                last_report = self.evaluations
+                report(self.evaluations, population)
+
+        return self.evaluations
+
+    def parents(self):
+        """
+        @return tuple a pair of organisms selected by the population's
+                      selector, with different genomes where possible
+        """
+        population = self.population
+        indices = population.selector.selectIndices(
+            Numeric.array(population.fitnesses, Numeric.Float), PAIR_CANDIDATES).tolist()
+        candidates = [population.organisms[i] for i in indices]
+        first, second = distinct_pairs([genome_key(candidate.genes)
+                                        for candidate in candidates], 1)[0]
+        return candidates[first], candidates[second]
+
+    def parentGenomes(self):
+        return tuple([gene_values(parent.genes).tostring()
+                      for parent in self.parents()])
+
+    def breed(self):
+        """
+        @return list two scored children of a selected pair of parents
+        """
+        parent1, parent2 = self.parents()
+        child1, child2 = parent1 + parent2
+        children = [child1.mutate(), child2.mutate()]
+        for child in children:
+            child.fitness()
+        return children
+
+    def receive(self, result):
+        """
+        @param list result (genome bytes, objectives) of each child bred by a
+                           worker, or a worker's traceback
+        @return list the children
+        """
+        if isinstance(result, str):
+            raise SteadyStateException("Breeding failed:\n%s" % result)
+
+        species = self.species
+        children = []
+        for genome, objectives in result:
+            genes = Numeric.reshape(Numeric.fromstring(genome, GENOME_TYPECODE),
+                                    (species.instrument_length, species.length))
+            child = species.fromGenes(genes)
+            child.setObjectives(objectives)
+            children.append(child)
+        return children
+
+    def insert(self, child):
+        """
+        Replace an organism of the population with a child if the child is at
+        least as fit.  The population stays ordered from best to worst.
+
+        @param PatternOrganism child
+        @return boolean whether the child was inserted
+        """
+        key = genome_key(child.genes)
+        if self.keys.has_key(key):
+            return False
+
+        organisms = self.population.organisms
+        fitnesses = self.population.fitnesses
+        if self.replacement == REPLACE_WORST:
+            index = len(organisms) - 1
+        else:
+            # The population is ordered, so the worst contestant is the one
+            # with the largest index.
+            index = max(sample(xrange(len(organisms)),
+                               min(self.tournament_size, len(organisms))))
+
+        fitness = child.fitness()
+        if fitness > fitnesses[index]:
+            return False
+
+        replaced = genome_key(organisms[index].genes)
+        self.keys[replaced] -= 1
+        if self.keys[replaced] == 0:
+            del self.keys[replaced]
+        self.keys[key] = 1
+
+        del organisms[index]
+        del fitnesses[index]
+        position = bisect.bisect_right(fitnesses, fitness)
+        organisms.insert(position, child)
+        fitnesses.insert(position, fitness)
+        return True
+
+    def close(self):
+        """
+        Stop the worker processes.  Children still being bred are discarded.
+        """
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+
+
+# Species of a worker process.
+_species = None
+
+def _initialize_worker(species, trajectories):
+    global _species
+    _species = species
+    species.trajectory_set = trajectories
+    species.compile()
+
+def _breed(genomes):
+    try:
+        species = _species
+        parents = [species.fromGenes(Numeric.reshape(
+                       Numeric.fromstring(genome, GENOME_TYPECODE),
+                       (species.instrument_length, species.length)))
+                   for genome in genomes]
+        child1, child2 = parents[0] + parents[1]
+        return [(genome_key(child.genes), tuple(child.objectives()))
+                for child in (child1.mutate(), child2.mutate())]
+    except Exception:
+        return traceback.format_exc()
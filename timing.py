@@ -0,0 +1,159 @@
+"""
+timing.py
+
+Per-phase timing of generations.
+
+A PhaseTimer splits the time of each generation into named phases.  Code
+being timed calls lap(phase) at the end of each phase, which adds the time
+since the previous lap to that phase, and endGeneration() once a generation
+is complete.  Because every lap ends where the previous one did, the phases
+of the evolve_beats loop and of the gen method it calls partition the whole
+run without nesting.
+
+Populations have a timer attribute that is None by default; timed code
+checks it before each lap, so timing costs a single comparison per phase
+when it is disabled.
+"""
+import json
+from math import floor, log
+from timeit import default_timer
+
+# Phases of PatternPopulation.gen
+SELECT = "select"
+PAIR = "pair"
+MATE = "mate"
+MUTATE = "mutate"
+EVALUATE = "evaluate"
+SORT = "sort"
+
+# Phases of MultiObjectiveDictPopulation.gen
+WAIT = "wait"
+READ = "read"
+ARCHIVE = "archive"
+WRITE = "write"
+
+# Phases of the evolve_beats loop
+BEST = "best"
+DIVERSITY = "diversity"
+REPORT = "report"
+STATS = "stats"
+
+# Time spent outside the timed phases, such as between generations.
+OTHER = "other"
+
+# Upper bound of the first histogram bucket in seconds.  Each later bucket's
+# bound is twice the one before.
+HISTOGRAM_BASE = 1e-6
+
+
+def histogram_bucket(seconds):
+    """
+    >>> histogram_bucket(3e-6)
+    1
+
+    @param float seconds
+    @return int the histogram bucket of a duration
+    """
+    if seconds <= HISTOGRAM_BASE:
+        return 0
+    return int(floor(log(seconds / HISTOGRAM_BASE, 2)))
+
+
+class PhaseTimer(object):
+    """
+    Totals, per-generation times and histograms of the phases of a run.
+    """
+    def __init__(self, clock=default_timer):
+        """
+        @param function clock returns the current time in seconds
+        """
+        self.clock = clock
+        self.totals = {}
+        self.calls = {}
+        self.histograms = {}
+        self.generations = []
+        self.current = {}
+        self.last = clock()
+
+    def reset(self):
+        """
+        Start timing from now, dropping the time since the last lap.
+        """
+        self.last = self.clock()
+
+    def lap(self, phase):
+        """
+        Add the time since the last lap to a phase of the current generation.
+
+        @param string phase
+        """
+        now = self.clock()
+        current = self.current
+        current[phase] = current.get(phase, 0.0) + now - self.last
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+        self.last = now
+
+    def endGeneration(self):
+        """
+        Add the phases of the current generation to the totals and
+        histograms and start the next generation.
+        """
+        for phase, seconds in self.current.items():
+            self.totals[phase] = self.totals.get(phase, 0.0) + seconds
+            histogram = self.histograms.setdefault(phase, {})
+            bucket = histogram_bucket(seconds)
+            histogram[bucket] = histogram.get(bucket, 0) + 1
+        self.generations.append(self.current)
+        self.current = {}
+
+    def report(self):
+        """
+        @return dict the number of generations, the total time and, for each
+                     phase, its total, mean, minimum and maximum time per
+                     generation, the number of laps and a histogram of
+                     (bucket upper bound, generations) pairs
+        """
+        phases = {}
+        for phase, total in self.totals.items():
+            times = [generation[phase] for generation in self.generations
+                     if generation.has_key(phase)]
+            buckets = self.histograms[phase].keys()
+            buckets.sort()
+            phases[phase] = {'total': total,
+                             'mean': total / len(times),
+                             'min': min(times),
+                             'max': max(times),
+                             'calls': self.calls[phase],
+                             'histogram': [(HISTOGRAM_BASE * 2 ** (bucket + 1),
+                                            self.histograms[phase][bucket])
+                                           for bucket in buckets]}
+
+        return {'generations': len(self.generations),
+                'total': sum(self.totals.values()),
+                'phases': phases,
+                'per_generation': self.generations}
+
+    def write(self, filename):
+        """
+        Write the report to a JSON file.
+
+        @param string filename
+        """
+        f = open(filename, "w")
+        try:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        finally:
+            f.close()
+
+    def __str__(self):
+        report = self.report()
+        total = report['total'] or 1.0
+        phases = report['phases'].items()
+        phases.sort(lambda a, b: cmp(b[1]['total'], a[1]['total']))
+
+        lines = ["%i generations, %.3f s" % (report['generations'], report['total'])]
+        for phase, stats in phases:
+            lines.append("%-10s %10.3f s %6.1f%% %10.6f s/generation %8i laps" %
+                         (phase, stats['total'], 100.0 * stats['total'] / total,
+                          stats['mean'], stats['calls']))
+        return "\n".join(lines)